@@ -0,0 +1,197 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from database.archive_source import ARCHIVE_COLUMNS, ArchiveSourceRepository
+from database.compacted_raw_data_repository import raw_data_table
+from database.watermark_repository import WatermarkRepository, DOWNSAMPLED_STAGE
+from utils.logger import get_logger
+
+PARTITIONING = ds.partitioning(pa.schema([('symbol', pa.string()), ('date', pa.string())]), flavor='hive')
+
+def archive_stage(table):
+    """Watermark stage name of the archive of a table."""
+    return f'archive_{table}'
+
+def archive_tables(config):
+    """Tables of archive.tables, where raw_data stands for the raw table raw_storage selects."""
+    raw_table = raw_data_table(config)
+    tables = config.get('archive', {}).get('tables', ['raw_data', 'downsampled_data'])
+    return [raw_table if table == 'raw_data' else table for table in tables]
+
+def partition_path(root, table, symbol, day):
+    return os.path.join(root, table, f'symbol={symbol}', f'date={day:%Y-%m-%d}', 'part-0.parquet')
+
+def archive_schema(table):
+    # Timestamps are stored as int64 nanoseconds since the epoch (UTC)
+    return pa.schema([('timestamp', pa.int64())] + [(column, pa.float64()) for column in ARCHIVE_COLUMNS[table]])
+
+
+class ParquetArchiver:
+    """Exports closed days of raw and downsampled data to Parquet files.
+
+    Files are partitioned as <table>/symbol=<symbol>/date=<YYYY-MM-DD>/ and
+    every day is streamed from PostgreSQL in row groups of row_group_size rows.
+    A day is closed once the transform watermark of its symbol has passed its
+    end. The archived days are tracked per symbol and table with the
+    watermarks of the archive_<table> stages, which retention checks before
+    deleting anything. A day archived again, after a backfill moved the
+    watermark back, keeps the archived rows the table no longer holds.
+    """
+
+    def __init__(self, config, source=None, watermark_repo=None):
+        self.config = config
+        archive_config = config.get('archive', {})
+        self.root = archive_config.get('path', 'archive_data')
+        self.tables = archive_tables(config)
+        self.row_group_size = archive_config.get('row_group_size', 100000)
+        self.compression = archive_config.get('compression', 'zstd')
+        self.timescale_config = config.get('timescale', {})
+        self.source = source or ArchiveSourceRepository()
+        self.watermark_repo = watermark_repo or WatermarkRepository()
+        self.logger = get_logger(self.__class__.__name__)
+
+    def archive(self, now=None):
+        """Archive every closed day that is not archived yet and return a report."""
+        start_time = time.perf_counter()
+        symbols = self.config['symbols']
+        closed_until = self._closed_until(symbols, now)
+        report = {'files': 0, 'rows': 0, 'bytes': 0}
+        for table in self.tables:
+            archived = self.watermark_repo.get_watermarks(symbols, stage=archive_stage(table))
+            for symbol, closed in closed_until.items():
+                end_day = pd.Timestamp(closed).floor('D')
+                day = archived.get(symbol)
+                if day is None:
+                    first = self.source.first_timestamp(table, symbol)
+                    if first is None:
+                        continue
+                    day = pd.Timestamp(first).floor('D')
+                day = pd.Timestamp(day)
+                while day < end_day:
+                    rows, size = self._write_day(table, symbol, day)
+                    if rows:
+                        report['files'] += 1
+                        report['rows'] += rows
+                        report['bytes'] += size
+                    day += pd.Timedelta(days=1)
+                    # Recorded after every day so an interrupted run resumes at the next one
+                    self.watermark_repo.set_watermarks({symbol: day.to_pydatetime()}, stage=archive_stage(table))
+        report['seconds'] = time.perf_counter() - start_time
+        self.logger.info("Archived %d rows to %d files (%d bytes) in %.2fs", report['rows'], report['files'],
+                         report['bytes'], report['seconds'])
+        return report
+
+    def _closed_until(self, symbols, now):
+        if self.timescale_config.get('enabled', False):
+            # The continuous aggregate may still change within its refresh lookback
+            if now is None:
+                now = datetime.now(timezone.utc)
+            closed = pd.Timestamp(now) - pd.Timedelta(self.timescale_config.get('refresh_lookback', '1 day'))
+            return {symbol: closed for symbol in symbols}
+        return self.watermark_repo.get_watermarks(symbols, stage=DOWNSAMPLED_STAGE)
+
+    def _write_day(self, table, symbol, day):
+        path = partition_path(self.root, table, symbol, day)
+        tmp_path = path + '.tmp'
+        schema = archive_schema(table)
+        writer = None
+        rows = 0
+        chunks = self.source.iter_rows(table, symbol, day, day + pd.Timedelta(days=1), self.row_group_size)
+        if os.path.exists(path):
+            # Archived again after a backfill, rows retention already deleted are only left in the file
+            chunks = [self._merge_archived(path, table, chunks)]
+        try:
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                if writer is None:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writer = pq.ParquetWriter(tmp_path, schema, compression=self.compression)
+                arrays = [pa.array(chunk['timestamp'].values.astype('datetime64[ns]').astype('int64'))]
+                arrays += [pa.array(chunk[column].to_numpy(dtype='float64')) for column in ARCHIVE_COLUMNS[table]]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=self.row_group_size)
+                rows += len(chunk)
+        except Exception:
+            if writer is not None:
+                writer.close()
+                os.remove(tmp_path)
+            raise
+        if writer is None:
+            return 0, 0
+        writer.close()
+        # Readers never see a half-written file
+        os.replace(tmp_path, path)
+        return rows, os.path.getsize(path)
+
+    @staticmethod
+    def _merge_archived(path, table, chunks):
+        """Return the rows of chunks and the archived rows of path at other timestamps, in timestamp order."""
+        archived = pq.read_table(path).to_pandas()
+        archived['timestamp'] = pd.to_datetime(archived['timestamp'], utc=True)
+        current = pd.concat([archived.iloc[:0]] + list(chunks), ignore_index=True)
+        archived = archived[~archived['timestamp'].isin(current['timestamp'])]
+        merged = pd.concat([archived, current], ignore_index=True)
+        return merged.sort_values('timestamp', ignore_index=True)[['timestamp'] + ARCHIVE_COLUMNS[table]]
+
+
+class ArchiveReader:
+    """Reads archived rows back for backtests.
+
+    Only the partitions of the requested symbols and days are opened, the
+    timestamp range is pushed down to the row group statistics, and files are
+    memory-mapped.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def read(self, table, symbols, start, end, columns=None, as_arrays=False):
+        """Return the rows of symbols with start <= timestamp < end.
+
+        The result is a DataFrame sorted by symbol and timestamp, or with
+        as_arrays a dict of {symbol: {column: numpy array}} with int64
+        nanosecond timestamps.
+        """
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        columns = columns or ARCHIVE_COLUMNS[table]
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        start = start.tz_localize('UTC') if start.tz is None else start.tz_convert('UTC')
+        end = end.tz_localize('UTC') if end.tz is None else end.tz_convert('UTC')
+        path = os.path.join(self.root, table)
+        if not os.path.isdir(path):
+            # Nothing has been archived yet
+            fields = [archive_schema(table).field(column) for column in ['timestamp'] + list(columns)]
+            arrow_table = pa.schema([('symbol', pa.string())] + fields).empty_table()
+        else:
+            arrow_table = pq.read_table(
+                path,
+                columns=['symbol', 'timestamp'] + list(columns),
+                filters=[
+                    ('symbol', 'in', list(symbols)),
+                    ('date', '>=', f'{start:%Y-%m-%d}'),
+                    ('date', '<=', f'{end:%Y-%m-%d}'),
+                    ('timestamp', '>=', start.value),
+                    ('timestamp', '<', end.value),
+                ],
+                partitioning=PARTITIONING,
+                memory_map=True
+            ).sort_by([('symbol', 'ascending'), ('timestamp', 'ascending')])
+
+        if as_arrays:
+            symbol_column = arrow_table.column('symbol').to_numpy(zero_copy_only=False)
+            values = {column: arrow_table.column(column).to_numpy() for column in ['timestamp'] + list(columns)}
+            result = {}
+            for symbol in symbols:
+                mask = symbol_column == symbol
+                result[symbol] = {column: column_values[mask] for column, column_values in values.items()}
+            return result
+        df = arrow_table.to_pandas()
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ns', utc=True)
+        return df
@@ -0,0 +1,147 @@
+# benchmarks/bench_archive.py
+
+import argparse
+import io
+import json
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from archive.parquet_archive import ArchiveReader, ParquetArchiver
+
+
+class GeneratedArchiveSource:
+    ''' Generates one day of ticks per call in place of ArchiveSourceRepository '''
+
+    def __init__(self, start, sampling_frequency, seed=0):
+        self.start = start
+        self.sampling_frequency = sampling_frequency
+        self.rng = np.random.default_rng(seed)
+
+    def first_timestamp(self, table, symbol):
+        return self.start
+
+    def iter_rows(self, table, symbol, start, end, chunksize):
+        timestamps = pd.date_range(start, end, freq=f'{self.sampling_frequency}s', inclusive='left')
+        prices = np.round(100 + self.rng.normal(size=len(timestamps)).cumsum(), 2)
+        for offset in range(0, len(timestamps), chunksize):
+            yield pd.DataFrame({
+                'timestamp': timestamps[offset:offset + chunksize],
+                'price': prices[offset:offset + chunksize]
+            })
+
+
+class StaticWatermarkRepository:
+    ''' Transform watermarks fixed at the end of the generated range, archive progress kept in a dict '''
+
+    def __init__(self, transform_watermark):
+        self.transform_watermark = transform_watermark
+        self.archived = {}
+
+    def get_watermarks(self, symbols, stage='downsampled_data'):
+        if stage == 'downsampled_data':
+            return {symbol: self.transform_watermark for symbol in symbols}
+        return {symbol: self.archived[symbol] for symbol in symbols if symbol in self.archived}
+
+    def set_watermarks(self, watermarks, stage='downsampled_data'):
+        self.archived.update(watermarks)
+
+
+def read_postgres(reader, symbols, start, end, repeat):
+    ''' Loads the archived month into a scratch table and reads it back the way the repositories do '''
+    from database.database import Database
+    engine = Database.get_engine()
+    df = reader.read('raw_data', symbols, start, end)
+    with engine.begin() as connection:
+        connection.execute(text('''
+            DROP TABLE IF EXISTS bench_raw_archive;
+            CREATE TABLE bench_raw_archive (
+                symbol VARCHAR NOT NULL, price DOUBLE PRECISION, timestamp TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY (symbol, timestamp)
+            );
+        '''))
+    connection = engine.raw_connection()
+    try:
+        buffer = io.StringIO()
+        df[['symbol', 'price', 'timestamp']].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert('COPY bench_raw_archive (symbol, price, timestamp) FROM STDIN WITH CSV', buffer)
+        connection.commit()
+    finally:
+        connection.close()
+    query = text('''
+        SELECT symbol, timestamp, price FROM bench_raw_archive
+        WHERE symbol = ANY(:symbols) AND timestamp >= :start AND timestamp < :end
+        ORDER BY symbol, timestamp
+    ''')
+    timings = []
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = pd.read_sql_query(query, engine, params={'symbols': symbols, 'start': start, 'end': end})
+            result['timestamp'] = pd.to_datetime(result['timestamp'], utc=True)
+            timings.append(time.perf_counter() - started)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS bench_raw_archive'))
+    return {'seconds': min(timings), 'rows': len(result)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a month of ticks to the Parquet archive and read it back.')
+    parser.add_argument('--symbols', type=int, default=5)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--sampling-frequency', type=int, default=10, help='Seconds between ticks.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--postgres', action='store_true',
+                        help='Also time the same read from a scratch raw_data table in the configured database.')
+    args = parser.parse_args()
+
+    start = pd.Timestamp('2024-09-01', tz='UTC')
+    end = start + pd.Timedelta(days=args.days)
+    symbols = [f'SYM{i:05d}USDT' for i in range(args.symbols)]
+    root = tempfile.mkdtemp(prefix='bench_archive_')
+    try:
+        archiver = ParquetArchiver(
+            {'symbols': symbols, 'archive': {'path': root, 'tables': ['raw_data']}},
+            source=GeneratedArchiveSource(start, args.sampling_frequency),
+            watermark_repo=StaticWatermarkRepository(end.to_pydatetime())
+        )
+        archiver.logger.disabled = True
+        write_report = archiver.archive()
+
+        reader = ArchiveReader(root)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            df = reader.read('raw_data', symbols, start, end)
+            timings.append(time.perf_counter() - started)
+        result = {
+            'benchmark': 'archive',
+            'rows': write_report['rows'],
+            'files': write_report['files'],
+            'archive_bytes': write_report['bytes'],
+            'bytes_per_row': write_report['bytes'] / write_report['rows'],
+            'write_seconds': write_report['seconds'],
+            'archive_read_seconds': min(timings),
+            'archive_rows_per_second': len(df) / min(timings),
+        }
+        if args.postgres:
+            postgres = read_postgres(reader, symbols, start, end, args.repeat)
+            result['postgres_read_seconds'] = postgres['seconds']
+            result['speedup'] = postgres['seconds'] / result['archive_read_seconds']
+        print(json.dumps(result, indent=2))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+# benchmarks/bench_compaction.py
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database.compacted_raw_data_repository import CompactedRawDataRepository
+from database.database import Database
+from database.raw_data_repository import RawDataRepository
+from transformation.transformer import DataTransformer
+from utils.config_loader import ConfigLoader
+
+# Rows per insert_raw_data_bulk call, the default raw_writer batch
+WRITE_BATCH_ROWS = 1000
+
+
+class _NoopRepository:
+    def insert_downsampled_data(self, df_downsampled):
+        pass
+
+
+def generate_ticks(symbols, hours, sampling_frequency, seed=0):
+    ''' Random walks rounded to the tick size of their price level, as on the exchange
+
+    Prices keep four significant digits, so a quiet symbol repeats its
+    price for several ticks in a row.
+    '''
+    rng = np.random.default_rng(seed)
+    points = int(hours * 3600 / sampling_frequency)
+    timestamps = pd.date_range('2024-10-12', periods=points, freq=f'{sampling_frequency}s', tz='UTC')
+    frames = []
+    for i in range(symbols):
+        start = 10 ** rng.uniform(-1, 3)
+        tick_size = 10 ** (np.floor(np.log10(start)) - 3)
+        # 0.5 to 3 basis points per second
+        sigma = rng.uniform(0.5e-4, 3e-4) * np.sqrt(sampling_frequency)
+        walk = start * np.exp(np.cumsum(rng.normal(0, sigma, points)))
+        frames.append(pd.DataFrame({
+            'timestamp': timestamps,
+            'price': np.round(walk / tick_size) * tick_size,
+            'symbol': f'SYM{i:05d}USDT',
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_recorded_ticks(symbols, hours):
+    ''' Read the last hours of raw_data from the configured database '''
+    query = text('''
+        SELECT timestamp, price, symbol
+        FROM raw_data
+        WHERE symbol IN :symbols AND timestamp >= :start AND price IS NOT NULL
+        ORDER BY symbol, timestamp
+    ''').bindparams(bindparam('symbols', expanding=True))
+    start = pd.Timestamp.now(tz='UTC') - pd.Timedelta(hours=hours)
+    if Database.is_sqlite():
+        start = start.strftime('%Y-%m-%d %H:%M:%S.%f')
+    df = pd.read_sql_query(query, Database.get_engine(), params={'symbols': list(symbols), 'start': start})
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+
+def write(repository, df):
+    ''' Insert the ticks in time order and batches, as the raw writer does '''
+    df = df.sort_values(['timestamp', 'symbol'])
+    rows = [(symbol, {'price': price}, timestamp.to_pydatetime())
+            for symbol, price, timestamp in zip(df['symbol'], df['price'], df['timestamp'])]
+    start = time.perf_counter()
+    for offset in range(0, len(rows), WRITE_BATCH_ROWS):
+        repository.insert_raw_data_bulk(rows[offset:offset + WRITE_BATCH_ROWS])
+    return time.perf_counter() - start
+
+
+def storage_bytes(table):
+    ''' Bytes of the table and of its primary key index, from the dbstat virtual table '''
+    with Database.get_engine().connect() as connection:
+        index = connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"), {'table': table}
+        ).scalar()
+        sizes = dict(connection.execute(
+            text('SELECT name, SUM(pgsize) FROM dbstat WHERE name IN (:table, :index) GROUP BY name'),
+            {'table': table, 'index': index}
+        ).fetchall())
+    return sizes.get(table, 0), sizes.get(index, 0)
+
+
+def measure(repository, df, symbols, repeat):
+    write_seconds = write(repository, df)
+    with Database.get_engine().connect() as connection:
+        rows = connection.execute(text(f'SELECT COUNT(*) FROM {repository.table}')).scalar()
+    table_bytes, index_bytes = storage_bytes(repository.table)
+    transformer = DataTransformer({'downsampling_frequency': 1, 'symbols': symbols},
+                                  raw_data_repo=repository, downsampled_repo=_NoopRepository(),
+                                  watermark_repo=object())
+    fetch_timings, transform_timings = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        raw = repository.fetch_unprocessed_data_all(symbols)
+        fetch_timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        downsampled = transformer._downsample_all(raw)
+        transform_timings.append(time.perf_counter() - start)
+    return {
+        'rows': rows,
+        'table_bytes': table_bytes,
+        'index_bytes': index_bytes,
+        'write_seconds': write_seconds,
+        'fetch_seconds': min(fetch_timings),
+        'transform_seconds': min(transform_timings),
+        'fetch_and_transform_seconds': min(f + t for f, t in zip(fetch_timings, transform_timings)),
+    }, downsampled
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare raw_data with the run-length compacted raw_data_run.')
+    parser.add_argument('--source', choices=['generated', 'database'], default='generated',
+                        help='database reads recorded ticks from raw_data of the configured database.')
+    parser.add_argument('--symbols', nargs='*', help='Symbols read with --source database, the configured ones '
+                                                     'by default.')
+    parser.add_argument('--generated-symbols', type=int, default=50)
+    parser.add_argument('--hours', type=float, default=6)
+    parser.add_argument('--sampling-frequency', type=float, default=1, help='Seconds between generated ticks.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.source == 'database':
+        df = load_recorded_ticks(args.symbols or ConfigLoader.load_config()['symbols'], args.hours)
+    else:
+        df = generate_ticks(args.generated_symbols, args.hours, args.sampling_frequency)
+    if df.empty:
+        sys.exit('No ticks to compare.')
+    symbols = sorted(df['symbol'].unique())
+
+    results = {}
+    downsampled = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, make_repository in (('raw_data', RawDataRepository),
+                                      ('raw_data_run', CompactedRawDataRepository)):
+            Database.initialize({'backend': 'sqlite', 'path': os.path.join(tmp_dir, f'{name}.sqlite')})
+            results[name], downsampled[name] = measure(make_repository(), df, symbols, args.repeat)
+            Database.get_engine().dispose()
+
+    pd.testing.assert_frame_equal(downsampled['raw_data'], downsampled['raw_data_run'])
+    uncompacted, compacted = results['raw_data'], results['raw_data_run']
+    print(json.dumps({
+        'benchmark': 'compaction',
+        'source': args.source,
+        'ticks': len(df),
+        'symbols': len(symbols),
+        'raw_data': uncompacted,
+        'raw_data_run': compacted,
+        'row_ratio': compacted['rows'] / uncompacted['rows'],
+        'index_ratio': compacted['index_bytes'] / uncompacted['index_bytes'],
+        'fetch_and_transform_speedup':
+            uncompacted['fetch_and_transform_seconds'] / compacted['fetch_and_transform_seconds'],
+        'downsampled_identical': True,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# benchmarks/bench_gap_detection.py
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database.database import Database
+from database.raw_data_repository import RawDataRepository
+from utils.gap_detector import GapDetector, find_gaps
+
+START = pd.Timestamp('2024-10-12', tz='UTC')
+# Rows per executemany while loading the scratch database
+LOAD_BATCH_ROWS = 500000
+
+
+def generate_timestamps(symbols, hours, sampling_frequency, gaps_per_symbol, seed=0):
+    ''' Epoch microseconds of one point per sampling interval and symbol, with gaps_per_symbol pauses cut out '''
+    rng = np.random.default_rng(seed)
+    points = int(hours * 3600 / sampling_frequency)
+    grid = START.value // 1000 + np.arange(points, dtype=np.int64) * int(sampling_frequency * 1000000)
+    arrays = []
+    for _ in range(symbols):
+        keep = np.ones(points, dtype=bool)
+        for start in rng.integers(0, points - 600, gaps_per_symbol):
+            keep[start:start + rng.integers(10, 600)] = False
+        arrays.append(grid[keep])
+    return arrays
+
+
+def load(symbol_names, arrays):
+    ''' Write the timestamps to raw_data of the current database, bypassing the repository for speed '''
+    RawDataRepository()
+    with Database.get_engine().begin() as connection:
+        for symbol, array in zip(symbol_names, arrays):
+            timestamps = pd.to_datetime(array, unit='us').strftime('%Y-%m-%d %H:%M:%S.%f')
+            rows = [(symbol, timestamp, 100.0) for timestamp in timestamps]
+            for offset in range(0, len(rows), LOAD_BATCH_ROWS):
+                connection.exec_driver_sql('INSERT INTO raw_data (symbol, timestamp, price) VALUES (?, ?, ?)',
+                                           rows[offset:offset + LOAD_BATCH_ROWS])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the gap detector on a day of generated 1-second data.')
+    parser.add_argument('--symbols', type=int, default=1000, help='Symbols of the in-memory detection run.')
+    parser.add_argument('--db-symbols', type=int, default=100,
+                        help='Symbols loaded into a scratch SQLite database for the end-to-end scan, 0 to skip.')
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--sampling-frequency', type=float, default=1)
+    parser.add_argument('--gaps-per-symbol', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    arrays = generate_timestamps(args.symbols, args.hours, args.sampling_frequency, args.gaps_per_symbol)
+    symbol_names = [f'SYM{i:05d}USDT' for i in range(args.symbols)]
+    threshold = int(3 * args.sampling_frequency * 1000000)
+    start = time.perf_counter()
+    gaps = find_gaps(symbol_names, arrays, arrays, threshold)
+    detect_seconds = time.perf_counter() - start
+    result = {
+        'benchmark': 'gap_detection',
+        'symbols': args.symbols,
+        'rows': int(sum(len(array) for array in arrays)),
+        'gaps': len(gaps),
+        'detect_seconds': detect_seconds,
+        'rows_per_second': sum(len(array) for array in arrays) / detect_seconds,
+    }
+
+    if args.db_symbols:
+        names, db_arrays = symbol_names[:args.db_symbols], arrays[:args.db_symbols]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            Database.initialize({'backend': 'sqlite', 'path': os.path.join(tmp_dir, 'gaps.sqlite')})
+            load(names, db_arrays)
+            config = {
+                'symbols': names,
+                'sampling_frequency': args.sampling_frequency,
+                'gap_detection': {'max_gap_factor': 3, 'lookback_hours': args.hours + 1, 'grace_seconds': 0,
+                                  'workers': args.workers, 'refill': False},
+            }
+            end = START + pd.Timedelta(hours=args.hours)
+            report = GapDetector(config).scan(now=end.to_pydatetime())
+            Database.get_engine().dispose()
+        expected = sum(1 for gap in gaps if gap['symbol'] in set(names))
+        assert report['gaps_found'] == expected, (report['gaps_found'], expected)
+        result['database_scan'] = dict(report, symbols=args.db_symbols,
+                                       rows_per_second=report['rows_scanned'] / report['scan_seconds'])
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
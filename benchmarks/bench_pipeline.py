@@ -0,0 +1,281 @@
+# benchmarks/bench_pipeline.py
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from sqlalchemy import bindparam, text
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bench_transform import generate_raw_data
+from fake_exchange import FakeBinanceExchange
+from storage_stand_ins import (
+    InMemoryDownsampledDataRepository, InMemoryRawDataRepository, InMemoryStateRepository,
+    InMemoryWatermarkRepository
+)
+from database.database import Database
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.raw_data_repository import RawDataRepository
+from database.state_repository import StateRepository
+from database.watermark_repository import WatermarkRepository
+from orchestrator.orchestrator import Orchestrator
+from transformation.transformer import DataTransformer
+from utils.retention_manager import RetentionManager
+from utils.state_manager import StateManager
+
+
+BENCHMARK_TABLES = ['raw_data', 'downsampled_data', 'transform_watermark', 'ingestion_state']
+LOAD_BATCH_ROWS = 10000
+
+
+def make_config(symbols, sampling_frequency, mode, exchange=None, downsampling_frequency=1):
+    config = {
+        'symbols': symbols,
+        'sampling_frequency': sampling_frequency,
+        'downsampling_frequency': downsampling_frequency,
+        'data_points': 10 ** 9,
+        'api_rate_limit': 100000,
+        'rate_limits': {'request_weight_per_minute': 10 ** 9},
+        'max_workers': 100,
+        'ingestion_mode': mode,
+        'batch_size': 100,
+        'transform_grace_seconds': 0,
+        'state_checkpoint_interval': 10,
+    }
+    if exchange is not None:
+        config['base_url'] = exchange.base_url
+        config['websocket'] = {'url': exchange.stream_url, 'streams_per_connection': 1024}
+    return config
+
+
+def clear_symbols(symbols):
+    ''' Remove earlier benchmark rows, only the generated symbols are touched '''
+    with Database.get_engine().begin() as connection:
+        for table in BENCHMARK_TABLES:
+            connection.execute(
+                text(f'DELETE FROM {table} WHERE symbol IN :symbols').bindparams(bindparam('symbols', expanding=True)),
+                {'symbols': list(symbols)}
+            )
+
+
+def count_rows(table, symbols):
+    with Database.get_engine().connect() as connection:
+        return connection.execute(
+            text(f'SELECT COUNT(*) FROM {table} WHERE symbol IN :symbols').bindparams(
+                bindparam('symbols', expanding=True)),
+            {'symbols': list(symbols)}
+        ).scalar()
+
+
+def make_storage(storage, tmp_dir, symbols):
+    ''' Return (raw, downsampled, watermark, state) repositories and a row counter of the storage under test
+
+    memory uses the stand-ins, sqlite a fresh embedded database and postgres
+    the configured one.
+    '''
+    if storage == 'memory':
+        raw_data_repo, downsampled_repo = InMemoryRawDataRepository(), InMemoryDownsampledDataRepository()
+        counts = {'raw_data': raw_data_repo.count, 'downsampled_data': lambda: downsampled_repo.rows}
+        return (raw_data_repo, downsampled_repo, InMemoryWatermarkRepository(), InMemoryStateRepository(),
+                lambda table: counts[table]())
+    if storage == 'sqlite':
+        Database.initialize({'backend': 'sqlite', 'path': os.path.join(tmp_dir, 'binance.sqlite')})
+    repositories = (RawDataRepository(), DownsampledDataRepository(), WatermarkRepository(), StateRepository())
+    clear_symbols(symbols)
+    return repositories + (lambda table: count_rows(table, symbols),)
+
+
+def load_raw_data(raw_data_repo, df):
+    if isinstance(raw_data_repo, InMemoryRawDataRepository):
+        raw_data_repo.load(df)
+        return
+    rows = [(symbol, {'price': price}, timestamp)
+            for symbol, price, timestamp in zip(df['symbol'], df['price'], df['timestamp'])]
+    for start in range(0, len(rows), LOAD_BATCH_ROWS):
+        raw_data_repo.insert_raw_data_bulk(rows[start:start + LOAD_BATCH_ROWS])
+
+
+def make_orchestrator(config, storage, tmp_dir):
+    ''' Orchestrator wired to the storage under test '''
+    raw_data_repo, downsampled_repo, watermark_repo, state_repo, count = make_storage(
+        storage, tmp_dir, config['symbols'])
+    if storage != 'memory':
+        # Database storage is written in batches, as in production
+        config['raw_writer'] = {'enabled': True, 'batch_size': 1000, 'flush_interval': 0.5}
+    else:
+        # The stats catalog is a database table, the stand-ins have none
+        config['stats_catalog'] = {'enabled': False}
+    transformer = DataTransformer(config, raw_data_repo=raw_data_repo, downsampled_repo=downsampled_repo,
+                                  watermark_repo=watermark_repo)
+    retention_manager = RetentionManager(config, raw_data_repo=raw_data_repo, watermark_repo=watermark_repo)
+    orchestrator = Orchestrator(config, raw_data_repo=raw_data_repo,
+                                state_manager=StateManager(state_repo),
+                                transformer=transformer, retention_manager=retention_manager)
+    return orchestrator, raw_data_repo, count
+
+
+def percentile_ms(values, q):
+    return float(np.percentile(values, q) * 1000) if values else None
+
+
+def run_ingest(scenario, tmp_dir):
+    symbols = [f'SYM{i:05d}USDT' for i in range(scenario['symbols'])]
+    with FakeBinanceExchange(symbols, latency=scenario['latency'], error_rate=scenario['error_rate'],
+                             push_interval=scenario['sampling_frequency']) as exchange:
+        config = make_config(symbols, scenario['sampling_frequency'], scenario['mode'], exchange)
+        orchestrator, raw_data_repo, count = make_orchestrator(config, scenario['storage'], tmp_dir)
+        latencies = []
+        lock = threading.Lock()
+
+        if scenario['mode'] in ('batch', 'per_symbol'):
+            def record(event):
+                # Completion of a tick measured from the time it was due
+                if event.job_id.startswith('ingest_data'):
+                    latency = (pd.Timestamp.now(tz='UTC') - pd.Timestamp(event.scheduled_run_time)).total_seconds()
+                    with lock:
+                        latencies.append(latency)
+            orchestrator.scheduler.add_listener(record, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+        elif scenario['mode'] == 'async':
+            client = orchestrator.ingestion_client
+            ingest_batch = client.ingest_batch
+
+            async def timed_ingest_batch():
+                start = time.perf_counter()
+                await ingest_batch()
+                latencies.append(time.perf_counter() - start)
+            client.ingest_batch = timed_ingest_batch
+
+        orchestrator.start()
+        start = time.perf_counter()
+        time.sleep(scenario['duration'])
+        elapsed = time.perf_counter() - start
+        orchestrator.stop()
+        # Includes the rows flushed on stop
+        rows = count('raw_data')
+        requests, errors = exchange.stats['requests'], exchange.stats['errors']
+
+    ticks = len(latencies)
+    if scenario['mode'] == 'per_symbol':
+        # One job run per symbol and tick
+        ticks = ticks / len(symbols)
+    return {
+        'ticks': ticks if scenario['mode'] != 'websocket' else None,
+        'ticks_per_second': ticks / elapsed if scenario['mode'] != 'websocket' else None,
+        'tick_latency_p50_ms': percentile_ms(latencies, 50),
+        'tick_latency_p99_ms': percentile_ms(latencies, 99),
+        'rows': rows,
+        'rows_per_second': rows / elapsed,
+        'http_requests': requests,
+        'http_errors': errors,
+    }
+
+
+def run_transform(scenario, tmp_dir):
+    points = scenario['backlog_rows'] // scenario['symbols']
+    df = generate_raw_data(scenario['symbols'], points, scenario['sampling_frequency'])
+    config = make_config(sorted(df['symbol'].unique()), scenario['sampling_frequency'], scenario['transform_mode'])
+    config['transform_mode'] = scenario['transform_mode']
+    orchestrator, raw_data_repo, count = make_orchestrator(config, scenario['storage'], tmp_dir)
+    load_raw_data(raw_data_repo, df)
+    now = df['timestamp'].max() + pd.Timedelta(minutes=1)
+    start = time.perf_counter()
+    orchestrator.transformer.transform_data(now=now)
+    seconds = time.perf_counter() - start
+    return {
+        'raw_rows': len(df),
+        'downsampled_rows': count('downsampled_data'),
+        'transform_seconds': seconds,
+        'rows_per_second': len(df) / seconds,
+    }
+
+
+def run_scenario(scenario, queue):
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            if scenario['kind'] == 'ingest':
+                result = run_ingest(scenario, tmp_dir)
+            else:
+                result = run_transform(scenario, tmp_dir)
+        except Exception as e:
+            result = {'error': repr(e)}
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put(dict(scenario, **result))
+
+
+def run_isolated(scenario):
+    ''' Run a scenario in a fresh process, so peak RSS is its own '''
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_scenario, args=(scenario, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the pipeline against a fake exchange and storage stand-ins.')
+    parser.add_argument('--scenarios', nargs='+', choices=['ingest', 'transform'], default=['ingest', 'transform'])
+    parser.add_argument('--symbols', type=int, nargs='+', default=[17, 500, 5000])
+    parser.add_argument('--sampling-frequencies', type=float, nargs='+', default=[1.0],
+                        help='Seconds between ingestion ticks.')
+    parser.add_argument('--modes', nargs='+', default=['batch', 'async', 'websocket'],
+                        choices=['batch', 'per_symbol', 'async', 'websocket'])
+    parser.add_argument('--duration', type=float, default=10, help='Seconds each ingest scenario runs.')
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds the fake exchange waits per request.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of failed REST requests.')
+    parser.add_argument('--backlog-rows', type=int, nargs='+', default=[100000, 1000000],
+                        help='Raw rows waiting for the transform scenario.')
+    parser.add_argument('--transform-modes', nargs='+', default=['batch'], choices=['batch', 'per_symbol'])
+    parser.add_argument('--storage', nargs='+', choices=['memory', 'sqlite', 'postgres'], default=['memory'],
+                        help='postgres uses the configured database and only touches the generated symbols.')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+
+    scenarios = []
+    if 'ingest' in args.scenarios:
+        for storage in args.storage:
+            for symbols in args.symbols:
+                for sampling_frequency in args.sampling_frequencies:
+                    for mode in args.modes:
+                        scenarios.append({
+                            'kind': 'ingest', 'symbols': symbols, 'sampling_frequency': sampling_frequency,
+                            'mode': mode, 'duration': args.duration, 'latency': args.latency,
+                            'error_rate': args.error_rate, 'storage': storage,
+                        })
+    if 'transform' in args.scenarios:
+        for storage in args.storage:
+            for backlog_rows in args.backlog_rows:
+                for transform_mode in args.transform_modes:
+                    scenarios.append({
+                        'kind': 'transform', 'symbols': min(args.symbols), 'backlog_rows': backlog_rows,
+                        'sampling_frequency': 1, 'transform_mode': transform_mode, 'storage': storage,
+                    })
+
+    results = []
+    for scenario in scenarios:
+        result = run_isolated(scenario)
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    report = {'benchmark': 'pipeline', 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
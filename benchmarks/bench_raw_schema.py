@@ -0,0 +1,118 @@
+# benchmarks/bench_raw_schema.py
+
+import argparse
+import json
+import sys
+import os
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database.database import Database
+from transformation.transformer import DataTransformer
+
+# The same generated ticks are stored once as JSON payloads (the old schema) and
+# once in a typed price column (the new schema) in two scratch tables.
+CREATE_TABLES = '''
+    DROP TABLE IF EXISTS bench_raw_json, bench_raw_typed;
+    CREATE TABLE bench_raw_json (
+        symbol VARCHAR NOT NULL, data JSON, timestamp TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (symbol, timestamp)
+    );
+    CREATE TABLE bench_raw_typed (
+        symbol VARCHAR NOT NULL, price DOUBLE PRECISION, data JSON, timestamp TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (symbol, timestamp)
+    );
+'''
+
+GENERATE_JSON = '''
+    INSERT INTO bench_raw_json (symbol, data, timestamp)
+    SELECT 'SYM' || s || 'USDT',
+           json_build_object('symbol', 'SYM' || s || 'USDT', 'price', to_char(100 + random(), 'FM999990.00000000')),
+           TIMESTAMPTZ '2024-10-12 00:00:00+00' + make_interval(secs => t)
+    FROM generate_series(1, :symbols) AS s, generate_series(0, :points - 1) AS t;
+'''
+
+COPY_TYPED = '''
+    INSERT INTO bench_raw_typed (symbol, price, timestamp)
+    SELECT symbol, (data->>'price')::double precision, timestamp FROM bench_raw_json;
+'''
+
+FETCH_JSON = '''
+    SELECT timestamp, data->>'price' AS price, symbol FROM bench_raw_json ORDER BY symbol, timestamp
+'''
+
+FETCH_TYPED = '''
+    SELECT timestamp, price, symbol FROM bench_raw_typed ORDER BY symbol, timestamp
+'''
+
+
+class _NoopRepository:
+    def insert_downsampled_data(self, df_downsampled):
+        pass
+
+
+def measure(engine, table, fetch_query, transformer, repeat):
+    with engine.connect() as connection:
+        size = connection.execute(text(f"SELECT pg_total_relation_size('{table}')")).scalar()
+    fetch_timings, transform_timings = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = pd.read_sql_query(text(fetch_query), engine)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        if df['price'].dtype == object:
+            df['price'] = pd.to_numeric(df['price'])
+        fetch_timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        transformer._downsample_all(df)
+        transform_timings.append(time.perf_counter() - start)
+    return {
+        'total_bytes': size,
+        'fetch_seconds': min(fetch_timings),
+        'transform_seconds': min(transform_timings),
+        'fetch_and_transform_seconds': min(f + t for f, t in zip(fetch_timings, transform_timings)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare JSON and typed raw_data schemas on generated data.')
+    parser.add_argument('--symbols', type=int, default=100)
+    parser.add_argument('--points', type=int, default=3600, help='Ticks per symbol, one per second.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch tables afterwards.')
+    args = parser.parse_args()
+
+    engine = Database.get_engine()
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_TABLES))
+        connection.execute(text(GENERATE_JSON), {'symbols': args.symbols, 'points': args.points})
+        connection.execute(text(COPY_TYPED))
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('VACUUM ANALYZE bench_raw_json'))
+        connection.execute(text('VACUUM ANALYZE bench_raw_typed'))
+
+    transformer = DataTransformer({'downsampling_frequency': 1, 'symbols': []},
+                                  raw_data_repo=object(), downsampled_repo=_NoopRepository())
+    try:
+        json_schema = measure(engine, 'bench_raw_json', FETCH_JSON, transformer, args.repeat)
+        typed_schema = measure(engine, 'bench_raw_typed', FETCH_TYPED, transformer, args.repeat)
+    finally:
+        if not args.keep:
+            with engine.begin() as connection:
+                connection.execute(text('DROP TABLE IF EXISTS bench_raw_json, bench_raw_typed'))
+
+    print(json.dumps({
+        'benchmark': 'raw_schema',
+        'rows': args.symbols * args.points,
+        'json_schema': json_schema,
+        'typed_schema': typed_schema,
+        'storage_ratio': typed_schema['total_bytes'] / json_schema['total_bytes'],
+        'fetch_and_transform_speedup':
+            json_schema['fetch_and_transform_seconds'] / typed_schema['fetch_and_transform_seconds'],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/bench_series_query.py
+
+import argparse
+import json
+import sys
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database.series_query import SeriesQuery
+
+
+class InMemoryDownsampledDataRepository:
+    ''' Serves generated windows and charges a simulated database round trip per query '''
+
+    def __init__(self, df, query_latency, row_cost):
+        self.by_symbol = {symbol: group.reset_index(drop=True) for symbol, group in df.groupby('symbol')}
+        self.query_latency = query_latency
+        self.row_cost = row_cost
+        self.queries = 0
+        self.rows_read = 0
+
+    def fetch_downsampled_data(self, symbol, start=None, end=None):
+        df = self.by_symbol[symbol]
+        timestamps = df['timestamp'].values
+        lower, upper = timestamps.searchsorted([start.to_datetime64(), end.to_datetime64()])
+        result = df.iloc[lower:upper].reset_index(drop=True)
+        self.queries += 1
+        self.rows_read += len(result)
+        time.sleep(self.query_latency + self.row_cost * len(result))
+        return result
+
+
+class StaticWatermarkRepository:
+    def __init__(self, watermark):
+        self.watermark = watermark
+
+    def get_watermarks(self, symbols, stage='downsampled_data'):
+        return {symbol: self.watermark for symbol in symbols}
+
+
+def generate_windows(symbols, days, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2024-10-01', periods=days * 1440, freq='1min', tz='UTC')
+    return pd.concat([
+        pd.DataFrame({
+            'symbol': f'SYM{i:05d}USDT',
+            'timestamp': timestamps,
+            'avg_price': 100 + rng.normal(size=len(timestamps)).cumsum(),
+            'median_price': 100 + rng.normal(size=len(timestamps)).cumsum()
+        })
+        for i in range(symbols)
+    ], ignore_index=True)
+
+
+def dashboard_queries(symbols, now, count, seed=1):
+    ''' Panels asking for the last 1h, 6h, 24h or 7d of a few symbols '''
+    rng = np.random.default_rng(seed)
+    spans = [pd.Timedelta(hours=1), pd.Timedelta(hours=6), pd.Timedelta(days=1), pd.Timedelta(days=7)]
+    queries = []
+    for _ in range(count):
+        chosen = list(rng.choice(symbols, size=min(3, len(symbols)), replace=False))
+        queries.append((chosen, now - spans[rng.integers(len(spans))], now))
+    return queries
+
+
+def run(queries, repo, series_query=None):
+    start = time.perf_counter()
+    for symbols, query_start, query_end in queries:
+        if series_query is None:
+            pd.concat([repo.fetch_downsampled_data(symbol, query_start, query_end) for symbol in symbols])
+        else:
+            series_query.get_series(symbols, query_start, query_end)
+    return {'seconds': time.perf_counter() - start, 'queries': repo.queries, 'rows_read': repo.rows_read}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Repeated dashboard reads with and without the series cache.')
+    parser.add_argument('--symbols', type=int, default=20)
+    parser.add_argument('--days', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--query-latency', type=float, default=0.002, help='Seconds per database query.')
+    parser.add_argument('--row-cost', type=float, default=0.000003, help='Seconds per row read.')
+    args = parser.parse_args()
+
+    df = generate_windows(args.symbols, args.days)
+    now = df['timestamp'].max() + pd.Timedelta(minutes=1)
+    # Everything but the last 5 minutes has been transformed
+    watermark = (now - pd.Timedelta(minutes=5)).to_pydatetime()
+    queries = dashboard_queries(sorted(df['symbol'].unique()), now, args.requests)
+
+    direct_repo = InMemoryDownsampledDataRepository(df, args.query_latency, args.row_cost)
+    direct = run(queries, direct_repo)
+
+    cached_repo = InMemoryDownsampledDataRepository(df, args.query_latency, args.row_cost)
+    series_query = SeriesQuery({'downsampling_frequency': 1}, downsampled_repo=cached_repo,
+                               watermark_repo=StaticWatermarkRepository(watermark))
+    cached = run(queries, cached_repo, series_query)
+    cached.update(series_query.get_stats())
+
+    print(json.dumps({
+        'benchmark': 'series_query',
+        'requests': args.requests,
+        'direct': direct,
+        'cached': cached,
+        'speedup': direct['seconds'] / cached['seconds'],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
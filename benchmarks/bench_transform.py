@@ -0,0 +1,134 @@
+# benchmarks/bench_transform.py
+
+import argparse
+import json
+import sys
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from transformation.transformer import DataTransformer
+
+
+class InMemoryRawDataRepository:
+    ''' Serves a pre-generated DataFrame through the RawDataRepository read methods '''
+
+    def __init__(self, df):
+        self.df = df
+        self.by_symbol = {symbol: group for symbol, group in df.groupby('symbol')}
+        self.queries = 0
+
+    def fetch_unprocessed_data(self, symbol, start=None, end=None):
+        self.queries += 1
+        return self._between(self.by_symbol[symbol], start, end)
+
+    def fetch_unprocessed_data_all(self, symbols, watermarks=None, end=None):
+        # Generated data has no watermarks, so every symbol starts at the beginning
+        self.queries += 1
+        return self._between(self.df, None, end)
+
+    @staticmethod
+    def _between(df, start, end):
+        mask = pd.Series(True, index=df.index)
+        if start is not None:
+            mask &= df['timestamp'] >= start
+        if end is not None:
+            mask &= df['timestamp'] < end
+        return df[mask].copy()
+
+
+class InMemoryWatermarkRepository:
+    ''' Keeps transform watermarks in a dict '''
+
+    def __init__(self):
+        self.watermarks = {}
+
+    def get_watermarks(self, symbols, stage='downsampled_data'):
+        return {symbol: self.watermarks[symbol] for symbol in symbols if symbol in self.watermarks}
+
+    def set_watermarks(self, watermarks, stage='downsampled_data'):
+        self.watermarks.update(watermarks)
+
+
+class CollectingDownsampledDataRepository:
+    ''' Keeps inserted rows in memory '''
+
+    def __init__(self):
+        self.frames = []
+
+    def insert_downsampled_data(self, df_downsampled):
+        self.frames.append(df_downsampled)
+
+    def result(self):
+        df = pd.concat(self.frames, ignore_index=True)
+        return df.sort_values(['symbol', 'timestamp']).reset_index(drop=True)
+
+
+def generate_raw_data(symbols, points, sampling_frequency, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2024-10-12', periods=points, freq=f'{sampling_frequency}s', tz='UTC')
+    frames = []
+    for i in range(symbols):
+        frames.append(pd.DataFrame({
+            'timestamp': timestamps,
+            'price': np.round(100 + rng.normal(size=points).cumsum(), 4),
+            'symbol': f'SYM{i:05d}USDT'
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def run_mode(mode, df, config, repeat):
+    timings = []
+    for _ in range(repeat):
+        raw_repo = InMemoryRawDataRepository(df)
+        downsampled_repo = CollectingDownsampledDataRepository()
+        transformer = DataTransformer(dict(config, transform_mode=mode),
+                                      raw_data_repo=raw_repo, downsampled_repo=downsampled_repo,
+                                      watermark_repo=InMemoryWatermarkRepository())
+        transformer.logger.disabled = True
+        start = time.perf_counter()
+        transformer.transform_data()
+        timings.append(time.perf_counter() - start)
+    return {
+        'seconds_min': min(timings),
+        'seconds_median': float(np.median(timings)),
+        'queries': raw_repo.queries,
+        'inserts': len(downsampled_repo.frames),
+    }, downsampled_repo.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-symbol and batch DataTransformer paths.')
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--points', type=int, default=3600, help='Raw points per symbol.')
+    parser.add_argument('--sampling-frequency', type=int, default=1, help='Seconds between raw points.')
+    parser.add_argument('--downsampling-frequency', type=int, default=1, help='Window size in minutes.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    config = {
+        'symbols': [f'SYM{i:05d}USDT' for i in range(args.symbols)],
+        'downsampling_frequency': args.downsampling_frequency,
+    }
+    df = generate_raw_data(args.symbols, args.points, args.sampling_frequency)
+
+    per_symbol, per_symbol_df = run_mode('per_symbol', df, config, args.repeat)
+    batch, batch_df = run_mode('batch', df, config, args.repeat)
+    pd.testing.assert_frame_equal(per_symbol_df, batch_df)
+
+    print(json.dumps({
+        'benchmark': 'transform',
+        'symbols': args.symbols,
+        'raw_rows': len(df),
+        'per_symbol': per_symbol,
+        'batch': batch,
+        'speedup': per_symbol['seconds_median'] / batch['seconds_median'],
+        'results_identical': True,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
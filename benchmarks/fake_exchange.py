@@ -0,0 +1,214 @@
+# benchmarks/fake_exchange.py
+
+import base64
+import hashlib
+import json
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MINUTE_MS = 60 * 1000
+
+
+def fake_price(symbol, step):
+    ''' Deterministic price walk, so repeated runs ingest the same values '''
+    return 100 + (zlib.crc32(symbol.encode()) % 1000) / 10 + (step % 600) / 100
+
+
+class FakeBinanceExchange:
+    ''' Local stand-in for the Binance REST API and combined streams
+
+    REST serves /api/v3/ticker/price (symbol, symbols or all) and
+    /api/v3/klines. Every REST request waits latency seconds and fails with
+    error_status with probability error_rate. The WebSocket server accepts
+    SUBSCRIBE requests and pushes a miniTicker event per subscribed symbol
+    every push_interval seconds.
+    '''
+
+    def __init__(self, symbols, latency=0.0, error_rate=0.0, error_status=503, push_interval=1.0, seed=0):
+        self.symbols = list(symbols)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.push_interval = push_interval
+        self.stats = {'requests': 0, 'errors': 0, 'ws_events': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._http = ThreadingHTTPServer(('127.0.0.1', 0), _RestHandler)
+        self._http.daemon_threads = True
+        self._http.exchange = self
+        self._ws = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._ws.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._ws.bind(('127.0.0.1', 0))
+        self._ws.listen(128)
+        self._connections = []
+        self.base_url = f'http://127.0.0.1:{self._http.server_address[1]}'
+        self.stream_url = f'ws://127.0.0.1:{self._ws.getsockname()[1]}/stream'
+
+    def __enter__(self):
+        threading.Thread(target=self._http.serve_forever, daemon=True).start()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        self._http.shutdown()
+        self._http.server_close()
+        self._ws.close()
+        for conn in self._connections:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    # REST
+
+    def ticker_price(self, params):
+        step = int(time.time())
+        if 'symbol' in params:
+            return {'symbol': params['symbol'], 'price': f"{fake_price(params['symbol'], step):.8f}"}
+        symbols = json.loads(params['symbols']) if 'symbols' in params else self.symbols
+        return [{'symbol': symbol, 'price': f'{fake_price(symbol, step):.8f}'} for symbol in symbols]
+
+    def klines(self, params):
+        interval_ms = MINUTE_MS
+        start = -(-int(params['startTime']) // interval_ms) * interval_ms
+        end = int(params.get('endTime', start + 1000 * interval_ms))
+        limit = int(params.get('limit', 500))
+        rows = []
+        for open_time in range(start, end + 1, interval_ms)[:limit]:
+            price = f"{fake_price(params['symbol'], open_time // interval_ms):.8f}"
+            rows.append([open_time, price, price, price, price, '1.0', open_time + interval_ms - 1, price, 1,
+                         '0.5', price, '0'])
+        return rows
+
+    # WebSocket
+
+    def _accept_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                conn, _ = self._ws.accept()
+            except OSError:
+                return
+            self._connections.append(conn)
+            threading.Thread(target=self._serve_stream, args=(conn,), daemon=True).start()
+
+    def _serve_stream(self, conn):
+        try:
+            self._handshake(conn)
+            request = json.loads(self._recv_frame(conn)[1].decode())
+            self._send_text(conn, json.dumps({'result': None, 'id': request.get('id')}))
+            symbols = [stream.split('@')[0].upper() for stream in request.get('params', [])]
+            next_push = time.monotonic()
+            while not self._stop_event.is_set():
+                event_time = int(time.time() * 1000)
+                for symbol in symbols:
+                    self._send_text(conn, json.dumps({
+                        'stream': f'{symbol.lower()}@miniTicker',
+                        'data': {'e': '24hrMiniTicker', 'E': event_time, 's': symbol,
+                                 'c': f'{fake_price(symbol, event_time // 1000):.8f}'}
+                    }))
+                self.count('ws_events', len(symbols))
+                next_push += self.push_interval
+                self._stop_event.wait(max(next_push - time.monotonic(), 0))
+        except (OSError, ValueError):
+            pass
+
+    def _handshake(self, conn):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                raise OSError("connection closed during handshake")
+            request += chunk
+        headers = {}
+        for line in request.decode().split('\r\n')[1:]:
+            if ': ' in line:
+                name, value = line.split(': ', 1)
+                headers[name.lower()] = value
+        accept = base64.b64encode(
+            hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()
+        ).decode()
+        conn.sendall((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+        ).encode())
+
+    def _recv_exact(self, conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise OSError("connection closed")
+            data += chunk
+        return data
+
+    def _recv_frame(self, conn):
+        first, second = self._recv_exact(conn, 2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._recv_exact(conn, 2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._recv_exact(conn, 8))[0]
+        mask = self._recv_exact(conn, 4) if second & 0x80 else b'\x00' * 4
+        payload = self._recv_exact(conn, length)
+        return first & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def _send_text(self, conn, text):
+        payload = text.encode()
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x81, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack('!BBH', 0x81, 126, len(payload))
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(payload))
+        conn.sendall(header + payload)
+
+
+class _RestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        exchange = self.server.exchange
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        exchange.count('requests')
+        if exchange.latency:
+            time.sleep(exchange.latency)
+        if exchange.should_fail():
+            exchange.count('errors')
+            self._reply(exchange.error_status, {'code': -1003, 'msg': 'Simulated failure.'})
+        elif url.path == '/api/v3/ticker/price':
+            self._reply(200, exchange.ticker_price(params))
+        elif url.path == '/api/v3/klines':
+            self._reply(200, exchange.klines(params))
+        else:
+            self._reply(404, {'code': -1, 'msg': 'Unknown path.'})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,111 @@
+# benchmarks/storage_stand_ins.py
+
+import threading
+
+import pandas as pd
+
+from database.raw_data_repository import parse_price
+
+
+class InMemoryRawDataRepository:
+    ''' Keeps raw data points in per-symbol lists, with the RawDataRepository methods '''
+
+    def __init__(self):
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def insert_raw_data(self, symbol, data, timestamp):
+        with self.lock:
+            self.rows.setdefault(symbol, []).append((timestamp, parse_price(data)))
+
+    def insert_raw_data_bulk(self, rows):
+        with self.lock:
+            for symbol, data, timestamp in rows:
+                self.rows.setdefault(symbol, []).append((timestamp, parse_price(data)))
+        return len(rows)
+
+    def load(self, df):
+        ''' Bulk load a generated (timestamp, price, symbol) DataFrame '''
+        with self.lock:
+            for symbol, group in df.groupby('symbol'):
+                self.rows.setdefault(symbol, []).extend(zip(group['timestamp'], group['price']))
+
+    def count(self):
+        with self.lock:
+            return sum(len(rows) for rows in self.rows.values())
+
+    def fetch_unprocessed_data(self, symbol, start=None, end=None):
+        return self._frame([symbol], {symbol: start}, end)
+
+    def fetch_unprocessed_data_all(self, symbols, watermarks=None, end=None):
+        return self._frame(symbols, watermarks or {}, end)
+
+    def delete_raw_data_before(self, symbol, cutoff, batch_size):
+        with self.lock:
+            rows = self.rows.get(symbol, [])
+            expired = [i for i, (timestamp, _) in enumerate(rows) if timestamp < cutoff][:batch_size]
+            for i in reversed(expired):
+                del rows[i]
+        return len(expired)
+
+    def _frame(self, symbols, starts, end):
+        frames = []
+        with self.lock:
+            snapshot = {symbol: list(self.rows.get(symbol, [])) for symbol in symbols}
+        for symbol, rows in snapshot.items():
+            if not rows:
+                continue
+            df = pd.DataFrame(rows, columns=['timestamp', 'price'])
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            mask = pd.Series(True, index=df.index)
+            if starts.get(symbol) is not None:
+                mask &= df['timestamp'] >= pd.Timestamp(starts[symbol])
+            if end is not None:
+                mask &= df['timestamp'] < pd.Timestamp(end)
+            df = df[mask]
+            df['symbol'] = symbol
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=['timestamp', 'price', 'symbol'])
+        return pd.concat(frames, ignore_index=True).sort_values(['symbol', 'timestamp'], ignore_index=True)
+
+
+class InMemoryDownsampledDataRepository:
+    ''' Counts inserted windows '''
+
+    def __init__(self):
+        self.rows = 0
+
+    def insert_downsampled_data(self, df_downsampled):
+        self.rows += len(df_downsampled)
+
+
+class InMemoryWatermarkRepository:
+    ''' Keeps watermarks of every stage in a dict '''
+
+    def __init__(self):
+        self.watermarks = {}
+
+    def get_watermarks(self, symbols, stage='downsampled_data'):
+        return {symbol: self.watermarks[(symbol, stage)] for symbol in symbols if (symbol, stage) in self.watermarks}
+
+    def set_watermarks(self, watermarks, stage='downsampled_data'):
+        for symbol, watermark in watermarks.items():
+            previous = self.watermarks.get((symbol, stage))
+            self.watermarks[(symbol, stage)] = watermark if previous is None else max(previous, watermark)
+
+
+class InMemoryStateRepository:
+    ''' Keeps the collected points counters of StateManager in a dict '''
+
+    def __init__(self):
+        self.collected_points = {}
+
+    def load_collected_points(self):
+        return dict(self.collected_points)
+
+    def save_collected_points(self, collected_points):
+        self.collected_points.update(collected_points)
+
+    def reset_state(self):
+        self.collected_points = {}
@@ -0,0 +1,119 @@
+import json
+
+import pandas as pd
+from sqlalchemy import text
+from database.models import AggregateData, Base, SQLITE_MIN_TIMESTAMP, sqlite_timestamp
+from database.database import Database
+from utils.metrics import timed_method, ROWS_WRITTEN
+
+MAX_ROWS_PER_STATEMENT = 5000
+
+STATE_COLUMNS = ['count', 'sum', 'min', 'max', 'm2', 'sketch']
+
+class AggregateRepository:
+    def __init__(self):
+        self.engine = Database.get_engine()
+        Base.metadata.create_all(self.engine)
+        self.sqlite = Database.is_sqlite()
+
+    @timed_method()
+    def insert_aggregates(self, table_name, resolution, df_aggregates):
+        '''Store windows of table_name (symbol, timestamp, states and aggregates), replacing stored ones'''
+        session = Database.get_session()
+        try:
+            records = df_aggregates.assign(table_name=table_name, resolution=resolution).to_dict(orient='records')
+            if not records:
+                return
+            columns = [column for column in STATE_COLUMNS + ['aggregates'] if column in df_aggregates.columns]
+            rows_per_statement = Database.rows_per_statement(len(records[0]), MAX_ROWS_PER_STATEMENT)
+            for start in range(0, len(records), rows_per_statement):
+                stmt = Database.insert(AggregateData.__table__).values(records[start:start + rows_per_statement])
+                # Windows that are aggregated again replace the stored row
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['table_name', 'symbol', 'resolution', 'timestamp'],
+                    set_={column: stmt.excluded[column] for column in columns}
+                )
+                session.execute(stmt)
+            session.commit()
+            ROWS_WRITTEN.labels('aggregate_data').inc(len(records))
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def fetch_aggregates(self, table_name, symbol, resolution, start=None, end=None):
+        '''Fetch the aggregations of one symbol with start <= timestamp < end, one column per aggregation'''
+        session = Database.get_session()
+        try:
+            query = session.query(AggregateData.symbol, AggregateData.timestamp, AggregateData.aggregates).filter(
+                AggregateData.table_name == table_name,
+                AggregateData.symbol == symbol,
+                AggregateData.resolution == resolution
+            )
+            if start is not None:
+                query = query.filter(AggregateData.timestamp >= start)
+            if end is not None:
+                query = query.filter(AggregateData.timestamp < end)
+            rows = query.order_by(AggregateData.timestamp).all()
+            df = pd.DataFrame([{'symbol': row.symbol, 'timestamp': row.timestamp, **row.aggregates} for row in rows])
+            if not df.empty:
+                df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            return df
+        finally:
+            session.close()
+
+    @timed_method()
+    def fetch_states_all(self, table_name, resolution, symbols, starts, ends):
+        '''Fetch the states of many symbols, each from starts[symbol] (or the beginning) to ends[symbol]'''
+        symbols = list(symbols)
+        session = Database.get_session()
+        try:
+            if self.sqlite:
+                query = text('''
+                    WITH bounds AS (
+                        SELECT json_extract(value, '$[0]') AS symbol, json_extract(value, '$[1]') AS start_ts,
+                               json_extract(value, '$[2]') AS end_ts
+                        FROM json_each(:bounds)
+                    )
+                    SELECT a.symbol, a.timestamp, a.count, a.sum, a.min, a.max, a.m2, a.sketch
+                    FROM bounds
+                    JOIN aggregate_data a ON a.table_name = :table_name AND a.symbol = bounds.symbol
+                    AND a.resolution = :resolution
+                    AND a.timestamp >= COALESCE(bounds.start_ts, :min_timestamp)
+                    AND a.timestamp < bounds.end_ts
+                    ORDER BY a.symbol, a.timestamp ASC
+                ''')
+                params = {
+                    'table_name': table_name,
+                    'resolution': resolution,
+                    'bounds': json.dumps([
+                        [symbol, sqlite_timestamp(starts.get(symbol)), sqlite_timestamp(ends[symbol])]
+                        for symbol in symbols
+                    ]),
+                    'min_timestamp': SQLITE_MIN_TIMESTAMP
+                }
+            else:
+                query = text('''
+                    SELECT a.symbol, a.timestamp, a.count, a.sum, a.min, a.max, a.m2, a.sketch
+                    FROM unnest(CAST(:symbols AS VARCHAR[]), CAST(:starts AS TIMESTAMPTZ[]),
+                                CAST(:ends AS TIMESTAMPTZ[])) AS bounds(symbol, start_ts, end_ts)
+                    JOIN aggregate_data a ON a.table_name = :table_name AND a.symbol = bounds.symbol
+                    AND a.resolution = :resolution
+                    AND a.timestamp >= COALESCE(bounds.start_ts, '-infinity')
+                    AND a.timestamp < bounds.end_ts
+                    ORDER BY a.symbol, a.timestamp ASC
+                ''')
+                params = {
+                    'table_name': table_name,
+                    'resolution': resolution,
+                    'symbols': symbols,
+                    'starts': [starts.get(symbol) for symbol in symbols],
+                    'ends': [ends[symbol] for symbol in symbols]
+                }
+            df = pd.read_sql_query(query, session.bind, params=params)
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            return df
+        finally:
+            session.close()
@@ -0,0 +1,48 @@
+import pandas as pd
+from sqlalchemy import text
+from database.database import Database
+from database.models import sqlite_timestamp
+
+# Columns exported to the archive besides symbol and timestamp
+ARCHIVE_COLUMNS = {
+    'raw_data': ['price'],
+    # Runs of raw_storage.compaction, at their first timestamp
+    'raw_data_run': ['price', 'count'],
+    'downsampled_data': ['avg_price', 'median_price'],
+}
+
+class ArchiveSourceRepository:
+    ''' Reads the rows of archived tables in bounded, streamed ranges '''
+
+    def __init__(self):
+        self.engine = Database.get_engine()
+        self.sqlite = Database.is_sqlite()
+
+    def first_timestamp(self, table, symbol):
+        '''Return the oldest timestamp of symbol in table, or None if it has no rows'''
+        with self.engine.connect() as connection:
+            first = connection.execute(
+                text(f"SELECT MIN(timestamp) FROM {table} WHERE symbol = :symbol"), {'symbol': symbol}
+            ).scalar()
+        if first is not None and self.sqlite:
+            # SQLite returns the stored UTC text
+            first = pd.Timestamp(first, tz='UTC').to_pydatetime()
+        return first
+
+    def iter_rows(self, table, symbol, start, end, chunksize):
+        '''Yield DataFrames of at most chunksize rows with start <= timestamp < end, in timestamp order'''
+        columns = ', '.join(ARCHIVE_COLUMNS[table])
+        query = text(f'''
+            SELECT timestamp, {columns}
+            FROM {table}
+            WHERE symbol = :symbol AND timestamp >= :start AND timestamp < :end
+            ORDER BY timestamp ASC
+        ''')
+        if self.sqlite:
+            start, end = sqlite_timestamp(start), sqlite_timestamp(end)
+        # A server-side cursor keeps only one chunk in memory
+        with self.engine.connect().execution_options(stream_results=True) as connection:
+            for chunk in pd.read_sql_query(query, connection, chunksize=chunksize,
+                                           params={'symbol': symbol, 'start': start, 'end': end}):
+                chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], utc=True)
+                yield chunk
@@ -0,0 +1,41 @@
+from database.models import BackfillProgress, Base
+from database.database import Database
+
+class BackfillProgressRepository:
+    def __init__(self):
+        self.engine = Database.get_engine()
+        Base.metadata.create_all(self.engine)
+
+    def get_progress(self, symbols, source):
+        '''Return {(symbol, range_start): (range_end, cursor, completed)}'''
+        session = Database.get_session()
+        try:
+            rows = session.query(BackfillProgress).filter(
+                BackfillProgress.source == source,
+                BackfillProgress.symbol.in_(list(symbols))
+            ).all()
+            return {
+                (row.symbol, row.range_start): (row.range_end, row.cursor, row.completed)
+                for row in rows
+            }
+        finally:
+            session.close()
+
+    def save_progress(self, symbol, source, range_start, range_end, cursor, completed):
+        session = Database.get_session()
+        try:
+            stmt = Database.insert(BackfillProgress.__table__).values(
+                symbol=symbol, source=source, range_start=range_start,
+                range_end=range_end, cursor=cursor, completed=completed
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['symbol', 'source', 'range_start'],
+                set_={'range_end': range_end, 'cursor': cursor, 'completed': completed}
+            )
+            session.execute(stmt)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
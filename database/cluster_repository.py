@@ -0,0 +1,110 @@
+from sqlalchemy import text
+from database.models import ClusterNode, ShardLease, Base
+from database.database import Database
+from utils.metrics import timed_method
+
+class ClusterRepository:
+    ''' Node heartbeats and shard leases of cluster mode
+
+    All times come from the database clock, so the hosts of a cluster do not
+    need synchronized clocks.
+    '''
+
+    def __init__(self):
+        self.engine = Database.get_engine()
+        Base.metadata.create_all(self.engine)
+
+    @timed_method()
+    def heartbeat(self, node_id):
+        session = Database.get_session()
+        try:
+            session.execute(text('''
+                INSERT INTO cluster_node (node_id, heartbeat) VALUES (:node_id, now())
+                ON CONFLICT (node_id) DO UPDATE SET heartbeat = now()
+            '''), {'node_id': node_id})
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def live_nodes(self, ttl_seconds):
+        '''Return the ids of the nodes with a heartbeat in the last ttl_seconds'''
+        session = Database.get_session()
+        try:
+            rows = session.execute(text('''
+                SELECT node_id FROM cluster_node
+                WHERE heartbeat > now() - make_interval(secs => :ttl)
+                ORDER BY node_id
+            '''), {'ttl': ttl_seconds}).fetchall()
+            return [row[0] for row in rows]
+        finally:
+            session.close()
+
+    @timed_method()
+    def claim_shards(self, node_id, shards, ttl_seconds):
+        '''Take or renew the leases of shards and return the shards now held by node_id
+
+        A shard held by another node is only taken over once its lease expired.
+        '''
+        if not shards:
+            return []
+        session = Database.get_session()
+        try:
+            rows = session.execute(text('''
+                INSERT INTO shard_lease (shard, node_id, expires_at)
+                SELECT shard, :node_id, now() + make_interval(secs => :ttl)
+                FROM unnest(CAST(:shards AS INTEGER[])) AS s(shard)
+                ON CONFLICT (shard) DO UPDATE
+                SET node_id = EXCLUDED.node_id, expires_at = EXCLUDED.expires_at
+                WHERE shard_lease.node_id = EXCLUDED.node_id OR shard_lease.expires_at < now()
+                RETURNING shard
+            '''), {'node_id': node_id, 'ttl': ttl_seconds, 'shards': list(shards)}).fetchall()
+            session.commit()
+            return [row[0] for row in rows]
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def release_shards(self, node_id, shards):
+        if not shards:
+            return
+        session = Database.get_session()
+        try:
+            session.execute(text('''
+                DELETE FROM shard_lease WHERE node_id = :node_id AND shard = ANY(CAST(:shards AS INTEGER[]))
+            '''), {'node_id': node_id, 'shards': list(shards)})
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def leave(self, node_id):
+        '''Remove the node and release all of its leases'''
+        session = Database.get_session()
+        try:
+            session.query(ShardLease).filter(ShardLease.node_id == node_id).delete()
+            session.query(ClusterNode).filter(ClusterNode.node_id == node_id).delete()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def get_leases(self):
+        '''Return [(shard, node_id, expires_at)] of all leases'''
+        session = Database.get_session()
+        try:
+            rows = session.query(ShardLease.shard, ShardLease.node_id, ShardLease.expires_at) \
+                .order_by(ShardLease.shard).all()
+            return [tuple(row) for row in rows]
+        finally:
+            session.close()
@@ -0,0 +1,208 @@
+import math
+import threading
+
+from sqlalchemy import text
+
+from database.models import RawDataRun, sqlite_timestamp
+from database.database import Database
+from database.raw_data_repository import RawDataRepository, parse_price
+from database.stats_catalog import STATS_COLLECTOR
+from utils.metrics import timed_method, ROWS_WRITTEN
+
+RAW_DATA_RUN_TABLE = 'raw_data_run'
+# Minutes per day, windows of _downsample_data start at midnight
+DAY_MINUTES = 24 * 60
+
+def raw_data_table(config):
+    ''' Table that holds the raw data points '''
+    return RAW_DATA_RUN_TABLE if config.get('raw_storage', {}).get('compaction', False) else 'raw_data'
+
+def run_split_minutes(config):
+    ''' Runs are cut at multiples of this many minutes since the epoch
+
+    Every downsampling window and base rollup bucket starts at such a
+    multiple, so all data points of a run belong to the same window.
+    '''
+    minutes = math.gcd(config['downsampling_frequency'], DAY_MINUTES)
+    rollup_config = config.get('rollups', {})
+    if rollup_config.get('enabled', False) and rollup_config.get('resolutions'):
+        minutes = math.gcd(minutes, rollup_config['resolutions'][0])
+    return minutes
+
+def create_raw_data_repository(config):
+    ''' Raw data repository selected by raw_storage '''
+    raw_storage = config.get('raw_storage', {})
+    if raw_storage.get('compaction', False):
+        return CompactedRawDataRepository(split_minutes=run_split_minutes(config))
+    return RawDataRepository(store_payload=raw_storage.get('store_payload', False))
+
+class CompactedRawDataRepository(RawDataRepository):
+    ''' Stores raw data points as runs of an unchanged price
+
+    Consecutive data points of a symbol with the same price are collapsed
+    into one raw_data_run row (first timestamp, last timestamp, price, count)
+    as they are written. The run that is still open is kept in memory and
+    upserted with every batch that extends it. A run ends when the price
+    changes or a split_minutes boundary is crossed, so it never spans two
+    downsampling windows. Data points older than the open run of their
+    symbol (backfills, late batches) are stored as runs of their own. The
+    open runs only take a batch in once it is stored, so a batch that failed
+    can be written again. After a restart the open runs start over; a stored
+    run is only replaced by a longer run with the same first timestamp, never
+    shortened.
+
+    Fetches return one row per data point again, every run repeated count
+    times at its first timestamp, so means, medians and rollups come out as
+    with raw_data. Payloads are not stored.
+    '''
+    table = RAW_DATA_RUN_TABLE
+    columns = 'rd.timestamp, rd.price, rd.symbol, rd.count'
+    # Points inside a run are not stored, only the pauses between runs can be seen
+    span_columns = ('timestamp', 'last_timestamp')
+
+    def __init__(self, split_minutes=1):
+        super().__init__()
+        self.split_seconds = split_minutes * 60
+        # symbol -> [first timestamp, last timestamp, price, count] of the run that can still grow
+        self.open_runs = {}
+        self.lock = threading.Lock()
+
+    def insert_raw_data(self, symbol, data, timestamp):
+        self.insert_raw_data_bulk([(symbol, data, timestamp)])
+
+    @timed_method()
+    def insert_raw_data_bulk(self, rows):
+        """Fold (symbol, data, timestamp) rows into runs and upsert the runs they touched."""
+        if not rows:
+            return 0
+        # Writers are serialized, a run must not be upserted with an older count
+        with self.lock:
+            # Folded into a copy, a failed upsert leaves the open runs as they were for the retry
+            open_runs = {symbol: list(run) for symbol, run in self.open_runs.items()}
+            touched = {}
+            late = {}
+            # symbol -> [runs started, first timestamp, last timestamp] for the stats catalog
+            summary = {}
+            for symbol, data, timestamp in sorted(rows, key=lambda row: row[2]):
+                price = parse_price(data)
+                if price is None:
+                    # raw_data keeps them with a NULL price, the transformation drops them
+                    continue
+                entry = summary.setdefault(symbol, [0, timestamp, timestamp])
+                entry[1], entry[2] = min(entry[1], timestamp), max(entry[2], timestamp)
+                run = open_runs.get(symbol)
+                if run is not None and timestamp <= run[1]:
+                    if (symbol, timestamp) not in late:
+                        late[(symbol, timestamp)] = [timestamp, timestamp, price, 1]
+                        entry[0] += 1
+                    continue
+                if run is None or run[2] != price or self._split(timestamp) != self._split(run[0]):
+                    run = open_runs[symbol] = [timestamp, timestamp, price, 0]
+                    entry[0] += 1
+                run[1] = timestamp
+                run[3] += 1
+                touched[(symbol, run[0])] = run
+            self._upsert(self._records(touched), update=True)
+            self._upsert(self._records(late), update=False)
+            self.open_runs = open_runs
+            ROWS_WRITTEN.labels(self.table).inc(len(touched) + len(late))
+            for symbol, (runs, first, last) in summary.items():
+                STATS_COLLECTOR.record(self.table, symbol, runs, first, last)
+        return len(rows)
+
+    def _split(self, timestamp):
+        return int(timestamp.timestamp() // self.split_seconds)
+
+    @staticmethod
+    def _records(runs):
+        return [
+            {'symbol': symbol, 'timestamp': first, 'last_timestamp': last, 'price': price, 'count': count}
+            for (symbol, _), (first, last, price, count) in runs.items()
+        ]
+
+    def _upsert(self, records, update):
+        if not records:
+            return
+        stmt = Database.insert(RawDataRun.__table__)
+        if update:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['symbol', 'timestamp'],
+                set_={'last_timestamp': stmt.excluded.last_timestamp, 'count': stmt.excluded.count},
+                # A run only grows, a shorter one is a redelivery of points that are already stored
+                where=RawDataRun.count < stmt.excluded.count
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=['symbol', 'timestamp'])
+        session = Database.get_session()
+        try:
+            # One statement compiled once and executed for every record
+            session.execute(stmt, records)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def _finish_frame(self, df):
+        # One row per data point
+        counts = df.pop('count')
+        return df.loc[df.index.repeat(counts)].reset_index(drop=True)
+
+    @timed_method()
+    def delete_raw_data_before(self, symbol, cutoff, batch_size):
+        """Delete up to batch_size of the oldest runs of symbol that ended before cutoff.
+
+        Returns the number of runs deleted.
+        """
+        session = Database.get_session()
+        try:
+            if self.sqlite:
+                query = text('''
+                    DELETE FROM raw_data_run
+                    WHERE (symbol, timestamp) IN (
+                        SELECT symbol, timestamp
+                        FROM raw_data_run
+                        WHERE symbol = :symbol AND timestamp < :cutoff AND last_timestamp < :cutoff
+                        ORDER BY timestamp ASC
+                        LIMIT :batch_size
+                    )
+                ''')
+            else:
+                query = text('''
+                    WITH batch AS (
+                        SELECT symbol, timestamp
+                        FROM raw_data_run
+                        WHERE symbol = :symbol AND timestamp < :cutoff AND last_timestamp < :cutoff
+                        ORDER BY timestamp ASC
+                        LIMIT :batch_size
+                    )
+                    DELETE FROM raw_data_run rd
+                    USING batch
+                    WHERE rd.symbol = batch.symbol AND rd.timestamp = batch.timestamp
+                ''')
+            result = session.execute(query, {
+                'symbol': symbol, 'cutoff': sqlite_timestamp(cutoff) if self.sqlite else cutoff, 'batch_size': batch_size
+            })
+            session.commit()
+            # Runs that started before the cutoff may be left, the oldest timestamp is unknown
+            STATS_COLLECTOR.record_delete(self.table, symbol, result.rowcount)
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def delete_all_raw_data(self):
+        session = Database.get_session()
+        try:
+            session.query(RawDataRun).delete(synchronize_session=False)
+            session.commit()
+            with self.lock:
+                self.open_runs.clear()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
@@ -1,21 +1,52 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 from utils.config_loader import ConfigLoader
 
+# Bind parameters allowed per statement
+MAX_BIND_PARAMETERS = {'postgresql': 65535, 'sqlite': 32766}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    ''' WAL lets readers run next to the single writer, NORMAL sync is durable in WAL mode '''
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 class Database:
-    ''' Database class to manage database connection and session '''
+    ''' Database class to manage database connection and session
+
+    database.backend selects PostgreSQL (postgresql, the default) or an
+    embedded SQLite file at database.path (sqlite).
+    '''
     _engine = None
     _SessionLocal = None
 
     @classmethod
-    def initialize(cls):
+    def initialize(cls, db_config=None):
         ''' Initialize database connection '''
-        config = ConfigLoader.load_config()
-        db_config = config['database']
-        db_url = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@" \
-                 f"{db_config['host']}:{db_config['port']}/{db_config['dbname']}"
-
-        cls._engine = create_engine(db_url, pool_pre_ping=True)
+        if db_config is None:
+            db_config = ConfigLoader.load_config()['database']
+        backend = db_config.get('backend', 'postgresql')
+        if backend == 'sqlite':
+            path = db_config.get('path', 'data/binance.sqlite')
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            cls._engine = create_engine(
+                f"sqlite:///{path}",
+                # Sessions are used from ingestion threads, writers wait for the lock instead of failing
+                connect_args={'check_same_thread': False, 'timeout': db_config.get('busy_timeout', 30)}
+            )
+            event.listen(cls._engine, 'connect', _set_sqlite_pragmas)
+        elif backend == 'postgresql':
+            db_url = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@" \
+                     f"{db_config['host']}:{db_config['port']}/{db_config['dbname']}"
+            cls._engine = create_engine(db_url, pool_pre_ping=True)
+        else:
+            raise ValueError(f"Unknown database backend: {backend}")
         cls._SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=cls._engine)
 
     @classmethod
@@ -31,3 +62,18 @@ class Database:
         if cls._SessionLocal is None:
             cls.initialize()
         return cls._SessionLocal()
+
+    @classmethod
+    def is_sqlite(cls):
+        ''' True if the embedded SQLite backend is in use '''
+        return cls.get_engine().dialect.name == 'sqlite'
+
+    @classmethod
+    def insert(cls, table):
+        ''' INSERT statement of the current dialect, which supports on_conflict_do_update/nothing '''
+        return sqlite_insert(table) if cls.is_sqlite() else pg_insert(table)
+
+    @classmethod
+    def rows_per_statement(cls, columns, limit):
+        ''' Rows of a multi-row insert that stay below the bind parameter limit of the dialect '''
+        return min(limit, MAX_BIND_PARAMETERS[cls.get_engine().dialect.name] // columns)
@@ -1,12 +1,19 @@
-from sqlalchemy.dialects.postgresql import insert as pg_insert
-from database.models import DownsampledData, Base
+import pandas as pd
+from sqlalchemy import text
+from database.models import DownsampledData, Base, SQLITE_MAX_TIMESTAMP, SQLITE_MIN_TIMESTAMP, sqlite_timestamp
 from database.database import Database
+from database.stats_catalog import STATS_COLLECTOR
+from utils.metrics import timed_method, ROWS_WRITTEN
+
+MAX_ROWS_PER_STATEMENT = 10000
 
 class DownsampledDataRepository:
     def __init__(self):
         self.engine = Database.get_engine()
         Base.metadata.create_all(self.engine)
+        self.sqlite = Database.is_sqlite()
 
+    @timed_method()
     def insert_downsampled_data(self, df_downsampled):
         session = Database.get_session()
         try:
@@ -14,14 +21,100 @@ class DownsampledDataRepository:
             df_downsampled = df_downsampled[['symbol', 'timestamp', 'avg_price', 'median_price']]
 
             records = df_downsampled.to_dict(orient='records')
-            stmt = pg_insert(DownsampledData.__table__).values(records)
-            stmt = stmt.on_conflict_do_nothing(
-                index_elements=['symbol', 'timestamp']
-            )
-            session.execute(stmt)
+            # Stay below the bind parameter limit per statement
+            rows_per_statement = Database.rows_per_statement(len(df_downsampled.columns), MAX_ROWS_PER_STATEMENT)
+            for start in range(0, len(records), rows_per_statement):
+                stmt = Database.insert(DownsampledData.__table__).values(
+                    records[start:start + rows_per_statement]
+                )
+                # Windows that are emitted again (late data, retries) replace the stored row
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['symbol', 'timestamp'],
+                    set_={
+                        'avg_price': stmt.excluded.avg_price,
+                        'median_price': stmt.excluded.median_price
+                    }
+                )
+                session.execute(stmt)
             session.commit()
+            ROWS_WRITTEN.labels('downsampled_data').inc(len(records))
+            STATS_COLLECTOR.record_frame('downsampled_data', df_downsampled)
         except Exception as e:
             session.rollback()
             raise e
         finally:
             session.close()
+
+    @timed_method()
+    def delete_downsampled_data_before(self, symbol, cutoff, batch_size):
+        '''Delete up to batch_size of the oldest windows of symbol older than cutoff, return the count'''
+        session = Database.get_session()
+        try:
+            if self.sqlite:
+                query = text('''
+                    DELETE FROM downsampled_data
+                    WHERE (symbol, timestamp) IN (
+                        SELECT symbol, timestamp
+                        FROM downsampled_data
+                        WHERE symbol = :symbol AND timestamp < :cutoff
+                        ORDER BY timestamp ASC
+                        LIMIT :batch_size
+                    )
+                ''')
+            else:
+                query = text('''
+                    WITH batch AS (
+                        SELECT symbol, timestamp
+                        FROM downsampled_data
+                        WHERE symbol = :symbol AND timestamp < :cutoff
+                        ORDER BY timestamp ASC
+                        LIMIT :batch_size
+                    )
+                    DELETE FROM downsampled_data dd
+                    USING batch
+                    WHERE dd.symbol = batch.symbol AND dd.timestamp = batch.timestamp
+                ''')
+            result = session.execute(query, {
+                'symbol': symbol, 'cutoff': sqlite_timestamp(cutoff) if self.sqlite else cutoff, 'batch_size': batch_size
+            })
+            session.commit()
+            STATS_COLLECTOR.record_delete('downsampled_data', symbol, result.rowcount,
+                                          cutoff if result.rowcount < batch_size else None)
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def fetch_downsampled_data(self, symbol, start=None, end=None):
+        '''Fetch the windows of one symbol with start <= timestamp < end'''
+        session = Database.get_session()
+        try:
+            if self.sqlite:
+                query = text('''
+                    SELECT symbol, timestamp, avg_price, median_price
+                    FROM downsampled_data
+                    WHERE symbol = :symbol
+                    AND timestamp >= COALESCE(:start, :min_timestamp)
+                    AND timestamp < COALESCE(:end, :max_timestamp)
+                    ORDER BY timestamp ASC
+                ''')
+                params = {'symbol': symbol, 'start': sqlite_timestamp(start), 'end': sqlite_timestamp(end),
+                          'min_timestamp': SQLITE_MIN_TIMESTAMP, 'max_timestamp': SQLITE_MAX_TIMESTAMP}
+            else:
+                query = text('''
+                    SELECT symbol, timestamp, avg_price, median_price
+                    FROM downsampled_data
+                    WHERE symbol = :symbol
+                    AND timestamp >= COALESCE(CAST(:start AS TIMESTAMPTZ), '-infinity')
+                    AND timestamp < COALESCE(CAST(:end AS TIMESTAMPTZ), 'infinity')
+                    ORDER BY timestamp ASC
+                ''')
+                params = {'symbol': symbol, 'start': start, 'end': end}
+            df = pd.read_sql_query(query, session.bind, params=params)
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            return df
+        finally:
+            session.close()
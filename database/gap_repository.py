@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+
+import pandas as pd
+from database.models import DataGap, Base
+from database.database import Database
+from utils.metrics import timed_method
+
+MAX_ROWS_PER_STATEMENT = 10000
+
+class GapRepository:
+    def __init__(self):
+        self.engine = Database.get_engine()
+        Base.metadata.create_all(self.engine)
+
+    @timed_method()
+    def insert_gaps(self, gaps):
+        '''Store [{symbol, gap_start, gap_end}] as open gaps, gaps that are already known are kept as they are'''
+        if not gaps:
+            return
+        now = datetime.now(timezone.utc)
+        records = [dict(gap, detected_at=now, status='open', refill_attempts=0, refilled_rows=0) for gap in gaps]
+        session = Database.get_session()
+        try:
+            rows_per_statement = Database.rows_per_statement(len(records[0]), MAX_ROWS_PER_STATEMENT)
+            for start in range(0, len(records), rows_per_statement):
+                stmt = Database.insert(DataGap.__table__).values(records[start:start + rows_per_statement])
+                session.execute(stmt.on_conflict_do_nothing(index_elements=['symbol', 'gap_start']))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def get_open_gaps(self, symbols, limit, max_attempts):
+        '''Return the oldest open gaps of symbols with fewer than max_attempts refills
+
+        Rows are (symbol, gap_start, gap_end, refill_attempts).
+        '''
+        session = Database.get_session()
+        try:
+            return session.query(DataGap.symbol, DataGap.gap_start, DataGap.gap_end, DataGap.refill_attempts).filter(
+                DataGap.symbol.in_(list(symbols)),
+                DataGap.status == 'open',
+                DataGap.refill_attempts < max_attempts
+            ).order_by(DataGap.gap_start).limit(limit).all()
+        finally:
+            session.close()
+
+    @timed_method()
+    def record_refill(self, symbol, gap_start, status, rows):
+        '''Count a refill attempt of a gap and set its status'''
+        session = Database.get_session()
+        try:
+            session.query(DataGap).filter(DataGap.symbol == symbol, DataGap.gap_start == gap_start).update({
+                DataGap.status: status,
+                DataGap.refill_attempts: DataGap.refill_attempts + 1,
+                DataGap.refilled_rows: DataGap.refilled_rows + rows,
+            }, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def get_gaps(self, symbols=None, status=None):
+        '''Return the recorded gaps as a DataFrame, optionally of some symbols or one status only'''
+        session = Database.get_session()
+        try:
+            query = session.query(DataGap.symbol, DataGap.gap_start, DataGap.gap_end, DataGap.status,
+                                  DataGap.refill_attempts, DataGap.refilled_rows)
+            if symbols:
+                query = query.filter(DataGap.symbol.in_(list(symbols)))
+            if status:
+                query = query.filter(DataGap.status == status)
+            rows = query.order_by(DataGap.symbol, DataGap.gap_start).all()
+            return pd.DataFrame(rows, columns=['symbol', 'gap_start', 'gap_end', 'status', 'refill_attempts',
+                                               'refilled_rows'])
+        finally:
+            session.close()
@@ -1,13 +1,63 @@
-from sqlalchemy import Column, String, TIMESTAMP, Float, JSON, PrimaryKeyConstraint, Integer
+from datetime import timezone
+
+import pandas as pd
+from sqlalchemy import Column, String, TIMESTAMP, Float, JSON, PrimaryKeyConstraint, Integer, Boolean, BigInteger, \
+    LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
 
 Base = declarative_base()
 
+SQLITE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# Bounds of unbounded ranges in SQLite, they sort before and after every timestamp
+SQLITE_MIN_TIMESTAMP = ''
+SQLITE_MAX_TIMESTAMP = '9999-12-31 23:59:59.999999'
+
+def _to_utc(value):
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+def sqlite_timestamp(value):
+    ''' Text form of a timestamp in SQLite: UTC, fixed width, so it sorts and compares like the time '''
+    if value is None:
+        return None
+    return _to_utc(value).strftime(SQLITE_TIMESTAMP_FORMAT)
+
+class UTCTimestamp(TypeDecorator):
+    ''' TIMESTAMP WITH TIME ZONE that SQLite stores as UTC text and returns timezone-aware '''
+    impl = TIMESTAMP(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name == 'sqlite' and value is not None:
+            return _to_utc(value).to_pydatetime().replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
 class RawData(Base):
     __tablename__ = 'raw_data'
     symbol = Column(String, nullable=False)
+    price = Column(Float)
+    # Original API payload, only kept when raw_storage.store_payload is enabled
     data = Column(JSON)
-    timestamp = Column(TIMESTAMP(timezone=True), nullable=False)
+    timestamp = Column(UTCTimestamp(), nullable=False)
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'timestamp'),
+    )
+
+class RawDataRun(Base):
+    # Consecutive data points of a symbol with the same price, when raw_storage.compaction is enabled
+    __tablename__ = 'raw_data_run'
+    symbol = Column(String, nullable=False)
+    # First and last data point of the run
+    timestamp = Column(UTCTimestamp(), nullable=False)
+    last_timestamp = Column(UTCTimestamp(), nullable=False)
+    price = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
     __table_args__ = (
         PrimaryKeyConstraint('symbol', 'timestamp'),
     )
@@ -15,7 +65,7 @@ class RawData(Base):
 class DownsampledData(Base):
     __tablename__ = 'downsampled_data'
     symbol = Column(String, nullable=False)
-    timestamp = Column(TIMESTAMP(timezone=True), nullable=False)
+    timestamp = Column(UTCTimestamp(), nullable=False)
     avg_price = Column(Float)
     median_price = Column(Float)
     __table_args__ = (
@@ -26,4 +76,116 @@ class IngestionState(Base):
     __tablename__ = 'ingestion_state'
     id = Column(Integer, primary_key=True, autoincrement=True)
     symbol = Column(String, unique=True, nullable=False)
-    collected_points = Column(Integer, nullable=False, default=0)
\ No newline at end of file
+    collected_points = Column(Integer, nullable=False, default=0)
+
+class TransformWatermark(Base):
+    __tablename__ = 'transform_watermark'
+    symbol = Column(String, nullable=False)
+    # Name of the output the watermark belongs to, e.g. 'downsampled_data'
+    stage = Column(String, nullable=False)
+    # End of the last fully closed window that has been transformed
+    watermark = Column(UTCTimestamp(), nullable=False)
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'stage'),
+    )
+
+class RollupData(Base):
+    __tablename__ = 'rollup_data'
+    symbol = Column(String, nullable=False)
+    # Bucket width in minutes
+    resolution = Column(Integer, nullable=False)
+    timestamp = Column(UTCTimestamp(), nullable=False)
+    open = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    mean = Column(Float, nullable=False)
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'resolution', 'timestamp'),
+    )
+
+class AggregateData(Base):
+    # Aggregations of a downsampled_data window or rollup_data bucket chosen in the aggregations config
+    __tablename__ = 'aggregate_data'
+    # Output table the window belongs to
+    table_name = Column(String, nullable=False)
+    symbol = Column(String, nullable=False)
+    # Window width in minutes
+    resolution = Column(Integer, nullable=False)
+    timestamp = Column(UTCTimestamp(), nullable=False)
+    # Mergeable partial states, only those the configured aggregations need are set
+    count = Column(BigInteger)
+    sum = Column(Float)
+    min = Column(Float)
+    max = Column(Float)
+    # Sum of squared deviations from the mean
+    m2 = Column(Float)
+    # Quantile sketch of the prices, see transformation/aggregations.py
+    sketch = Column(LargeBinary)
+    # Value of every configured aggregation by name
+    aggregates = Column(JSON, nullable=False)
+    __table_args__ = (
+        PrimaryKeyConstraint('table_name', 'symbol', 'resolution', 'timestamp'),
+    )
+
+class BackfillProgress(Base):
+    __tablename__ = 'backfill_progress'
+    symbol = Column(String, nullable=False)
+    # Endpoint the range is read from, e.g. 'klines_1m' or 'aggTrades'
+    source = Column(String, nullable=False)
+    range_start = Column(UTCTimestamp(), nullable=False)
+    range_end = Column(UTCTimestamp(), nullable=False)
+    # Everything before the cursor has been stored
+    cursor = Column(UTCTimestamp(), nullable=False)
+    completed = Column(Boolean, nullable=False, default=False)
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'source', 'range_start'),
+    )
+
+class ClusterNode(Base):
+    __tablename__ = 'cluster_node'
+    node_id = Column(String, primary_key=True)
+    # Last time the node announced itself, nodes that stop are dropped after the lease TTL
+    heartbeat = Column(UTCTimestamp(), nullable=False)
+
+class ShardLease(Base):
+    __tablename__ = 'shard_lease'
+    shard = Column(Integer, primary_key=True)
+    node_id = Column(String, nullable=False)
+    expires_at = Column(UTCTimestamp(), nullable=False)
+
+class TableStats(Base):
+    # Per-symbol statistics of a data table, kept up to date by the write paths
+    __tablename__ = 'table_stats'
+    table_name = Column(String, nullable=False)
+    symbol = Column(String, nullable=False)
+    row_count = Column(BigInteger, nullable=False)
+    # Oldest and newest timestamp written, retention moves the first one up
+    first_timestamp = Column(UTCTimestamp())
+    last_timestamp = Column(UTCTimestamp())
+    # Seconds between the newest data point and its write
+    last_ingest_latency = Column(Float)
+    # Share of the table size by row count, PostgreSQL only
+    bytes = Column(BigInteger)
+    updated_at = Column(UTCTimestamp(), nullable=False)
+    __table_args__ = (
+        PrimaryKeyConstraint('table_name', 'symbol'),
+    )
+
+class DataGap(Base):
+    # Pause in the raw data points of a symbol, found by the gap detector
+    __tablename__ = 'data_gaps'
+    symbol = Column(String, nullable=False)
+    # Last data point before and first data point after the gap
+    gap_start = Column(UTCTimestamp(), nullable=False)
+    gap_end = Column(UTCTimestamp(), nullable=False)
+    detected_at = Column(UTCTimestamp(), nullable=False)
+    # open, filled or failed
+    status = Column(String, nullable=False, default='open')
+    refill_attempts = Column(Integer, nullable=False, default=0)
+    refilled_rows = Column(Integer, nullable=False, default=0)
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'gap_start'),
+    )
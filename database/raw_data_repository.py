@@ -1,48 +1,313 @@
+import io
+import itertools
+import json
+
+import numpy as np
 import pandas as pd
+from psycopg2.extras import Json, execute_values
 from sqlalchemy import text
 
-from database.models import RawData, Base
+from database.models import RawData, Base, SQLITE_MAX_TIMESTAMP, SQLITE_MIN_TIMESTAMP, sqlite_timestamp
 from database.database import Database
+from database.stats_catalog import STATS_COLLECTOR
+from utils.metrics import timed_method, ROWS_WRITTEN
+
+def parse_price(data):
+    """Return the payload price as a float, or None if it is missing or not numeric."""
+    try:
+        return float(data['price'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+# Header and trailer of the binary COPY format
+COPY_HEADER_BYTES = 19
+COPY_TRAILER_BYTES = 2
 
 class RawDataRepository:
-    def __init__(self):
+    # Table and columns the fetch queries read
+    table = 'raw_data'
+    columns = 'rd.timestamp, rd.price, rd.symbol'
+    # First and last timestamp of the data points of a row
+    span_columns = ('timestamp',)
+
+    def __init__(self, store_payload=False):
         self.engine = Database.get_engine()
         Base.metadata.create_all(self.engine)
+        self.store_payload = store_payload
+        self.sqlite = Database.is_sqlite()
 
+    @timed_method()
     def insert_raw_data(self, symbol, data, timestamp):
         session = Database.get_session()
         try:
-            raw_data = RawData(symbol=symbol, data=data, timestamp=timestamp)
+            raw_data = RawData(
+                symbol=symbol,
+                price=parse_price(data),
+                data=data if self.store_payload else None,
+                timestamp=timestamp
+            )
             session.add(raw_data)
             session.commit()
+            ROWS_WRITTEN.labels('raw_data').inc()
+            STATS_COLLECTOR.record('raw_data', symbol, 1, timestamp, timestamp)
         except Exception as e:
             session.rollback()
             raise e
         finally:
             session.close()
 
-    def fetch_unprocessed_data(self, symbol):
+    @timed_method()
+    def insert_raw_data_bulk(self, rows):
+        """Insert (symbol, data, timestamp) rows with one multi-row statement."""
+        if not rows:
+            return 0
+        if self.sqlite:
+            return self._insert_raw_data_bulk_sqlite(rows)
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    "INSERT INTO raw_data (symbol, price, data, timestamp) VALUES %s "
+                    "ON CONFLICT (symbol, timestamp) DO NOTHING",
+                    [
+                        (symbol, parse_price(data), Json(data) if self.store_payload else None, timestamp)
+                        for symbol, data, timestamp in rows
+                    ],
+                    page_size=len(rows)
+                )
+            connection.commit()
+            ROWS_WRITTEN.labels('raw_data').inc(len(rows))
+            STATS_COLLECTOR.record_rows('raw_data', ((symbol, timestamp) for symbol, _, timestamp in rows))
+            return len(rows)
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            connection.close()
+
+    def _insert_raw_data_bulk_sqlite(self, rows):
+        # One transaction per batch, the WAL is synced once per commit
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.executemany(
+                "INSERT OR IGNORE INTO raw_data (symbol, price, data, timestamp) VALUES (?, ?, ?, ?)",
+                [
+                    (symbol, parse_price(data), json.dumps(data) if self.store_payload else None,
+                     sqlite_timestamp(timestamp))
+                    for symbol, data, timestamp in rows
+                ]
+            )
+            cursor.close()
+            connection.commit()
+            ROWS_WRITTEN.labels('raw_data').inc(len(rows))
+            STATS_COLLECTOR.record_rows('raw_data', ((symbol, timestamp) for symbol, _, timestamp in rows))
+            return len(rows)
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            connection.close()
+
+    @timed_method()
+    def fetch_unprocessed_data(self, symbol, start=None, end=None):
+        """Fetch the rows of one symbol with start <= timestamp < end (unbounded if None)."""
+        if self.sqlite:
+            return self._fetch_sqlite(f'''
+                SELECT {self.columns}
+                FROM {self.table} rd
+                WHERE rd.symbol = :symbol
+                AND rd.timestamp >= COALESCE(:start, :min_timestamp)
+                AND rd.timestamp < COALESCE(:end, :max_timestamp)
+                ORDER BY rd.timestamp ASC
+            ''', {'symbol': symbol, 'start': sqlite_timestamp(start), 'end': sqlite_timestamp(end)})
         session = Database.get_session()
         try:
-            query = text('''
-                SELECT rd.timestamp, rd.data->>'price' AS price, rd.symbol
-                FROM raw_data rd
+            query = text(f'''
+                SELECT {self.columns}
+                FROM {self.table} rd
                 WHERE rd.symbol = :symbol
-                AND rd.timestamp > (
-                    SELECT COALESCE(MAX(timestamp), '1970-01-01') FROM downsampled_data WHERE symbol = :symbol
-                )
+                AND rd.timestamp >= COALESCE(CAST(:start AS TIMESTAMPTZ), '-infinity')
+                AND rd.timestamp < COALESCE(CAST(:end AS TIMESTAMPTZ), 'infinity')
                 ORDER BY rd.timestamp ASC
             ''')
-            params = {'symbol': symbol}
+            params = {'symbol': symbol, 'start': start, 'end': end}
             df = pd.read_sql_query(query, session.bind, params=params)
             if df.empty:
                 return df
             df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df['price'] = pd.to_numeric(df['price'])
-            return df
+            return self._finish_frame(df)
         finally:
             session.close()
 
+    @timed_method()
+    def fetch_unprocessed_data_all(self, symbols, watermarks=None, end=None):
+        """Fetch the rows of many symbols with one query.
+
+        Each symbol is read from its own watermark (or from the beginning if it
+        has none) up to the shared end, as one index range scan per symbol.
+        """
+        watermarks = watermarks or {}
+        symbols = list(symbols)
+        if self.sqlite:
+            # json_each stands in for unnest, the bounds are one parameter however many symbols there are
+            return self._fetch_sqlite(f'''
+                WITH wm AS (
+                    SELECT json_extract(value, '$[0]') AS symbol, json_extract(value, '$[1]') AS watermark
+                    FROM json_each(:bounds)
+                )
+                SELECT {self.columns}
+                FROM wm
+                JOIN {self.table} rd ON rd.symbol = wm.symbol
+                AND rd.timestamp >= COALESCE(wm.watermark, :min_timestamp)
+                AND rd.timestamp < COALESCE(:end, :max_timestamp)
+                ORDER BY rd.symbol, rd.timestamp ASC
+            ''', {
+                'bounds': json.dumps([[symbol, sqlite_timestamp(watermarks.get(symbol))] for symbol in symbols]),
+                'end': sqlite_timestamp(end)
+            })
+        session = Database.get_session()
+        try:
+            query = text(f'''
+                SELECT {self.columns}
+                FROM unnest(CAST(:symbols AS VARCHAR[]), CAST(:watermarks AS TIMESTAMPTZ[]))
+                    AS wm(symbol, watermark)
+                JOIN {self.table} rd ON rd.symbol = wm.symbol
+                AND rd.timestamp >= COALESCE(wm.watermark, '-infinity')
+                AND rd.timestamp < COALESCE(CAST(:end AS TIMESTAMPTZ), 'infinity')
+                ORDER BY rd.symbol, rd.timestamp ASC
+            ''')
+            params = {
+                'symbols': symbols,
+                'watermarks': [watermarks.get(symbol) for symbol in symbols],
+                'end': end
+            }
+            df = pd.read_sql_query(query, session.bind, params=params)
+            if df.empty:
+                return df
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            return self._finish_frame(df)
+        finally:
+            session.close()
+
+    @timed_method()
+    def fetch_timestamps(self, symbol, start, end):
+        """Return (first, last) epoch microsecond arrays of the rows with start <= timestamp < end.
+
+        Only primary key columns are read, so the query is an index-only range
+        scan. On PostgreSQL the values are streamed with a binary COPY and
+        decoded by NumPy without creating a Python object per row. Every
+        raw_data row is one data point, so first and last are the same array.
+        """
+        if self.sqlite:
+            # Timestamps are stored as '%Y-%m-%d %H:%M:%S.%f' text
+            columns = ', '.join(
+                f"CAST(strftime('%s', {column}) AS INTEGER) * 1000000 + CAST(substr({column}, 21, 6) AS INTEGER)"
+                for column in self.span_columns
+            )
+            # Plain sqlite3 tuples, SQLAlchemy rows are several times slower to convert
+            connection = self.engine.raw_connection()
+            try:
+                rows = connection.cursor().execute(f'''
+                    SELECT {columns} FROM {self.table}
+                    WHERE symbol = :symbol AND timestamp >= :start AND timestamp < :end
+                    ORDER BY timestamp ASC
+                ''', {'symbol': symbol, 'start': sqlite_timestamp(start), 'end': sqlite_timestamp(end)}).fetchall()
+            finally:
+                connection.close()
+            values = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64,
+                                 count=len(rows) * len(self.span_columns)).reshape(-1, len(self.span_columns))
+            arrays = [values[:, i] for i in range(len(self.span_columns))]
+        else:
+            columns = ', '.join(f'(EXTRACT(EPOCH FROM {column}) * 1000000)::BIGINT' for column in self.span_columns)
+            arrays = self._copy_int64(f'''
+                SELECT {columns} FROM {self.table}
+                WHERE symbol = %(symbol)s AND timestamp >= %(start)s AND timestamp < %(end)s
+                ORDER BY timestamp ASC
+            ''', {'symbol': symbol, 'start': start, 'end': end}, len(self.span_columns))
+        return arrays[0], arrays[-1]
+
+    def _copy_int64(self, query, params, columns):
+        connection = self.engine.raw_connection()
+        try:
+            buffer = io.BytesIO()
+            with connection.cursor() as cursor:
+                query = cursor.mogrify(query, params).decode()
+                cursor.copy_expert(f'COPY ({query}) TO STDOUT (FORMAT binary)', buffer)
+            connection.rollback()
+        finally:
+            connection.close()
+        # Every row is a field count followed by the length and value of each field
+        row_type = np.dtype([('fields', '>i2')] + [
+            field for i in range(columns) for field in ((f'length{i}', '>i4'), (f'value{i}', '>i8'))
+        ])
+        data = buffer.getbuffer()
+        rows = np.frombuffer(data[COPY_HEADER_BYTES:len(data) - COPY_TRAILER_BYTES], dtype=row_type)
+        return [rows[f'value{i}'].astype(np.int64) for i in range(columns)]
+
+    @timed_method()
+    def delete_raw_data_before(self, symbol, cutoff, batch_size):
+        """Delete up to batch_size of the oldest rows of symbol older than cutoff.
+
+        The batch is selected by primary key order, so every call is a short
+        index range scan in its own transaction. Returns the number of rows deleted.
+        """
+        session = Database.get_session()
+        try:
+            if self.sqlite:
+                query = text('''
+                    DELETE FROM raw_data
+                    WHERE (symbol, timestamp) IN (
+                        SELECT symbol, timestamp
+                        FROM raw_data
+                        WHERE symbol = :symbol AND timestamp < :cutoff
+                        ORDER BY timestamp ASC
+                        LIMIT :batch_size
+                    )
+                ''')
+            else:
+                query = text('''
+                    WITH batch AS (
+                        SELECT symbol, timestamp
+                        FROM raw_data
+                        WHERE symbol = :symbol AND timestamp < :cutoff
+                        ORDER BY timestamp ASC
+                        LIMIT :batch_size
+                    )
+                    DELETE FROM raw_data rd
+                    USING batch
+                    WHERE rd.symbol = batch.symbol AND rd.timestamp = batch.timestamp
+                ''')
+            result = session.execute(query, {
+                'symbol': symbol, 'cutoff': sqlite_timestamp(cutoff) if self.sqlite else cutoff, 'batch_size': batch_size
+            })
+            session.commit()
+            # Once a batch comes up short, no row older than the cutoff is left
+            STATS_COLLECTOR.record_delete('raw_data', symbol, result.rowcount,
+                                          cutoff if result.rowcount < batch_size else None)
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def _fetch_sqlite(self, query, params):
+        session = Database.get_session()
+        try:
+            params = dict(params, min_timestamp=SQLITE_MIN_TIMESTAMP, max_timestamp=SQLITE_MAX_TIMESTAMP)
+            df = pd.read_sql_query(text(query), session.bind, params=params)
+            if df.empty:
+                return df
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            return self._finish_frame(df)
+        finally:
+            session.close()
+
+    def _finish_frame(self, df):
+        return df
+
     def delete_all_raw_data(self):
         session = Database.get_session()
         try:
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+
+from database.raw_data_repository import RawDataRepository
+from utils.logger import get_logger
+
+class RawDataWriter:
+    """Write-behind buffer for raw data points.
+
+    Ingestion threads enqueue rows through insert_raw_data, which has the same
+    signature as RawDataRepository.insert_raw_data. A background flusher
+    drains the queue and writes it with one bulk insert whenever batch_size
+    rows are buffered or flush_interval seconds have passed. When the queue is
+    full, producers block for up to put_timeout seconds (backpressure) and then
+    get a queue.Full error. A batch whose insert fails is retried up to
+    max_retries times, retry_backoff seconds later and twice as long after
+    each further failure, before its rows are counted as failed.
+    """
+
+    def __init__(self, repository=None, batch_size=1000, flush_interval=1.0,
+                 max_queue_size=100000, put_timeout=5.0, max_retries=3, retry_backoff=1.0):
+        self.repository = repository or RawDataRepository()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.logger = get_logger(self.__class__.__name__)
+        self._stop_event = threading.Event()
+        self._thread = None
+        # (due, rows, attempts) of failed batches, only used by the flusher thread
+        self._retries = []
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'flushes': 0,
+            'rows_written': 0,
+            'rows_failed': 0,
+            'retries': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0,
+        }
+
+    @classmethod
+    def from_config(cls, config, repository=None):
+        writer_config = config.get('raw_writer', {})
+        return cls(
+            repository=repository,
+            batch_size=writer_config.get('batch_size', 1000),
+            flush_interval=writer_config.get('flush_interval', 1.0),
+            max_queue_size=writer_config.get('max_queue_size', 100000),
+            put_timeout=writer_config.get('put_timeout', 5.0),
+            max_retries=writer_config.get('max_retries', 3),
+            retry_backoff=writer_config.get('retry_backoff', 1.0)
+        )
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher after writing every row that is still queued or waiting for a retry."""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.logger.info("Raw data writer stopped: %s", self.get_stats())
+
+    def insert_raw_data(self, symbol, data, timestamp):
+        self.queue.put((symbol, data, timestamp), timeout=self.put_timeout)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_size'] = self.queue.qsize()
+        stats['retry_rows'] = sum(len(rows) for _, rows, _ in list(self._retries))
+        stats['avg_flush_seconds'] = (
+            stats['total_flush_seconds'] / stats['flushes'] if stats['flushes'] else 0.0
+        )
+        return stats
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self.queue.get(timeout=min(timeout, 0.1)))
+                batch.extend(self._drain(self.batch_size - len(batch)))
+            except queue.Empty:
+                pass
+
+            self._retry_due()
+            stopping = self._stop_event.is_set()
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline or stopping:
+                if stopping:
+                    batch.extend(self._drain())
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                if stopping and self.queue.empty():
+                    # The retries are bounded, so this ends
+                    while self._retries:
+                        time.sleep(max(0.0, min(due for due, _, _ in self._retries) - time.monotonic()))
+                        self._retry_due()
+                    return
+
+    def _drain(self, limit=None):
+        rows = []
+        while limit is None or len(rows) < limit:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                return rows
+        return rows
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+
+    def _retry_due(self):
+        """Write the failed batches whose backoff has passed."""
+        if not self._retries:
+            return
+        now = time.monotonic()
+        due = [retry for retry in self._retries if retry[0] <= now]
+        self._retries = [retry for retry in self._retries if retry[0] > now]
+        for _, rows, attempts in due:
+            self._write(rows, attempts)
+
+    def _write(self, rows, attempts=0):
+        start_time = time.perf_counter()
+        try:
+            self.repository.insert_raw_data_bulk(rows)
+        except Exception as e:
+            if attempts >= self.max_retries:
+                self.logger.error("Error flushing %d raw data rows, giving up after %d retries: %s",
+                                  len(rows), attempts, e)
+                with self._stats_lock:
+                    self._stats['rows_failed'] += len(rows)
+                return
+            delay = self.retry_backoff * 2 ** attempts
+            self.logger.warning("Error flushing %d raw data rows, retrying in %.1fs: %s", len(rows), delay, e)
+            self._retries.append((time.monotonic() + delay, rows, attempts + 1))
+            with self._stats_lock:
+                self._stats['retries'] += 1
+            return
+        elapsed = time.perf_counter() - start_time
+        with self._stats_lock:
+            self._stats['flushes'] += 1
+            self._stats['rows_written'] += len(rows)
+            self._stats['last_batch_size'] = len(rows)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(rows))
+            self._stats['last_flush_seconds'] = elapsed
+            self._stats['max_flush_seconds'] = max(self._stats['max_flush_seconds'], elapsed)
+            self._stats['total_flush_seconds'] += elapsed
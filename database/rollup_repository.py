@@ -0,0 +1,134 @@
+import json
+
+import pandas as pd
+from sqlalchemy import text
+from database.models import RollupData, Base, SQLITE_MAX_TIMESTAMP, SQLITE_MIN_TIMESTAMP, sqlite_timestamp
+from database.database import Database
+from utils.metrics import timed_method, ROWS_WRITTEN
+
+# 10 columns per row, stay below the PostgreSQL limit of 65535 bind parameters
+MAX_ROWS_PER_STATEMENT = 5000
+
+ROLLUP_COLUMNS = ['symbol', 'resolution', 'timestamp', 'open', 'high', 'low', 'close', 'count', 'sum', 'mean']
+
+def rollup_stage(resolution):
+    '''Watermark stage name of a rollup level'''
+    return f'rollup_{resolution}m'
+
+class RollupRepository:
+    def __init__(self):
+        self.engine = Database.get_engine()
+        Base.metadata.create_all(self.engine)
+        self.sqlite = Database.is_sqlite()
+
+    @timed_method()
+    def insert_rollups(self, df_rollups):
+        session = Database.get_session()
+        try:
+            records = df_rollups[ROLLUP_COLUMNS].to_dict(orient='records')
+            rows_per_statement = Database.rows_per_statement(len(ROLLUP_COLUMNS), MAX_ROWS_PER_STATEMENT)
+            for start in range(0, len(records), rows_per_statement):
+                stmt = Database.insert(RollupData.__table__).values(records[start:start + rows_per_statement])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['symbol', 'resolution', 'timestamp'],
+                    set_={column: stmt.excluded[column] for column in ROLLUP_COLUMNS[3:]}
+                )
+                session.execute(stmt)
+            session.commit()
+            ROWS_WRITTEN.labels('rollup_data').inc(len(records))
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def fetch_rollups(self, symbol, resolution, start=None, end=None):
+        '''Fetch the buckets of one symbol and resolution with start <= timestamp < end'''
+        session = Database.get_session()
+        try:
+            if self.sqlite:
+                query = text('''
+                    SELECT symbol, resolution, timestamp, open, high, low, close, count, sum, mean
+                    FROM rollup_data
+                    WHERE symbol = :symbol AND resolution = :resolution
+                    AND timestamp >= COALESCE(:start, :min_timestamp)
+                    AND timestamp < COALESCE(:end, :max_timestamp)
+                    ORDER BY timestamp ASC
+                ''')
+                params = {'symbol': symbol, 'resolution': resolution, 'start': sqlite_timestamp(start),
+                          'end': sqlite_timestamp(end), 'min_timestamp': SQLITE_MIN_TIMESTAMP,
+                          'max_timestamp': SQLITE_MAX_TIMESTAMP}
+            else:
+                query = text('''
+                    SELECT symbol, resolution, timestamp, open, high, low, close, count, sum, mean
+                    FROM rollup_data
+                    WHERE symbol = :symbol AND resolution = :resolution
+                    AND timestamp >= COALESCE(CAST(:start AS TIMESTAMPTZ), '-infinity')
+                    AND timestamp < COALESCE(CAST(:end AS TIMESTAMPTZ), 'infinity')
+                    ORDER BY timestamp ASC
+                ''')
+                params = {'symbol': symbol, 'resolution': resolution, 'start': start, 'end': end}
+            df = pd.read_sql_query(query, session.bind, params=params)
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            return df
+        finally:
+            session.close()
+
+    @timed_method()
+    def fetch_rollups_all(self, resolution, symbols, starts, ends):
+        '''Fetch the buckets of many symbols, each from starts[symbol] (or the beginning) to ends[symbol]'''
+        symbols = list(symbols)
+        if self.sqlite:
+            return self._fetch_rollups_all_sqlite(resolution, symbols, starts, ends)
+        session = Database.get_session()
+        try:
+            query = text('''
+                SELECT r.symbol, r.resolution, r.timestamp, r.open, r.high, r.low, r.close, r.count, r.sum, r.mean
+                FROM unnest(CAST(:symbols AS VARCHAR[]), CAST(:starts AS TIMESTAMPTZ[]),
+                            CAST(:ends AS TIMESTAMPTZ[])) AS bounds(symbol, start_ts, end_ts)
+                JOIN rollup_data r ON r.symbol = bounds.symbol AND r.resolution = :resolution
+                AND r.timestamp >= COALESCE(bounds.start_ts, '-infinity')
+                AND r.timestamp < bounds.end_ts
+                ORDER BY r.symbol, r.timestamp ASC
+            ''')
+            params = {
+                'resolution': resolution,
+                'symbols': symbols,
+                'starts': [starts.get(symbol) for symbol in symbols],
+                'ends': [ends[symbol] for symbol in symbols]
+            }
+            df = pd.read_sql_query(query, session.bind, params=params)
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            return df
+        finally:
+            session.close()
+
+    def _fetch_rollups_all_sqlite(self, resolution, symbols, starts, ends):
+        session = Database.get_session()
+        try:
+            query = text('''
+                WITH bounds AS (
+                    SELECT json_extract(value, '$[0]') AS symbol, json_extract(value, '$[1]') AS start_ts,
+                           json_extract(value, '$[2]') AS end_ts
+                    FROM json_each(:bounds)
+                )
+                SELECT r.symbol, r.resolution, r.timestamp, r.open, r.high, r.low, r.close, r.count, r.sum, r.mean
+                FROM bounds
+                JOIN rollup_data r ON r.symbol = bounds.symbol AND r.resolution = :resolution
+                AND r.timestamp >= COALESCE(bounds.start_ts, :min_timestamp)
+                AND r.timestamp < bounds.end_ts
+                ORDER BY r.symbol, r.timestamp ASC
+            ''')
+            params = {
+                'resolution': resolution,
+                'bounds': json.dumps([
+                    [symbol, sqlite_timestamp(starts.get(symbol)), sqlite_timestamp(ends[symbol])] for symbol in symbols
+                ]),
+                'min_timestamp': SQLITE_MIN_TIMESTAMP
+            }
+            df = pd.read_sql_query(query, session.bind, params=params)
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+            return df
+        finally:
+            session.close()
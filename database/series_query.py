@@ -0,0 +1,184 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.rollup_repository import RollupRepository, rollup_stage
+from database.watermark_repository import WatermarkRepository, DOWNSAMPLED_STAGE
+
+DOWNSAMPLED_SERIES_COLUMNS = ['timestamp', 'avg_price', 'median_price']
+ROLLUP_SERIES_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'count', 'sum', 'mean']
+
+class SeriesQuery:
+    ''' Read API for downsampled_data and rollup_data with an in-process cache
+
+    The time axis is split into epoch-aligned chunks of chunk_buckets buckets.
+    Buckets before the transform watermark of their symbol can no longer
+    change, so they are cached per chunk as NumPy arrays and served from
+    memory afterwards; a chunk the watermark is still inside is extended as
+    the watermark moves. Only the open tail after the watermark is read from
+    the database on every call. Cached chunks are evicted least recently used first once more
+    than max_rows rows are held.
+    '''
+
+    def __init__(self, config, downsampled_repo=None, rollup_repo=None, watermark_repo=None):
+        self.config = config
+        cache_config = config.get('series_cache', {})
+        self.max_rows = cache_config.get('max_rows', 1000000)
+        self.chunk_buckets = cache_config.get('chunk_buckets', 1440)
+        self.base_resolution = config['downsampling_frequency']
+        self.downsampled_repo = downsampled_repo or DownsampledDataRepository()
+        self.rollup_repo = rollup_repo
+        self.watermark_repo = watermark_repo or WatermarkRepository()
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._cached_rows = 0
+        self._lock = threading.Lock()
+
+    def get_series(self, symbols, start, end, resolution=None, as_arrays=False):
+        '''Return the buckets of symbols with start <= timestamp < end
+
+        resolution is in minutes and defaults to downsampling_frequency, which
+        reads downsampled_data; other resolutions read rollup_data. The result
+        is a DataFrame sorted by symbol and timestamp, or with as_arrays a dict
+        of {symbol: {column: numpy array}} with int64 nanosecond timestamps.
+        '''
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        resolution = resolution or self.base_resolution
+        start, end = self._to_utc(start), self._to_utc(end)
+        watermarks = self.watermark_repo.get_watermarks(symbols, stage=self._stage(resolution))
+        series = {
+            symbol: self._symbol_series(symbol, start, end, resolution, watermarks.get(symbol))
+            for symbol in symbols
+        }
+        if as_arrays:
+            return series
+        counts = [len(arrays['timestamp']) for arrays in series.values()]
+        data = {'symbol': np.repeat(np.array(list(series), dtype=object), counts)}
+        for column in self._columns(resolution):
+            data[column] = np.concatenate([arrays[column] for arrays in series.values()])
+        data['timestamp'] = pd.DatetimeIndex(data['timestamp'].view('datetime64[ns]')).tz_localize('UTC')
+        df = pd.DataFrame(data)
+        return df
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_chunks': len(self._cache),
+                'cached_rows': self._cached_rows
+            }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cached_rows = 0
+
+    def _symbol_series(self, symbol, start, end, resolution, watermark):
+        width = pd.Timedelta(minutes=resolution * self.chunk_buckets)
+        closed_end = min(self._to_utc(watermark), end) if watermark is not None else start
+        chunk_start = start.floor(f'{resolution * self.chunk_buckets}T')
+
+        # Closed buckets come from the cache, consecutive misses are read with one query
+        parts, missing = [], []
+        while chunk_start < closed_end:
+            key = (symbol, resolution, chunk_start)
+            chunk_end = min(chunk_start + width, closed_end)
+            chunk = self._get_cached(key, chunk_end)
+            if chunk is None:
+                missing.append(chunk_start)
+            else:
+                if missing:
+                    parts.append(self._load_chunks(symbol, resolution, missing, width, closed_end))
+                    missing = []
+                parts.append(chunk)
+            chunk_start += width
+        if missing:
+            parts.append(self._load_chunks(symbol, resolution, missing, width, closed_end))
+
+        if closed_end < end:
+            # Open tail after the watermark, never cached
+            parts.append(self._fetch(symbol, resolution, max(closed_end, start), end))
+
+        columns = self._columns(resolution)
+        if not parts:
+            return {column: np.empty(0, dtype='int64' if column == 'timestamp' else 'float64') for column in columns}
+        # Only the first and last part can stick out of the range
+        parts[0] = self._slice(parts[0], start, end)
+        parts[-1] = self._slice(parts[-1], start, end)
+        return {column: np.concatenate([part[column] for part in parts]) for column in columns}
+
+    def _load_chunks(self, symbol, resolution, chunk_starts, width, closed_end):
+        load_end = min(chunk_starts[-1] + width, closed_end)
+        arrays = self._fetch(symbol, resolution, chunk_starts[0], load_end)
+        for chunk_start in chunk_starts:
+            chunk_end = min(chunk_start + width, closed_end)
+            self._put_cached((symbol, resolution, chunk_start), self._slice(arrays, chunk_start, chunk_end), chunk_end)
+        return arrays
+
+    def _fetch(self, symbol, resolution, start, end):
+        if resolution == self.base_resolution:
+            df = self.downsampled_repo.fetch_downsampled_data(symbol, start, end)
+        else:
+            if self.rollup_repo is None:
+                self.rollup_repo = RollupRepository()
+            df = self.rollup_repo.fetch_rollups(symbol, resolution, start, end)
+        arrays = {column: df[column].to_numpy() for column in self._columns(resolution) if column != 'timestamp'}
+        # Nanoseconds since the epoch in UTC
+        arrays['timestamp'] = df['timestamp'].values.astype('datetime64[ns]').astype('int64')
+        return arrays
+
+    @staticmethod
+    def _slice(arrays, start, end):
+        lower, upper = arrays['timestamp'].searchsorted([start.value, end.value])
+        if lower == 0 and upper == len(arrays['timestamp']):
+            return arrays
+        return {column: values[lower:upper] for column, values in arrays.items()}
+
+    def _columns(self, resolution):
+        if resolution == self.base_resolution:
+            return DOWNSAMPLED_SERIES_COLUMNS
+        return ROLLUP_SERIES_COLUMNS
+
+    def _get_cached(self, key, closed_end):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            chunk, covered_until = entry
+        if covered_until >= closed_end:
+            return chunk
+        # The chunk was still open when it was cached, read only the buckets closed since
+        symbol, resolution, _ = key
+        extension = self._fetch(symbol, resolution, covered_until, closed_end)
+        chunk = {column: np.concatenate([chunk[column], extension[column]]) for column in chunk}
+        self._put_cached(key, chunk, closed_end)
+        return chunk
+
+    def _put_cached(self, key, chunk, covered_until):
+        with self._lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                # Empty chunks still take an entry
+                self._cached_rows -= max(len(previous[0]['timestamp']), 1)
+            self._cache[key] = (chunk, covered_until)
+            self._cached_rows += max(len(chunk['timestamp']), 1)
+            while self._cached_rows > self.max_rows and len(self._cache) > 1:
+                _, (evicted, _) = self._cache.popitem(last=False)
+                self._cached_rows -= max(len(evicted['timestamp']), 1)
+
+    def _stage(self, resolution):
+        return DOWNSAMPLED_STAGE if resolution == self.base_resolution else rollup_stage(resolution)
+
+    @staticmethod
+    def _to_utc(value):
+        value = pd.Timestamp(value)
+        return value.tz_localize('UTC') if value.tz is None else value.tz_convert('UTC')
@@ -1,6 +1,7 @@
 from .models import IngestionState
 from .database import Database
 from utils.logger import get_logger
+from utils.metrics import timed_method
 
 class StateRepository:
     def __init__(self):
@@ -9,31 +10,37 @@ class StateRepository:
         Base.metadata.create_all(self.engine)
         self.logger = get_logger(self.__class__.__name__)
 
-    def get_collected_points(self, symbol):
+    @timed_method()
+    def load_collected_points(self):
+        """Return the persisted collected points of every symbol as a dict."""
         session = Database.get_session()
         try:
-            state = session.query(IngestionState).filter_by(symbol=symbol).first()
-            return state.collected_points if state else 0
+            rows = session.query(IngestionState.symbol, IngestionState.collected_points).all()
+            return {symbol: collected_points for symbol, collected_points in rows}
         finally:
             session.close()
 
-    def update_collected_points(self, symbol):
+    @timed_method()
+    def save_collected_points(self, collected_points):
+        """Upsert the collected points of many symbols in one statement."""
+        if not collected_points:
+            return
         session = Database.get_session()
         try:
-            state = session.query(IngestionState).filter_by(symbol=symbol).first()
-            if state:
-                state.collected_points += 1
-                self.logger.debug("Incremented collected points for %s: %d", symbol, state.collected_points)
-            else:
-                state = IngestionState(symbol=symbol, collected_points=1)  # Initialize to 1
-                session.add(state)
-                self.logger.debug("Created new IngestionState for %s with collected_points=1", symbol)
+            records = [
+                {'symbol': symbol, 'collected_points': points}
+                for symbol, points in collected_points.items()
+            ]
+            stmt = Database.insert(IngestionState.__table__).values(records)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['symbol'],
+                set_={'collected_points': stmt.excluded.collected_points}
+            )
+            session.execute(stmt)
             session.commit()
-            self.logger.info("Updated collected points for %s", symbol)
-            self.logger.info("Collected points: %d", state.collected_points)
-            return state.collected_points
+            self.logger.debug("Saved collected points for %d symbols", len(records))
         except Exception as e:
-            self.logger.error("Error updating collected points for %s: %s", symbol, e)
+            self.logger.error("Error saving collected points: %s", e)
             session.rollback()
             raise e
         finally:
@@ -0,0 +1,271 @@
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+from sqlalchemy import and_, case, func, or_, text
+
+from database.models import TableStats, Base, sqlite_timestamp
+from database.database import Database
+from utils.metrics import timed_method
+
+class StatsCollector:
+    ''' Accumulates what the write paths did per table and symbol until it is flushed to table_stats
+
+    Repositories report every committed write and delete here, which only
+    updates a dict, and the deltas are upserted to the catalog every
+    stats_catalog.flush_interval seconds. Rows dropped as duplicates by ON
+    CONFLICT and re-emitted windows are counted as written, so row counts
+    are estimates; audit_db --exact --refresh replaces them with exact ones.
+    '''
+
+    def __init__(self):
+        # (table, symbol) -> {'rows', 'first', 'last', 'latency', 'floor'}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def record(self, table, symbol, rows, first, last):
+        '''Count rows written to table with timestamps in [first, last]'''
+        latency = (datetime.now(timezone.utc) - pd.Timestamp(last)).total_seconds()
+        self._merge((table, symbol), {'rows': rows, 'first': pd.Timestamp(first), 'last': pd.Timestamp(last),
+                                      'latency': latency, 'floor': None})
+
+    def record_rows(self, table, rows):
+        '''Count the (symbol, timestamp) pairs written to table'''
+        summary = {}
+        for symbol, timestamp in rows:
+            entry = summary.get(symbol)
+            if entry is None:
+                summary[symbol] = [1, timestamp, timestamp]
+            else:
+                entry[0] += 1
+                entry[1] = min(entry[1], timestamp)
+                entry[2] = max(entry[2], timestamp)
+        for symbol, (count, first, last) in summary.items():
+            self.record(table, symbol, count, first, last)
+
+    def record_frame(self, table, df):
+        '''Count the rows of a DataFrame with symbol and timestamp columns written to table'''
+        if df.empty:
+            return
+        summary = df.groupby('symbol')['timestamp'].agg(['count', 'min', 'max'])
+        for symbol, count, first, last in summary.itertuples():
+            self.record(table, symbol, int(count), first, last)
+
+    def record_delete(self, table, symbol, rows, before=None):
+        '''Count rows deleted from table; before is set once no row older than it is left'''
+        self._merge((table, symbol), {'rows': -rows, 'first': None, 'last': None, 'latency': None,
+                                      'floor': pd.Timestamp(before) if before is not None else None})
+
+    def record_drop(self, table, before):
+        '''Note that every row of table older than before was removed without counting them per symbol'''
+        self._merge((table, None), {'rows': 0, 'first': None, 'last': None, 'latency': None,
+                                    'floor': pd.Timestamp(before)})
+
+    def flush(self, repository):
+        '''Upsert the pending deltas, they are kept for the next flush if that fails'''
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        try:
+            repository.apply_deltas(pending)
+        except Exception as e:
+            for key, delta in pending.items():
+                self._merge(key, delta)
+            raise e
+        return len(pending)
+
+    def _merge(self, key, delta):
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = dict(delta)
+                return
+            entry['rows'] += delta['rows']
+            if delta['first'] is not None:
+                entry['first'] = delta['first'] if entry['first'] is None else min(entry['first'], delta['first'])
+            if delta['last'] is not None and (entry['last'] is None or delta['last'] >= entry['last']):
+                entry['last'], entry['latency'] = delta['last'], delta['latency']
+            if delta['floor'] is not None:
+                entry['floor'] = delta['floor'] if entry['floor'] is None else max(entry['floor'], delta['floor'])
+
+# Shared by every repository of the process
+STATS_COLLECTOR = StatsCollector()
+
+class StatsCatalogRepository:
+    ''' Reads and maintains table_stats, the per-symbol statistics of the data tables '''
+
+    def __init__(self):
+        self.engine = Database.get_engine()
+        Base.metadata.create_all(self.engine)
+        self.sqlite = Database.is_sqlite()
+
+    @timed_method()
+    def apply_deltas(self, deltas):
+        '''Add {(table, symbol): delta} of StatsCollector to the catalog
+
+        A symbol of None stands for a drop of all rows of the table older
+        than its floor. The count of every symbol is then scaled down by the
+        part of its time range that was dropped, as rows arrive at a steady
+        rate; this happens before the other deltas are added.
+        '''
+        now = datetime.now(timezone.utc)
+        records = [
+            {'table_name': table, 'symbol': symbol, 'row_count': delta['rows'],
+             'first_timestamp': self._timestamp(delta['first']), 'last_timestamp': self._timestamp(delta['last']),
+             'last_ingest_latency': delta['latency'], 'updated_at': now}
+            for (table, symbol), delta in deltas.items() if symbol is not None
+        ]
+        floors = [
+            {'table_name': table, 'symbol': symbol, 'floor': self._bind_timestamp(delta['floor'])}
+            for (table, symbol), delta in deltas.items() if delta['floor'] is not None and symbol is not None
+        ]
+        drops = [
+            {'table_name': table, 'floor': self._bind_timestamp(delta['floor'])}
+            for (table, symbol), delta in deltas.items() if symbol is None
+        ]
+        # Multi-argument min() and max() of SQLite are LEAST and GREATEST
+        least = func.min if self.sqlite else func.least
+        greatest = func.max if self.sqlite else func.greatest
+        stored = TableStats.__table__.c
+        if self.sqlite:
+            remaining = 'julianday(last_timestamp) - julianday(:floor)'
+            span = 'julianday(last_timestamp) - julianday(first_timestamp)'
+        else:
+            remaining = 'EXTRACT(EPOCH FROM last_timestamp - :floor)'
+            span = 'EXTRACT(EPOCH FROM last_timestamp - first_timestamp)'
+        session = Database.get_session()
+        try:
+            if drops:
+                session.execute(text(f'''
+                    UPDATE table_stats
+                    SET row_count = CASE
+                            WHEN last_timestamp < :floor THEN 0
+                            ELSE CAST(row_count * ({remaining}) / ({span}) AS BIGINT)
+                        END,
+                        first_timestamp = CASE WHEN last_timestamp < :floor THEN NULL ELSE :floor END,
+                        last_timestamp = CASE WHEN last_timestamp < :floor THEN NULL ELSE last_timestamp END,
+                        updated_at = :updated_at
+                    WHERE table_name = :table_name AND first_timestamp < :floor
+                '''), [dict(drop, updated_at=self._bind_timestamp(now)) for drop in drops])
+            step = Database.rows_per_statement(len(records[0]), 10000) if records else 1
+            for start in range(0, len(records), step):
+                stmt = Database.insert(TableStats.__table__).values(records[start:start + step])
+                new = stmt.excluded
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['table_name', 'symbol'],
+                    set_={
+                        'row_count': stored.row_count + new.row_count,
+                        'first_timestamp': least(func.coalesce(stored.first_timestamp, new.first_timestamp),
+                                                 func.coalesce(new.first_timestamp, stored.first_timestamp)),
+                        'last_timestamp': greatest(func.coalesce(stored.last_timestamp, new.last_timestamp),
+                                                   func.coalesce(new.last_timestamp, stored.last_timestamp)),
+                        # Only a write that advanced the newest timestamp tells the current latency
+                        'last_ingest_latency': case(
+                            (and_(new.last_timestamp.isnot(None),
+                                  or_(stored.last_timestamp.is_(None), new.last_timestamp >= stored.last_timestamp)),
+                             new.last_ingest_latency),
+                            else_=stored.last_ingest_latency
+                        ),
+                        'updated_at': new.updated_at,
+                    }
+                )
+                session.execute(stmt)
+            if floors:
+                session.execute(text(f'''
+                    UPDATE table_stats
+                    SET first_timestamp = {'MAX' if self.sqlite else 'GREATEST'}(first_timestamp, :floor)
+                    WHERE table_name = :table_name AND symbol = :symbol
+                '''), floors)
+            # Deletes of rows written before the catalog existed
+            session.execute(text('UPDATE table_stats SET row_count = 0 WHERE row_count < 0'))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @staticmethod
+    def _timestamp(value):
+        return value.to_pydatetime() if value is not None else None
+
+    def _bind_timestamp(self, value):
+        # Compared with stored timestamps in plain SQL, which bypasses UTCTimestamp
+        return sqlite_timestamp(value) if self.sqlite else pd.Timestamp(value).to_pydatetime()
+
+    @timed_method()
+    def refresh_bytes(self, tables):
+        '''Split the size of every table over its symbols by row count, PostgreSQL only'''
+        if self.sqlite:
+            return
+        session = Database.get_session()
+        try:
+            for table in tables:
+                session.execute(text('''
+                    UPDATE table_stats
+                    SET bytes = CAST(
+                        COALESCE(pg_total_relation_size(to_regclass(:table)), 0) * row_count
+                        / NULLIF((SELECT SUM(row_count) FROM table_stats WHERE table_name = :table), 0)
+                        AS BIGINT)
+                    WHERE table_name = :table
+                '''), {'table': table})
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def replace_stats(self, table, df):
+        '''Store exact symbol, row_count, first_timestamp and last_timestamp of table'''
+        if df.empty:
+            return
+        now = datetime.now(timezone.utc)
+        records = [
+            {'table_name': table, 'symbol': row.symbol, 'row_count': int(row.row_count),
+             'first_timestamp': self._timestamp(row.first_timestamp), 'last_timestamp': self._timestamp(row.last_timestamp),
+             'updated_at': now}
+            for row in df.itertuples()
+        ]
+        session = Database.get_session()
+        try:
+            stmt = Database.insert(TableStats.__table__).values(records)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['table_name', 'symbol'],
+                set_={column: getattr(stmt.excluded, column)
+                      for column in ('row_count', 'first_timestamp', 'last_timestamp', 'updated_at')}
+            )
+            session.execute(stmt)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def get_stats(self, table):
+        '''Return the catalog rows of table as a DataFrame, one row per symbol'''
+        session = Database.get_session()
+        try:
+            rows = session.query(
+                TableStats.symbol, TableStats.row_count, TableStats.first_timestamp, TableStats.last_timestamp,
+                TableStats.last_ingest_latency, TableStats.bytes
+            ).filter(TableStats.table_name == table).order_by(TableStats.symbol).all()
+            return pd.DataFrame(rows, columns=['symbol', 'row_count', 'first_timestamp', 'last_timestamp',
+                                               'last_ingest_latency', 'bytes'])
+        finally:
+            session.close()
+
+    def reset(self, table):
+        '''Forget the statistics of a cleared table'''
+        session = Database.get_session()
+        try:
+            session.query(TableStats).filter(TableStats.table_name == table).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
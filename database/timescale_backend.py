@@ -0,0 +1,130 @@
+from sqlalchemy import text
+
+from database.database import Database
+from utils.logger import get_logger
+
+class TimescaleBackend:
+    ''' Moves storage and downsampling into TimescaleDB
+
+    raw_data becomes a hypertable with time-based chunks and a compression
+    policy, and downsampled_data becomes a continuous aggregate (avg and
+    percentile_cont(0.5) per time_bucket) that TimescaleDB refreshes itself.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        timescale_config = config.get('timescale', {})
+        self.bucket_width = f"{config['downsampling_frequency']} minutes"
+        self.chunk_time_interval = timescale_config.get('chunk_time_interval', '1 day')
+        self.refresh_interval = timescale_config.get('refresh_interval', '1 minute')
+        self.refresh_lookback = timescale_config.get('refresh_lookback', '1 day')
+        self.compress_after = timescale_config.get('compress_after', '7 days')
+        self.engine = Database.get_engine()
+        self.logger = get_logger(self.__class__.__name__)
+
+    def setup(self):
+        ''' Idempotently create the hypertable, continuous aggregate and policies '''
+        # TimescaleDB refuses to create continuous aggregates inside a transaction
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+            self._create_hypertable(connection)
+            self._enable_compression(connection)
+            self._create_continuous_aggregate(connection)
+        self.logger.info("TimescaleDB backend ready.")
+
+    def _create_hypertable(self, connection):
+        connection.execute(text('''
+            SELECT create_hypertable(
+                'raw_data', 'timestamp',
+                chunk_time_interval => CAST(:chunk_time_interval AS INTERVAL),
+                if_not_exists => TRUE,
+                migrate_data => TRUE
+            )
+        '''), {'chunk_time_interval': self.chunk_time_interval})
+
+    def _enable_compression(self, connection):
+        enabled = connection.execute(text(
+            "SELECT compression_enabled FROM timescaledb_information.hypertables WHERE hypertable_name = 'raw_data'"
+        )).scalar()
+        if enabled:
+            # Settings cannot be changed once chunks have been compressed
+            return
+        connection.execute(text('''
+            ALTER TABLE raw_data SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'symbol',
+                timescaledb.compress_orderby = 'timestamp'
+            )
+        '''))
+        connection.execute(text('''
+            SELECT add_compression_policy(
+                'raw_data', CAST(:compress_after AS INTERVAL), if_not_exists => TRUE
+            )
+        '''), {'compress_after': self.compress_after})
+
+    def _create_continuous_aggregate(self, connection):
+        relkind = connection.execute(text(
+            "SELECT relkind FROM pg_class WHERE relname = 'downsampled_data' AND relnamespace = 'public'::regnamespace"
+        )).scalar()
+        if relkind == 'r':
+            # A plain table was created by an earlier run; keep its rows if it has any
+            if connection.execute(text("SELECT EXISTS (SELECT 1 FROM downsampled_data)")).scalar():
+                connection.execute(text("ALTER TABLE downsampled_data RENAME TO downsampled_data_legacy"))
+                self.logger.warning("Renamed the existing downsampled_data table to downsampled_data_legacy.")
+            else:
+                connection.execute(text("DROP TABLE downsampled_data"))
+        elif relkind is not None:
+            self.logger.info("Continuous aggregate downsampled_data already exists.")
+            return
+
+        # The bucket width is part of the view definition, so it cannot be a bind parameter
+        connection.execute(text(f'''
+            CREATE MATERIALIZED VIEW downsampled_data
+            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+            SELECT symbol,
+                   time_bucket(INTERVAL '{self.bucket_width}', timestamp) AS timestamp,
+                   AVG(price) AS avg_price,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY price) AS median_price
+            FROM raw_data
+            GROUP BY symbol, time_bucket(INTERVAL '{self.bucket_width}', timestamp)
+            WITH NO DATA
+        '''))
+        connection.execute(text('''
+            SELECT add_continuous_aggregate_policy(
+                'downsampled_data',
+                start_offset => CAST(:start_offset AS INTERVAL),
+                end_offset => CAST(:end_offset AS INTERVAL),
+                schedule_interval => CAST(:schedule_interval AS INTERVAL),
+                if_not_exists => TRUE
+            )
+        '''), {
+            'start_offset': self.refresh_lookback,
+            'end_offset': self.bucket_width,
+            'schedule_interval': self.refresh_interval
+        })
+        self.logger.info("Created continuous aggregate downsampled_data with %s buckets.", self.bucket_width)
+
+    def drop_raw_chunks(self, older_than):
+        ''' Drop the raw_data chunks that end before older_than
+
+        Returns the number of chunks, their approximate rows and the end of
+        the newest chunk dropped, no raw_data row older than it is left.
+        '''
+        with self.engine.begin() as connection:
+            # Rows still inside the refresh window of the continuous aggregate are kept
+            cutoff = connection.execute(text('''
+                SELECT LEAST(CAST(:older_than AS TIMESTAMPTZ), now() - CAST(:refresh_lookback AS INTERVAL))
+            '''), {'older_than': older_than, 'refresh_lookback': self.refresh_lookback}).scalar()
+            # Estimated from the chunk statistics, counting would read and decompress every chunk
+            chunks_end, rows = connection.execute(text('''
+                SELECT MAX(range_end),
+                       SUM(approximate_row_count(format('%I.%I', chunk_schema, chunk_name)::regclass))
+                FROM timescaledb_information.chunks
+                WHERE hypertable_name = 'raw_data' AND range_end <= :cutoff
+            '''), {'cutoff': cutoff}).one()
+            if chunks_end is None:
+                return 0, 0, None
+            dropped = connection.execute(text(
+                "SELECT drop_chunks('raw_data', older_than => CAST(:cutoff AS TIMESTAMPTZ))"
+            ), {'cutoff': cutoff}).fetchall()
+        return len(dropped), int(rows), chunks_end
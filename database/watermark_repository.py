@@ -0,0 +1,74 @@
+from sqlalchemy import func, text
+from database.models import TransformWatermark, Base, sqlite_timestamp
+from database.database import Database
+from utils.metrics import timed_method
+
+DOWNSAMPLED_STAGE = 'downsampled_data'
+
+class WatermarkRepository:
+    def __init__(self):
+        self.engine = Database.get_engine()
+        Base.metadata.create_all(self.engine)
+        self.sqlite = Database.is_sqlite()
+
+    @timed_method()
+    def get_watermarks(self, symbols, stage=DOWNSAMPLED_STAGE):
+        """Return {symbol: watermark} for the symbols that have one."""
+        session = Database.get_session()
+        try:
+            rows = session.query(TransformWatermark.symbol, TransformWatermark.watermark).filter(
+                TransformWatermark.stage == stage,
+                TransformWatermark.symbol.in_(list(symbols))
+            ).all()
+            return {symbol: watermark for symbol, watermark in rows}
+        finally:
+            session.close()
+
+    @timed_method()
+    def set_watermarks(self, watermarks, stage=DOWNSAMPLED_STAGE):
+        """Upsert {symbol: watermark}; a watermark never moves backwards."""
+        if not watermarks:
+            return
+        session = Database.get_session()
+        try:
+            records = [
+                {'symbol': symbol, 'stage': stage, 'watermark': watermark}
+                for symbol, watermark in watermarks.items()
+            ]
+            stmt = Database.insert(TransformWatermark.__table__).values(records)
+            # The two-argument max() of SQLite is GREATEST
+            greatest = func.max if self.sqlite else func.greatest
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['symbol', 'stage'],
+                set_={'watermark': greatest(TransformWatermark.__table__.c.watermark, stmt.excluded.watermark)}
+            )
+            session.execute(stmt)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @timed_method()
+    def rewind_watermarks(self, watermarks, stage=DOWNSAMPLED_STAGE):
+        """Move existing watermarks back to {symbol: watermark} if they are later."""
+        if not watermarks:
+            return
+        session = Database.get_session()
+        try:
+            session.execute(text(f'''
+                UPDATE transform_watermark
+                SET watermark = {'MIN' if self.sqlite else 'LEAST'}(watermark, :watermark)
+                WHERE symbol = :symbol AND stage = :stage
+            '''), [
+                {'symbol': symbol, 'stage': stage,
+                 'watermark': sqlite_timestamp(watermark) if self.sqlite else watermark}
+                for symbol, watermark in watermarks.items()
+            ])
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
@@ -0,0 +1,175 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+from utils.logger import get_logger
+from utils.metrics import gauge
+
+SAMPLING_INTERVAL_SECONDS = gauge('sampling_interval_seconds', 'Current poll interval of a symbol.', ['symbol'])
+API_WEIGHT_SAVED = gauge('api_weight_saved', 'Request weight saved compared to polling every symbol at '
+                         'sampling_frequency, negative if more was spent.')
+
+
+class AdaptiveSampler:
+    """Chooses a poll interval per symbol from the volatility of its recent prices.
+
+    Every observed price updates an exponentially weighted estimate of the
+    variance of log returns per second. A symbol is polled often enough that
+    its price is expected to move target_move_bps basis points between polls,
+    i.e. every (target / sigma)^2 seconds, clamped to [min_interval,
+    max_interval]. Flat symbols drift to max_interval, and symbols without
+    enough observations keep sampling_frequency.
+
+    The poll budget is what static polling of every symbol at
+    sampling_frequency costs, unless max_polls_per_second is set. A
+    redistribute share of the polls freed by quiet symbols is handed to the
+    most volatile ones, down to min_interval; the rest is saved. If the volatile
+    symbols ask for more than the budget, every interval is stretched.
+    Intervals are recomputed at most every rebalance_interval seconds.
+
+    The request weight is capped at that of static polling as well: a token
+    bucket refills at that rate, and due symbols that cannot be afforded yet
+    wait for a later tick, where they share a request with other symbols.
+    This matters for batched requests, which cost the same for one symbol as
+    for a full chunk.
+
+    Clients ask for the due symbols every tick_interval seconds (the
+    min_interval), report prices with observe and the request weight they
+    spend with record_weight.
+    """
+
+    def __init__(self, config, weight_per_request=2, symbols_per_request=1, clock=time.monotonic):
+        self.base_interval = config['sampling_frequency']
+        sampler_config = config.get('adaptive_sampling', {})
+        self.min_interval = sampler_config.get('min_interval', self.base_interval)
+        self.max_interval = sampler_config.get('max_interval', 30 * self.base_interval)
+        if not 0 < self.min_interval <= self.max_interval:
+            raise ValueError("adaptive_sampling needs 0 < min_interval <= max_interval")
+        self.target_move = sampler_config.get('target_move_bps', 1.0) / 10000
+        # Smoothing of the variance estimate, as the span of an EWMA in observations
+        self.alpha = 2 / (sampler_config.get('window', 20) + 1)
+        self.redistribute = sampler_config.get('redistribute', 0.5)
+        self.max_polls_per_second = sampler_config.get('max_polls_per_second')
+        self.rebalance_interval = sampler_config.get('rebalance_interval', 5)
+        self.weight_per_request = weight_per_request
+        self.symbols_per_request = symbols_per_request
+        self.clock = clock
+        self.tick_interval = self.min_interval
+        self.symbols = config['symbols']
+        self.intervals = {}
+        self.stats = {'polls': 0, 'weight_spent': 0, 'baseline_weight': 0.0}
+        self.logger = get_logger(self.__class__.__name__)
+        self._variance = {}
+        self._last = {}
+        self._next_due = {}
+        self._last_rebalance = None
+        self._tokens = None
+        self._last_refill = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """Return a sampler if adaptive_sampling is enabled, otherwise None."""
+        if not config.get('adaptive_sampling', {}).get('enabled', False):
+            return None
+        return cls(config, **kwargs)
+
+    def due_symbols(self, symbols=None, now=None):
+        """Return the symbols whose next poll is due and schedule their following one."""
+        now = self.clock() if now is None else now
+        symbols = self.symbols if symbols is None else symbols
+        with self._lock:
+            self._maybe_rebalance(now)
+            due = [symbol for symbol in symbols if self._next_due.get(symbol, now) <= now]
+            if not due:
+                return due
+            self._refill(now)
+            affordable = int(self._tokens // self.weight_per_request) * self.symbols_per_request
+            if affordable < len(due):
+                # Most overdue first
+                due = sorted(due, key=lambda symbol: self._next_due.get(symbol, now))[:affordable]
+            self._tokens -= math.ceil(len(due) / self.symbols_per_request) * self.weight_per_request
+            for symbol in due:
+                self._next_due[symbol] = now + self.intervals.get(symbol, self.base_interval)
+            self.stats['polls'] += len(due)
+            return due
+
+    def is_due(self, symbol, now=None):
+        """Single-symbol due_symbols for per-symbol jobs."""
+        return bool(self.due_symbols([symbol], now))
+
+    def observe(self, symbol, price, now=None):
+        """Update the variance estimate of symbol with a newly ingested price."""
+        if price is None or price <= 0:
+            return
+        now = self.clock() if now is None else now
+        with self._lock:
+            last = self._last.get(symbol)
+            self._last[symbol] = (price, now)
+            if last is None or now <= last[1]:
+                return
+            sample = math.log(price / last[0]) ** 2 / (now - last[1])
+            variance = self._variance.get(symbol)
+            self._variance[symbol] = sample if variance is None else variance + self.alpha * (sample - variance)
+
+    def record_weight(self, weight):
+        with self._lock:
+            self.stats['weight_spent'] += weight
+
+    def weight_saved(self):
+        with self._lock:
+            return self.stats['baseline_weight'] - self.stats['weight_spent']
+
+    def _weight_rate(self):
+        """Request weight per second of static polling."""
+        requests = math.ceil(len(self.symbols) / self.symbols_per_request)
+        return requests * self.weight_per_request / self.base_interval
+
+    def _refill(self, now):
+        capacity = self._weight_rate() * self.base_interval
+        if self._tokens is None:
+            self._tokens = capacity
+        else:
+            self._tokens = min(capacity, self._tokens + self._weight_rate() * (now - self._last_refill))
+        self._last_refill = now
+
+    def _maybe_rebalance(self, now):
+        if self._last_rebalance is not None:
+            elapsed = now - self._last_rebalance
+            if elapsed < self.rebalance_interval:
+                return
+            # What static polling would have cost since the last rebalance
+            self.stats['baseline_weight'] += self._weight_rate() * elapsed
+        self._last_rebalance = now
+        self._rebalance()
+        API_WEIGHT_SAVED.set(self.stats['baseline_weight'] - self.stats['weight_spent'])
+
+    def _rebalance(self):
+        symbols = list(self.symbols)
+        if not symbols:
+            return
+        variance = np.array([self._variance.get(symbol, np.nan) for symbol in symbols])
+        known = ~np.isnan(variance)
+        with np.errstate(divide='ignore'):
+            desired = np.where(known, self.target_move ** 2 / np.where(known, variance, 1.0), self.base_interval)
+        rates = 1 / np.clip(desired, self.min_interval, self.max_interval)
+
+        budget = self.max_polls_per_second or len(symbols) / self.base_interval
+        total = rates.sum()
+        if total > budget:
+            rates = np.maximum(rates * budget / total, 1 / self.max_interval)
+        else:
+            spare = (budget - total) * self.redistribute
+            # Most volatile first, each up to min_interval
+            for index in np.argsort(-np.where(known, variance, -1.0)):
+                if spare <= 0 or not known[index]:
+                    break
+                extra = min(1 / self.min_interval - rates[index], spare)
+                rates[index] += extra
+                spare -= extra
+
+        self.intervals = dict(zip(symbols, (1 / rates).tolist()))
+        for symbol, interval in self.intervals.items():
+            SAMPLING_INTERVAL_SECONDS.labels(symbol).set(interval)
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import aiohttp
+
+from ingestion.adaptive_sampler import AdaptiveSampler
+from ingestion.base_ingestion import DataIngestionClient
+from ingestion.binance_ingestion import chunk_symbols, BINANCE_BASE_URL, DEFAULT_BATCH_SIZE, TICKER_PRICE_PATH
+from database.raw_data_repository import RawDataRepository, parse_price
+from utils.metrics import HTTP_REQUEST_SECONDS, HTTP_RESPONSES, SCHEDULER_TICK_LAG_SECONDS, SCHEDULER_MISSED_RUNS
+from utils.rate_limiter import WeightedRateLimiter, request_weight
+from utils.state_manager import StateManager
+from utils.logger import get_logger
+
+
+
+class AsyncBinanceIngestionClient(DataIngestionClient):
+    """Ingestion engine that runs every symbol on one asyncio event loop.
+
+    A single tick loop fires every sampling_frequency seconds and fetches all
+    pending symbols through one keep-alive aiohttp connection pool. If the
+    previous tick is still running the new one is skipped and counted as
+    missed, so the number of in-flight requests stays bounded. Writes to the
+    raw data sink run on a small, fixed storage thread pool. With
+    adaptive_sampling, the loop ticks every min_interval and only fetches the
+    symbols the sampler picks.
+    """
+
+    def __init__(self, config, raw_data_sink=None, state_manager=None, sampler=None):
+        self.config = config
+        self.symbols = config['symbols']
+        self.data_points = config['data_points']
+        self.sampling_frequency = config['sampling_frequency']
+        self.api_rate_limit = config['api_rate_limit']
+        self.batch_size = config.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.base_url = config.get('base_url', BINANCE_BASE_URL)
+        async_config = config.get('async_engine', {})
+        self.max_connections = async_config.get('max_connections', 20)
+        self.request_timeout = async_config.get('request_timeout', 5)
+        self.storage_workers = async_config.get('storage_workers', 4)
+        self.rate_limiter = WeightedRateLimiter.from_config(config)
+        self.state_manager = state_manager or StateManager()
+        self.raw_data_sink = raw_data_sink or RawDataRepository()
+        self.sampler = sampler if sampler is not None else AdaptiveSampler.from_config(
+            config, weight_per_request=request_weight(TICKER_PRICE_PATH, {}), symbols_per_request=self.batch_size
+        )
+        self.tick_interval = self.sampler.tick_interval if self.sampler else self.sampling_frequency
+        self.logger = get_logger(self.__class__.__name__)
+        self.stats = {'ticks': 0, 'missed_ticks': 0, 'max_tick_lag': 0.0}
+        self._session = None
+        self._loop = None
+        self._stop_event = None
+        self._thread = None
+        self._started = threading.Event()
+        self._executor = None
+
+    def start(self):
+        """Run the event loop on a dedicated thread."""
+        if self._thread is not None:
+            return
+        self._started.clear()
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),),
+                                        name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        """Stop the tick loop and wait for the in-flight tick to finish."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+        self._thread.join()
+        self._thread = None
+        self.logger.info("Async ingestion stopped: %s", self.stats)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.storage_workers)
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        try:
+            async with aiohttp.ClientSession(self.base_url, connector=connector, timeout=timeout) as session:
+                self._session = session
+                self._started.set()
+                await self._tick_loop()
+        finally:
+            self._started.set()
+            self._session = None
+            self._executor.shutdown(wait=True)
+
+    async def _tick_loop(self):
+        tick_task = None
+        next_tick = self._loop.time()
+        while not self._stop_event.is_set():
+            lag = self._loop.time() - next_tick
+            self.stats['max_tick_lag'] = max(self.stats['max_tick_lag'], lag)
+            SCHEDULER_TICK_LAG_SECONDS.labels('async_ingestion').observe(lag)
+            if tick_task is not None and not tick_task.done():
+                self.stats['missed_ticks'] += 1
+                SCHEDULER_MISSED_RUNS.labels('async_ingestion').inc()
+            else:
+                self.stats['ticks'] += 1
+                tick_task = asyncio.ensure_future(self.ingest_batch())
+
+            next_tick += self.tick_interval
+            # Skip tick slots that already passed instead of firing them in a burst
+            now = self._loop.time()
+            if next_tick < now:
+                skipped = int((now - next_tick) // self.tick_interval) + 1
+                self.stats['missed_ticks'] += skipped
+                SCHEDULER_MISSED_RUNS.labels('async_ingestion').inc(skipped)
+                next_tick += skipped * self.tick_interval
+
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=next_tick - self._loop.time())
+            except asyncio.TimeoutError:
+                pass
+
+        if tick_task is not None:
+            await tick_task
+
+    async def ingest_data(self, symbol):
+        """Ingest data for a single symbol."""
+        if self.state_manager.get_collected_points(symbol) >= self.data_points:
+            return
+        try:
+            data = await self._get_ticker_price({'symbol': symbol})
+            timestamp = datetime.now(timezone.utc)
+            await self._store([data], timestamp)
+        except Exception as e:
+            self.logger.error(f"Error processing data for {symbol}: {e}")
+
+    async def ingest_batch(self):
+        """Ingest data for every pending symbol, one concurrent request per chunk."""
+        pending = [
+            symbol for symbol in self.symbols
+            if self.state_manager.get_collected_points(symbol) < self.data_points
+        ]
+        if self.sampler:
+            pending = self.sampler.due_symbols(pending)
+        if not pending:
+            return
+        timestamp = datetime.now(timezone.utc)
+        await asyncio.gather(*[
+            self._ingest_chunk(chunk, timestamp)
+            for chunk in chunk_symbols(pending, self.batch_size)
+        ])
+
+    async def _ingest_chunk(self, chunk, timestamp):
+        try:
+            tickers = await self._get_ticker_price(
+                {'symbols': json.dumps(chunk, separators=(',', ':'))}
+            )
+        except Exception as e:
+            self.logger.error(f"Batch request failed for {len(chunk)} symbols, "
+                              f"falling back to per-symbol requests: {e}")
+            await asyncio.gather(*[self.ingest_data(symbol) for symbol in chunk])
+            return
+        try:
+            await self._store(tickers, timestamp)
+        except Exception as e:
+            self.logger.error(f"Error storing data for {len(chunk)} symbols: {e}")
+
+    async def _get_ticker_price(self, params):
+        await self.rate_limiter.acquire_async(request_weight(TICKER_PRICE_PATH, params))
+        with HTTP_REQUEST_SECONDS.labels(TICKER_PRICE_PATH).time():
+            async with self._session.get(TICKER_PRICE_PATH, params=params) as response:
+                HTTP_RESPONSES.labels(TICKER_PRICE_PATH, str(response.status)).inc()
+                self.rate_limiter.record_response(response.status, response.headers)
+                if self.sampler:
+                    self.sampler.record_weight(request_weight(TICKER_PRICE_PATH, params))
+                response.raise_for_status()
+                return await response.json()
+
+    async def _store(self, tickers, timestamp):
+        await self._loop.run_in_executor(self._executor, self._store_tickers, tickers, timestamp)
+
+    def _store_tickers(self, tickers, timestamp):
+        for data in tickers:
+            symbol = data['symbol']
+            try:
+                self.raw_data_sink.insert_raw_data(symbol, data, timestamp)
+                if self.sampler:
+                    self.sampler.observe(symbol, parse_price(data))
+                collected_points = self.state_manager.update_collected_points(symbol)
+                if collected_points >= self.data_points:
+                    self.logger.info(f"Reached data points limit for {symbol}")
+            except Exception as e:
+                self.logger.error(f"Error processing data for {symbol}: {e}")
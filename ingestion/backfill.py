@@ -0,0 +1,265 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import pandas as pd
+from binance.spot import Spot as Client
+
+from archive.parquet_archive import archive_stage, archive_tables
+from database.backfill_progress_repository import BackfillProgressRepository
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.compacted_raw_data_repository import create_raw_data_repository, raw_data_table
+from database.rollup_repository import rollup_stage
+from database.stats_catalog import STATS_COLLECTOR, StatsCatalogRepository
+from database.watermark_repository import WatermarkRepository, DOWNSAMPLED_STAGE
+from ingestion.binance_ingestion import BINANCE_BASE_URL, limited_call
+from utils.rate_limiter import WeightedRateLimiter
+from utils.logger import get_logger
+
+# Maximum number of rows Binance returns per klines or aggTrades request
+PAGE_LIMIT = 1000
+# aggTrades only accepts startTime/endTime less than an hour apart
+AGG_TRADES_WINDOW_MS = 60 * 60 * 1000
+
+KLINE_INTERVALS = {
+    '1m': 1, '3m': 3, '5m': 5, '15m': 15, '30m': 30, '1h': 60, '2h': 120,
+    '4h': 240, '6h': 360, '8h': 480, '12h': 720, '1d': 1440,
+}
+
+
+def to_ms(value):
+    return int(pd.Timestamp(value).timestamp() * 1000)
+
+
+def from_ms(value):
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+
+
+class BackfillEngine:
+    """Loads historical data for many symbols from the klines or aggTrades endpoint.
+
+    The requested period of every symbol is split into segments of
+    segment_days days. Segments are fetched page by page on a pool of worker
+    threads that share one rate limiter, and the cursor of every segment is
+    checkpointed in backfill_progress after each stored page, so a rerun
+    resumes where the previous one stopped.
+
+    With target raw, every kline (close price at its open time) or aggregate
+    trade becomes a raw data point; with sample_interval set, only the last
+    trade of every sample_interval seconds does. Afterwards the transform watermarks are
+    moved back to the start of the window that holds the start of the
+    backfill, so the regular transformation downsamples the new history.
+    With target downsampled, klines of the downsampling frequency are written
+    to downsampled_data directly, with the volume-weighted price as avg_price
+    and the typical price (high + low + close) / 3 as median_price, as klines
+    carry no single prices. Either way the archive watermarks of the written
+    tables are moved back to the day of the start, so those days are archived
+    again.
+    """
+
+    def __init__(self, config, raw_data_repo=None, downsampled_repo=None, progress_repo=None,
+                 watermark_repo=None, rate_limiter=None):
+        self.config = config
+        backfill_config = config.get('backfill', {})
+        self.source = backfill_config.get('source', 'klines')
+        self.target = backfill_config.get('target', 'raw')
+        self.workers = backfill_config.get('workers', 4)
+        self.segment_days = backfill_config.get('segment_days', 7)
+        self.kline_interval = backfill_config.get('kline_interval', '1m')
+        # Aggregate trades are reduced to one point per sample_interval seconds when set
+        self.sample_ms = int(backfill_config.get('sample_interval', 0) * 1000)
+        if self.target == 'downsampled':
+            if self.source != 'klines':
+                raise ValueError("The downsampled backfill target requires the klines source")
+            intervals = {minutes: interval for interval, minutes in KLINE_INTERVALS.items()}
+            if config['downsampling_frequency'] not in intervals:
+                raise ValueError(f"No kline interval matches downsampling_frequency {config['downsampling_frequency']}")
+            self.kline_interval = intervals[config['downsampling_frequency']]
+        elif self.target != 'raw':
+            raise ValueError(f"Unknown backfill target: {self.target}")
+        if self.source not in ('klines', 'aggTrades'):
+            raise ValueError(f"Unknown backfill source: {self.source}")
+        self.source_key = f'klines_{self.kline_interval}' if self.source == 'klines' else 'aggTrades'
+        self.base_url = config.get('base_url', BINANCE_BASE_URL)
+        self.api_key = config.get('api_key')
+        self.api_secret = config.get('api_secret')
+        self.rate_limiter = rate_limiter or WeightedRateLimiter.from_config(config)
+        self.raw_data_repo = raw_data_repo or (create_raw_data_repository(config) if self.target == 'raw' else None)
+        self.downsampled_repo = downsampled_repo or (DownsampledDataRepository() if self.target == 'downsampled' else None)
+        self.progress_repo = progress_repo or BackfillProgressRepository()
+        self.archived_tables = []
+        if config.get('archive', {}).get('enabled', False):
+            written = [raw_data_table(config), 'downsampled_data'] if self.target == 'raw' else ['downsampled_data']
+            self.archived_tables = [table for table in archive_tables(config) if table in written]
+        self.watermark_repo = watermark_repo or (
+            WatermarkRepository() if self.target == 'raw' or self.archived_tables else None
+        )
+        self.logger = get_logger(self.__class__.__name__)
+        self.stats = {'rows': 0, 'requests': 0, 'segments': 0, 'failed_segments': 0}
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+
+    def run(self, symbols, start, end):
+        """Backfill [start, end) for every symbol and return a throughput report."""
+        start_time = time.perf_counter()
+        segments = self._plan(symbols, to_ms(start), to_ms(end))
+        self.logger.info("Backfilling %d segments of %d symbols with %d workers",
+                         len(segments), len(symbols), self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._backfill_segment, *segment): segment for segment in segments}
+            for future in as_completed(futures):
+                symbol, range_start, _, _ = futures[future]
+                try:
+                    future.result()
+                    self._count(segments=1)
+                except Exception as e:
+                    self._count(failed_segments=1)
+                    self.logger.error("Error backfilling %s from %s: %s", symbol, from_ms(range_start), e)
+        self._rewind_watermarks(symbols, from_ms(to_ms(start)))
+        self._flush_stats()
+        report = dict(self.stats)
+        report['seconds'] = time.perf_counter() - start_time
+        report['rows_per_second'] = report['rows'] / report['seconds'] if report['seconds'] else 0.0
+        self.logger.info("Backfilled %d rows with %d requests in %.1fs (%.0f rows/s)", report['rows'],
+                         report['requests'], report['seconds'], report['rows_per_second'])
+        return report
+
+    def _plan(self, symbols, start_ms, end_ms):
+        """Return the (symbol, range_start, range_end, cursor) segments that still need work."""
+        segment_ms = self.segment_days * 24 * 60 * 60 * 1000
+        progress = self.progress_repo.get_progress(symbols, self.source_key)
+        segments = []
+        for symbol in symbols:
+            for range_start in range(start_ms, end_ms, segment_ms):
+                range_end = min(range_start + segment_ms, end_ms)
+                saved = progress.get((symbol, from_ms(range_start)))
+                cursor = range_start
+                if saved is not None:
+                    saved_end, saved_cursor, completed = saved
+                    if completed and to_ms(saved_end) >= range_end:
+                        continue
+                    cursor = min(to_ms(saved_cursor), range_end)
+                segments.append((symbol, range_start, range_end, cursor))
+        return segments
+
+    def _backfill_segment(self, symbol, range_start, range_end, cursor):
+        client = self._client()
+        # (interval, trade) of the sample interval the next page may still add trades to
+        held = None
+        while cursor < range_end:
+            if self.source == 'klines':
+                rows, cursor = self._fetch_klines(client, symbol, cursor, range_end)
+            else:
+                rows, cursor = self._fetch_agg_trades(client, symbol, cursor, range_end)
+                if self.sample_ms:
+                    rows, held = self._sample_trades(rows, held, range_start, range_end, cursor >= range_end)
+            if rows:
+                self._store(symbol, rows)
+            self.progress_repo.save_progress(symbol, self.source_key, from_ms(range_start), from_ms(range_end),
+                                             from_ms(cursor), cursor >= range_end)
+
+    def _fetch_klines(self, client, symbol, cursor, range_end):
+        interval_ms = KLINE_INTERVALS[self.kline_interval] * 60 * 1000
+        klines = limited_call(self.rate_limiter, '/api/v3/klines', client.klines, symbol=symbol,
+                              interval=self.kline_interval, startTime=cursor, endTime=range_end - 1, limit=PAGE_LIMIT)
+        self._count(requests=1)
+        if len(klines) < PAGE_LIMIT:
+            # The rest of the range has no more klines
+            return klines, range_end
+        return klines, klines[-1][0] + interval_ms
+
+    def _fetch_agg_trades(self, client, symbol, cursor, range_end):
+        window_end = min(cursor + AGG_TRADES_WINDOW_MS, range_end)
+        trades = limited_call(self.rate_limiter, '/api/v3/aggTrades', client.agg_trades, symbol=symbol,
+                              startTime=cursor, endTime=window_end - 1, limit=PAGE_LIMIT)
+        self._count(requests=1)
+        if len(trades) < PAGE_LIMIT:
+            return trades, window_end
+        # Trades of the same millisecond share a raw_data row, so none are lost here
+        return trades, trades[-1]['T'] + 1
+
+    def _sample_trades(self, trades, held, range_start, range_end, done):
+        """Reduce trades to the last one of every sample interval since range_start.
+
+        Each kept trade is stamped with the end of its interval, like a poll
+        of the price at that time. The last interval of a page is held back,
+        as the next page may continue it; at the end of the range it is only
+        kept if it is complete. Returns (trades, held).
+        """
+        last = dict([held]) if held else {}
+        for trade in trades:
+            last[(trade['T'] - range_start) // self.sample_ms] = trade
+        intervals = sorted(last.items())
+        held = intervals.pop() if intervals else None
+        if done and held is not None and range_start + (held[0] + 1) * self.sample_ms <= range_end:
+            intervals.append(held)
+            held = None
+        return [dict(trade, T=range_start + (interval + 1) * self.sample_ms - 1) for interval, trade in intervals], held
+
+    def _store(self, symbol, rows):
+        if self.target == 'downsampled':
+            df = pd.DataFrame([
+                {
+                    'symbol': symbol,
+                    'timestamp': pd.Timestamp(kline[0], unit='ms', tz='UTC'),
+                    # quote asset volume / volume, or the close price if nothing was traded
+                    'avg_price': float(kline[7]) / float(kline[5]) if float(kline[5]) else float(kline[4]),
+                    'median_price': (float(kline[2]) + float(kline[3]) + float(kline[4])) / 3
+                }
+                for kline in rows
+            ])
+            self.downsampled_repo.insert_downsampled_data(df)
+        elif self.source == 'klines':
+            self.raw_data_repo.insert_raw_data_bulk([
+                (symbol, {'symbol': symbol, 'price': kline[4]}, from_ms(kline[0])) for kline in rows
+            ])
+        else:
+            self.raw_data_repo.insert_raw_data_bulk([
+                (symbol, {'symbol': symbol, 'price': trade['p']}, from_ms(trade['T'])) for trade in rows
+            ])
+        self._count(rows=len(rows))
+
+    def _rewind_watermarks(self, symbols, start):
+        """Let the transformation downsample and the archiver export the backfilled rows.
+
+        Every stage is moved back to the start of its window, bucket or day
+        that holds start, so that window is aggregated, and that day
+        archived, again from all of its rows instead of being replaced by the
+        rows after start. Archived days are only exported again once the
+        transformation has passed them.
+        """
+        stages = []
+        if self.target == 'raw':
+            stages.append((DOWNSAMPLED_STAGE, f"{self.config['downsampling_frequency']}T"))
+            rollup_config = self.config.get('rollups', {})
+            if rollup_config.get('enabled', False):
+                stages += [(rollup_stage(resolution), f'{resolution}T')
+                           for resolution in rollup_config.get('resolutions', [])]
+        stages += [(archive_stage(table), 'D') for table in self.archived_tables]
+        for stage, freq in stages:
+            # Windows and buckets are aligned to the epoch, like pandas floor()
+            watermark = pd.Timestamp(start).floor(freq).to_pydatetime()
+            self.watermark_repo.rewind_watermarks({symbol: watermark for symbol in symbols}, stage=stage)
+
+    def _flush_stats(self):
+        """Write the rows stored by this run to the statistics catalog."""
+        if not self.config.get('stats_catalog', {}).get('enabled', True) or not STATS_COLLECTOR.pending:
+            return
+        try:
+            STATS_COLLECTOR.flush(StatsCatalogRepository())
+        except Exception as e:
+            self.logger.error("Error flushing table statistics: %s", e)
+
+    def _client(self):
+        # requests sessions are not shared between threads
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(self.api_key, self.api_secret, base_url=self.base_url,
+                                                show_limit_usage=True)
+        return client
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
@@ -1,47 +1,143 @@
+from ingestion.adaptive_sampler import AdaptiveSampler
 from ingestion.base_ingestion import DataIngestionClient
+from binance.error import ClientError
 from binance.spot import Spot as Client
-from utils.rate_limiter import RateLimiter
+from utils.metrics import HTTP_REQUEST_SECONDS, HTTP_RESPONSES
+from utils.rate_limiter import WeightedRateLimiter, request_weight
 from utils.state_manager import StateManager
 from utils.logger import get_logger
 from datetime import datetime, timezone
-from database.raw_data_repository import RawDataRepository
-# import time
+from database.raw_data_repository import RawDataRepository, parse_price
+
+# Binance accepts the symbols list as a JSON array in the query string, so a
+# chunk of 100 keeps the URL well under the server limit.
+DEFAULT_BATCH_SIZE = 100
+BINANCE_BASE_URL = 'https://api.binance.com'
+TICKER_PRICE_PATH = '/api/v3/ticker/price'
+
+
+def chunk_symbols(symbols, batch_size):
+    """Split symbols into consecutive chunks of at most batch_size."""
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    return [symbols[i:i + batch_size] for i in range(0, len(symbols), batch_size)]
+
+
+def limited_call(rate_limiter, path, func, **params):
+    """Call a binance-connector method once the rate limiter grants its weight.
+
+    The limiter is resynced from the limit usage headers of the response, or
+    of the error for rejected requests.
+    """
+    rate_limiter.acquire(request_weight(path, params))
+    try:
+        with HTTP_REQUEST_SECONDS.labels(path).time():
+            response = func(**params)
+    except ClientError as e:
+        HTTP_RESPONSES.labels(path, str(e.status_code)).inc()
+        rate_limiter.record_response(e.status_code, e.header if hasattr(e.header, 'items') else None)
+        raise
+    HTTP_RESPONSES.labels(path, '200').inc()
+    if isinstance(response, dict) and 'limit_usage' in response:
+        # Clients created with show_limit_usage=True
+        rate_limiter.record_response(200, response['limit_usage'])
+        return response['data']
+    return response
 
 
 class BinanceIngestionClient(DataIngestionClient):
-    def __init__(self, config):
+    def __init__(self, config, raw_data_sink=None, state_manager=None, sampler=None):
         self.config = config
         self.symbols = config['symbols']
         self.data_points = config['data_points']
         self.api_rate_limit = config['api_rate_limit']
+        self.batch_size = config.get('batch_size', DEFAULT_BATCH_SIZE)
         self.api_key = config.get('api_key')
         self.api_secret = config.get('api_secret')
-        self.client = Client(self.api_key, self.api_secret)
-        self.rate_limiter = RateLimiter(self.api_rate_limit)
-        self.state_manager = StateManager()
-        self.raw_data_repo = RawDataRepository()
+        self.base_url = config.get('base_url', BINANCE_BASE_URL)
+        self.client = Client(self.api_key, self.api_secret, base_url=self.base_url, show_limit_usage=True)
+        self.rate_limiter = WeightedRateLimiter.from_config(config)
+        self.state_manager = state_manager or StateManager()
+        # Anything with insert_raw_data(symbol, data, timestamp), e.g. a RawDataWriter
+        self.raw_data_sink = raw_data_sink or RawDataRepository()
+        # per_symbol jobs poll one symbol per request, batch jobs a chunk
+        per_symbol = config.get('ingestion_mode') == 'per_symbol'
+        self.sampler = sampler if sampler is not None else AdaptiveSampler.from_config(
+            config, weight_per_request=request_weight(TICKER_PRICE_PATH, {'symbol': ''} if per_symbol else {}),
+            symbols_per_request=1 if per_symbol else self.batch_size
+        )
+        # Jobs run this often, the sampler decides which symbols are polled
+        self.tick_interval = self.sampler.tick_interval if self.sampler else config.get('sampling_frequency')
         self.logger = get_logger(self.__class__.__name__)
 
-    def ingest_data(self, symbol):
-        """Ingest data for a single symbol."""
-        # start_time = time.time()
+    def ingest_data(self, symbol, due=False):
+        """Ingest data for a single symbol.
+
+        due is set when the sampler already picked the symbol for this tick.
+        """
         collected_points = self.state_manager.get_collected_points(symbol)
         if collected_points >= self.data_points:
             return
+        if self.sampler and not due and not self.sampler.is_due(symbol):
+            return
+
+        try:
+            self.logger.debug(f"Requesting data for {symbol}...")
+            params = {'symbol': symbol}
+            data = limited_call(self.rate_limiter, TICKER_PRICE_PATH, self.client.ticker_price, **params)
+            if self.sampler:
+                self.sampler.record_weight(request_weight(TICKER_PRICE_PATH, params))
+            timestamp = datetime.now(timezone.utc)
+            self._store_data_point(symbol, data, timestamp)
+        except Exception as e:
+            self.logger.error(f"Error processing data for {symbol}: {e}")
 
-        with self.rate_limiter:
+    def ingest_batch(self):
+        """Ingest data for every configured symbol using one request per chunk.
+
+        All data points collected during a tick share the same timestamp. If a
+        chunk request fails (e.g. one delisted symbol makes Binance reject the
+        whole list), its symbols fall back to the per-symbol path.
+        """
+        pending = [
+            symbol for symbol in self.symbols
+            if self.state_manager.get_collected_points(symbol) < self.data_points
+        ]
+        if self.sampler:
+            pending = self.sampler.due_symbols(pending)
+        if not pending:
+            return
+
+        timestamp = datetime.now(timezone.utc)
+        for chunk in chunk_symbols(pending, self.batch_size):
             try:
-                self.logger.debug(f"Requesting data for {symbol}...")
-                data = self.client.ticker_price(symbol=symbol)
-                timestamp = datetime.now(timezone.utc)
-                self.raw_data_repo.insert_raw_data(symbol, data, timestamp)
-                collected_points = self.state_manager.update_collected_points(symbol)
-                self.logger.info(f"Collected data point {collected_points} for {symbol}")
-
-                if collected_points >= self.data_points:
-                    self.logger.info(f"Reached data points limit for {symbol}")
+                self.logger.debug(f"Requesting data for {len(chunk)} symbols...")
+                tickers = limited_call(self.rate_limiter, TICKER_PRICE_PATH, self.client.ticker_price, symbols=chunk)
+                if self.sampler:
+                    self.sampler.record_weight(request_weight(TICKER_PRICE_PATH, {'symbols': chunk}))
             except Exception as e:
-                self.logger.error(f"Error processing data for {symbol}: {e}")
-        # end_time = time.time()
-        # elapsed_time = end_time - start_time
-        # self.logger.debug(f"Time taken for {symbol}: {elapsed_time:.2f} seconds")
+                self.logger.error(f"Batch request failed for {len(chunk)} symbols, "
+                                  f"falling back to per-symbol requests: {e}")
+                tickers = None
+
+            if tickers is None:
+                for symbol in chunk:
+                    self.ingest_data(symbol, due=True)
+                continue
+
+            for data in tickers:
+                symbol = data['symbol']
+                try:
+                    self._store_data_point(symbol, data, timestamp)
+                except Exception as e:
+                    self.logger.error(f"Error processing data for {symbol}: {e}")
+
+    def _store_data_point(self, symbol, data, timestamp):
+        self.raw_data_sink.insert_raw_data(symbol, data, timestamp)
+        if self.sampler:
+            self.sampler.observe(symbol, parse_price(data))
+        collected_points = self.state_manager.update_collected_points(symbol)
+        self.logger.debug("Collected data point %d for %s", collected_points, symbol)
+
+        if collected_points >= self.data_points:
+            self.logger.info(f"Reached data points limit for {symbol}")
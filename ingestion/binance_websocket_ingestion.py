@@ -0,0 +1,211 @@
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+import websocket
+
+from ingestion.base_ingestion import DataIngestionClient
+from ingestion.binance_ingestion import chunk_symbols
+from database.raw_data_repository import RawDataRepository
+from utils.state_manager import StateManager
+from utils.logger import get_logger
+
+BINANCE_STREAM_URL = 'wss://stream.binance.com:9443/stream'
+# Binance allows up to 1024 streams per connection
+DEFAULT_STREAMS_PER_CONNECTION = 200
+# The miniTicker stream pushes one update per second per symbol
+MINI_TICKER_INTERVAL_MS = 1000
+
+
+class BinanceWebSocketIngestionClient(DataIngestionClient):
+    """Streaming ingestion from Binance combined streams.
+
+    Symbols are spread over a few multiplexed connections, each subscribing
+    to `<symbol>@miniTicker` or `<symbol>@trade`. Dropped connections are
+    reopened with exponential backoff and resubscribed. Gaps are tracked per
+    symbol: time spent disconnected, skipped trade ids and missing
+    miniTicker updates. Events are written to the same raw data sink as the
+    polling clients, as {'symbol', 'price'} payloads stamped with the
+    exchange event time. raw_data keeps one point per symbol and
+    millisecond, so only the first trade of every millisecond is written and
+    the others are counted as collapsed trades.
+    """
+
+    def __init__(self, config, raw_data_sink=None, state_manager=None):
+        self.config = config
+        self.symbols = config['symbols']
+        self.data_points = config['data_points']
+        ws_config = config.get('websocket', {})
+        self.stream_url = ws_config.get('url', BINANCE_STREAM_URL)
+        self.stream_type = ws_config.get('stream', 'miniTicker')
+        if self.stream_type not in ('miniTicker', 'trade'):
+            raise ValueError(f"Unsupported websocket stream: {self.stream_type}")
+        self.streams_per_connection = ws_config.get('streams_per_connection', DEFAULT_STREAMS_PER_CONNECTION)
+        self.reconnect_delay = ws_config.get('reconnect_delay', 1)
+        self.max_reconnect_delay = ws_config.get('max_reconnect_delay', 60)
+        self.ping_interval = ws_config.get('ping_interval', 180)
+        # Also bounds how long a closing connection waits before its read loop notices
+        self.ping_timeout = ws_config.get('ping_timeout', 10)
+        self.state_manager = state_manager or StateManager()
+        self.raw_data_sink = raw_data_sink or RawDataRepository()
+        self.logger = get_logger(self.__class__.__name__)
+        self.gap_stats = {
+            symbol: {'reconnects': 0, 'disconnected_seconds': 0.0, 'missed_trades': 0, 'missed_updates': 0,
+                     'collapsed_trades': 0}
+            for symbol in self.symbols
+        }
+        self._last_event = {}
+        # Event time of the last point written per symbol
+        self._last_written = {}
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.connections = [
+            _StreamConnection(self, chunk)
+            for chunk in chunk_symbols(self.symbols, self.streams_per_connection)
+        ]
+
+    def start(self):
+        self._stop_event.clear()
+        for connection in self.connections:
+            connection.start()
+
+    def stop(self):
+        self._stop_event.set()
+        for connection in self.connections:
+            connection.stop()
+        self.logger.info("WebSocket ingestion stopped, gap stats: %s", self.get_gap_stats())
+
+    def stream_name(self, symbol):
+        return f"{symbol.lower()}@{self.stream_type}"
+
+    def get_gap_stats(self):
+        with self._stats_lock:
+            return {symbol: dict(stats) for symbol, stats in self.gap_stats.items()}
+
+    def ingest_data(self, event):
+        """Ingest one stream event for a single symbol."""
+        symbol = event.get('s')
+        if symbol not in self.gap_stats:
+            return
+        if event.get('e') == 'trade':
+            price, event_time = event['p'], event['T']
+        elif event.get('e') == '24hrMiniTicker':
+            price, event_time = event['c'], event['E']
+        else:
+            return
+
+        self._account_gaps(symbol, event)
+        if self.state_manager.get_collected_points(symbol) >= self.data_points:
+            return
+        if self._last_written.get(symbol) == event_time:
+            # Same (symbol, timestamp) key as the point already written
+            with self._stats_lock:
+                self.gap_stats[symbol]['collapsed_trades'] += 1
+            return
+        try:
+            timestamp = datetime.fromtimestamp(event_time / 1000, tz=timezone.utc)
+            self.raw_data_sink.insert_raw_data(symbol, {'symbol': symbol, 'price': price}, timestamp)
+            self._last_written[symbol] = event_time
+            collected_points = self.state_manager.update_collected_points(symbol)
+            if collected_points >= self.data_points:
+                self.logger.info(f"Reached data points limit for {symbol}")
+        except Exception as e:
+            self.logger.error(f"Error processing data for {symbol}: {e}")
+
+    def _account_gaps(self, symbol, event):
+        with self._stats_lock:
+            previous = self._last_event.get(symbol)
+            self._last_event[symbol] = event
+            if previous is None:
+                return
+            stats = self.gap_stats[symbol]
+            if event['e'] == 'trade':
+                missed = event['t'] - previous['t'] - 1
+                if missed > 0:
+                    stats['missed_trades'] += missed
+            else:
+                missed = (event['E'] - previous['E']) // MINI_TICKER_INTERVAL_MS - 1
+                if missed > 0:
+                    stats['missed_updates'] += missed
+
+    def _record_disconnect(self, symbols, seconds):
+        with self._stats_lock:
+            for symbol in symbols:
+                self.gap_stats[symbol]['reconnects'] += 1
+                self.gap_stats[symbol]['disconnected_seconds'] += seconds
+
+
+class _StreamConnection:
+    """One multiplexed connection, reopened and resubscribed until stopped."""
+
+    _request_ids = itertools.count(1)
+
+    def __init__(self, client, symbols):
+        self.client = client
+        self.symbols = symbols
+        self.logger = client.logger
+        self._ws = None
+        self._thread = None
+        self._disconnected_at = None
+        self._opened = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"ws-{self.symbols[0]}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._ws is not None:
+            self._ws.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        delay = self.client.reconnect_delay
+        while not self.client._stop_event.is_set():
+            self._ws = websocket.WebSocketApp(
+                self.client.stream_url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error
+            )
+            self._opened = False
+            self._ws.run_forever(ping_interval=self.client.ping_interval,
+                                 ping_timeout=self.client.ping_timeout, reconnect=0)
+            if self.client._stop_event.is_set():
+                break
+            if self._disconnected_at is None:
+                self._disconnected_at = time.monotonic()
+            # Only consecutive failed attempts keep growing the backoff
+            if self._opened:
+                delay = self.client.reconnect_delay
+            self.logger.warning("Stream connection for %d symbols closed, reconnecting in %.1fs",
+                                len(self.symbols), delay)
+            self.client._stop_event.wait(delay)
+            delay = min(delay * 2, self.client.max_reconnect_delay)
+
+    def _on_open(self, ws):
+        self._opened = True
+        ws.send(json.dumps({
+            'method': 'SUBSCRIBE',
+            'params': [self.client.stream_name(symbol) for symbol in self.symbols],
+            'id': next(self._request_ids)
+        }))
+        if self._disconnected_at is not None:
+            self.client._record_disconnect(self.symbols, time.monotonic() - self._disconnected_at)
+            self._disconnected_at = None
+
+    def _on_message(self, ws, message):
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            self.logger.warning("Ignoring non-JSON stream message")
+            return
+        # Subscription acknowledgements look like {"result": null, "id": 1}
+        if 'data' in payload:
+            self.client.ingest_data(payload['data'])
+
+    def _on_error(self, ws, error):
+        self.logger.error("Stream connection error: %s", error)
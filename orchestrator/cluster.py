@@ -0,0 +1,122 @@
+import bisect
+import hashlib
+import os
+import socket
+import time
+import zlib
+
+from database.cluster_repository import ClusterRepository
+from utils.logger import get_logger
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def shard_of(symbol, shards):
+    """Shard a symbol belongs to, stable across processes and hosts."""
+    return zlib.crc32(symbol.encode()) % shards
+
+
+class HashRing:
+    """Consistent hash ring of nodes with virtual_nodes points each.
+
+    When a node joins or leaves, only the keys between its points and their
+    predecessors move, about 1/N of all keys.
+    """
+
+    def __init__(self, nodes, virtual_nodes=64):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key):
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class ClusterMembership:
+    """Decides which symbols this orchestrator instance owns in cluster mode.
+
+    Symbols are grouped into a fixed number of shards. Every live node places
+    the shards on a consistent hash ring of all nodes with a recent heartbeat
+    and claims the ones that land on itself with a lease in shard_lease. A
+    shard held by another node is only taken over once that node released it
+    or its lease expired, so a shard never has two owners. Nodes that stop
+    heartbeating drop out of the ring after lease_ttl seconds and their shards
+    move to the remaining nodes; a node that cannot reach the database gives
+    its shards up before its leases expire.
+    """
+
+    def __init__(self, config, repository=None):
+        cluster_config = config.get('cluster', {})
+        self.node_id = (cluster_config.get('node_id') or os.environ.get('CLUSTER_NODE_ID')
+                        or f'{socket.gethostname()}-{os.getpid()}')
+        self.shards = cluster_config.get('shards', 256)
+        self.lease_ttl = cluster_config.get('lease_ttl', 30)
+        self.heartbeat_interval = cluster_config.get('heartbeat_interval', self.lease_ttl / 3)
+        self.virtual_nodes = cluster_config.get('virtual_nodes', 64)
+        self.symbols = list(config['symbols'])
+        self.repository = repository or ClusterRepository()
+        self.owned_shards = set()
+        # Shards given up by sync() whose leases are still held until release()
+        self.releasing = set()
+        # Monotonic time of the last successful sync, the leases are valid for lease_ttl from then on
+        self.renewed_at = None
+        self.logger = get_logger(self.__class__.__name__)
+
+    def sync(self):
+        """Heartbeat, rebalance and renew leases, then return the owned symbols.
+
+        Shards that moved to another node are no longer owned but stay leased
+        until release() is called, after their counters have been saved.
+        """
+        started = time.monotonic()
+        self.repository.heartbeat(self.node_id)
+        nodes = self.repository.live_nodes(self.lease_ttl)
+        if self.node_id not in nodes:
+            nodes.append(self.node_id)
+        ring = HashRing(nodes, self.virtual_nodes)
+        desired = {shard for shard in range(self.shards) if ring.node_for(f'shard-{shard}') == self.node_id}
+        self.releasing = (self.releasing | self.owned_shards) - desired
+        claimed = set(self.repository.claim_shards(self.node_id, sorted(desired), self.lease_ttl))
+        if claimed != self.owned_shards:
+            self.logger.info("Node %s owns %d of %d shards (%d nodes live, %d waiting for handover)",
+                             self.node_id, len(claimed), self.shards, len(nodes), len(desired - claimed))
+        self.owned_shards = claimed
+        self.renewed_at = started
+        return self.owned_symbols()
+
+    def fence_if_expiring(self):
+        """Give up every shard when sync keeps failing and the leases would expire before the next one.
+
+        Other nodes take the shards over once the leases expired, so this node
+        has to stop ingesting them before. Returns True if it did.
+        """
+        if not self.owned_shards and not self.releasing:
+            return False
+        if time.monotonic() - self.renewed_at + self.heartbeat_interval < self.lease_ttl:
+            return False
+        self.logger.warning("Node %s could not renew its leases, giving up %d shards",
+                            self.node_id, len(self.owned_shards))
+        self.owned_shards = set()
+        self.releasing = set()
+        return True
+
+    def release(self):
+        """Hand the shards given up by the last sync() over, the new owner claims them on its next sync."""
+        if self.releasing:
+            self.repository.release_shards(self.node_id, sorted(self.releasing))
+            self.releasing = set()
+
+    def owned_symbols(self):
+        return [symbol for symbol in self.symbols if shard_of(symbol, self.shards) in self.owned_shards]
+
+    def leave(self):
+        """Release every shard so the other nodes take over without waiting for the leases to expire."""
+        self.repository.leave(self.node_id)
+        self.owned_shards = set()
+        self.releasing = set()
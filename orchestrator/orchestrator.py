@@ -1,72 +1,335 @@
+from datetime import datetime, timezone
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.triggers.interval import IntervalTrigger
+from archive.parquet_archive import ParquetArchiver
 from ingestion.binance_ingestion import BinanceIngestionClient
+from ingestion.async_binance_ingestion import AsyncBinanceIngestionClient
+from ingestion.binance_websocket_ingestion import BinanceWebSocketIngestionClient
+from orchestrator.cluster import ClusterMembership
 from transformation.transformer import DataTransformer
+from transformation.streaming_downsampler import StreamingDownsampler
 from utils.config_loader import ConfigLoader
+from utils.gap_detector import GapDetector
 from utils.logger import get_logger
-from database.raw_data_repository import RawDataRepository
+from utils.metrics import configure_metrics, SCHEDULER_TICK_LAG_SECONDS, SCHEDULER_MISSED_RUNS
+from database.compacted_raw_data_repository import create_raw_data_repository, raw_data_table
+from database.raw_data_writer import RawDataWriter
+from database.stats_catalog import STATS_COLLECTOR, StatsCatalogRepository
+from database.timescale_backend import TimescaleBackend
+from utils.retention_manager import RetentionManager
 from utils.state_manager import StateManager
 
 class Orchestrator:
-    def __init__(self):
-        self.config = ConfigLoader.load_config()
-        self.ingestion_client = BinanceIngestionClient(self.config)
-        self.transformer = DataTransformer(self.config)
+    # Ingestion modes whose client runs its own loop instead of scheduler jobs
+    SELF_SCHEDULED_CLIENTS = {
+        'async': AsyncBinanceIngestionClient,
+        'websocket': BinanceWebSocketIngestionClient,
+    }
+
+    def __init__(self, config=None, raw_data_repo=None, state_manager=None, transformer=None, retention_manager=None):
+        self.config = config or ConfigLoader.load_config()
+        self.metrics_server = configure_metrics(self.config)
+        if self.config.get('database', {}).get('backend', 'postgresql') == 'sqlite':
+            for section in ('cluster', 'timescale'):
+                if self.config.get(section, {}).get('enabled', False):
+                    raise ValueError(f"{section} requires the postgresql database backend")
+        self.cluster = None
+        universe_config = self.config
+        if self.config.get('cluster', {}).get('enabled', False):
+            self.cluster = ClusterMembership(self.config)
+            # Every component shares this list, it is updated in place when shards move
+            self.config = dict(self.config, symbols=[])
+        self.timescale_enabled = self.config.get('timescale', {}).get('enabled', False)
+        if self.timescale_enabled and self.config.get('raw_storage', {}).get('compaction', False):
+            # The continuous aggregate is defined on raw_data
+            raise ValueError("raw_storage.compaction cannot be combined with timescale")
+        self.raw_data_repo = raw_data_repo or create_raw_data_repository(self.config)
+        self.timescale_backend = None
+        if self.timescale_enabled:
+            self.timescale_backend = TimescaleBackend(self.config)
+            self.timescale_backend.setup()
+        self.raw_data_writer = None
+        if self.config.get('raw_writer', {}).get('enabled', False):
+            self.raw_data_writer = RawDataWriter.from_config(self.config, self.raw_data_repo)
+        raw_data_sink = self.raw_data_writer or self.raw_data_repo
+        self.streaming_downsampler = None
+        streaming_config = self.config.get('streaming_downsampling', {})
+        # With TimescaleDB, downsampled_data is a continuous aggregate and cannot be written to
+        if streaming_config.get('enabled', False) and not self.timescale_enabled:
+            store_raw = streaming_config.get('store_raw', True)
+            self.streaming_downsampler = StreamingDownsampler(
+                self.config, downstream=raw_data_sink if store_raw else None,
+                # Windows open across a restart are downsampled from the raw data points; rollups are not
+                # maintained in streaming mode
+                recovery_transformer=DataTransformer(dict(self.config, rollups={'enabled': False}))
+                if store_raw else None
+            )
+            raw_data_sink = self.streaming_downsampler
+        self.raw_data_sink = raw_data_sink
+        self.state_manager = state_manager or StateManager()
+        self.ingestion_mode = self.config.get('ingestion_mode', 'batch')
+        self.ingestion_client = self._create_ingestion_client()
+        self.transformer = transformer or DataTransformer(self.config)
+        self.stats_repo = None
+        if self.config.get('stats_catalog', {}).get('enabled', True):
+            self.stats_repo = StatsCatalogRepository()
+        self.gap_detector = None
+        if self.config.get('gap_detection', {}).get('enabled', False):
+            self.gap_detector = GapDetector(self.config, raw_data_repo=self.raw_data_repo)
+        self.archiver = None
+        if self.config.get('archive', {}).get('enabled', False):
+            self.archiver = ParquetArchiver(self.config)
+        self.retention_manager = retention_manager or RetentionManager(
+            # Dropping TimescaleDB chunks affects every symbol at once
+            universe_config if self.timescale_enabled else self.config,
+            raw_data_repo=self.raw_data_repo, timescale_backend=self.timescale_backend
+        )
         executors = {
             'default': ThreadPoolExecutor(max_workers=self.config['max_workers'])
         }
         self.scheduler = BackgroundScheduler(executors=executors)
+        self.scheduler.add_listener(self._record_job_event,
+                                    EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
         self.logger = get_logger(self.__class__.__name__)
-        self.raw_data_repo = RawDataRepository()
-        self.state_manager = StateManager()
         self._configure_jobs()
 
     def _configure_jobs(self):
         try: 
-            sampling_frequency = self.config['sampling_frequency']
+            ingestion_mode = self.ingestion_mode
+            if ingestion_mode in self.SELF_SCHEDULED_CLIENTS:
+                # The client runs its own loop, see start()
+                pass
+            elif ingestion_mode == 'batch':
+                # Schedule one ingestion job that fetches all symbols per tick
+                self.scheduler.add_job(
+                    self.ingestion_client.ingest_batch,
+                    # sampling_frequency, or the tick of the adaptive sampler
+                    trigger=IntervalTrigger(seconds=self.ingestion_client.tick_interval),
+                    id='ingest_data_batch'
+                )
+            elif ingestion_mode == 'per_symbol':
+                # Schedule data ingestion for each symbol
+                for symbol in self.config['symbols']:
+                    self._add_symbol_job(symbol)
+            else:
+                raise ValueError(f"Unknown ingestion_mode: {ingestion_mode}")
+
+            if self.streaming_downsampler:
+                # Windows are aggregated while ingesting, only emit the closed ones
+                self.scheduler.add_job(
+                    self._flush_streaming_downsampler,
+                    'interval',
+                    seconds=self.config['streaming_downsampling'].get('flush_interval', 10),
+                    id='streaming_downsampling'
+                )
+            elif not self.timescale_enabled:
+                # Schedule the data transformation job
+                self.scheduler.add_job(
+                    self.transformer.transform_data,
+                    'interval',
+                    minutes=self.config['downsampling_frequency'],
+                    id='data_transformation'
+                )
 
-            # Schedule data ingestion for each symbol
-            for symbol in self.config['symbols']:
+            if self.cluster:
+                # Heartbeat, rebalance and renew the shard leases
                 self.scheduler.add_job(
-                    self.ingestion_client.ingest_data,
-                    trigger=IntervalTrigger(seconds=sampling_frequency),
-                    args=[symbol],
-                    id=f'ingest_data_{symbol}'
+                    self._sync_cluster,
+                    'interval',
+                    seconds=self.cluster.heartbeat_interval,
+                    id='cluster_sync'
                 )
 
-            # Schedule the data transformation job
+            # Schedule the ingestion state checkpoint job
             self.scheduler.add_job(
-                self.transformer.transform_data,
+                self._checkpoint_state,
                 'interval',
-                minutes=self.config['downsampling_frequency'],
-                id='data_transformation'
+                seconds=self.config.get('state_checkpoint_interval', 10),
+                id='state_checkpoint'
             )
 
-            # Schedule the raw data cleanup job
+            if self.stats_repo:
+                # Write the statistics collected by the repositories to table_stats
+                self.scheduler.add_job(
+                    self._flush_stats,
+                    'interval',
+                    seconds=self.config.get('stats_catalog', {}).get('flush_interval', 30),
+                    id='stats_catalog_flush'
+                )
+
+            if self.gap_detector:
+                # Find pauses in the raw data and refill them from Binance
+                self.scheduler.add_job(
+                    self._detect_gaps,
+                    'interval',
+                    minutes=self.config['gap_detection'].get('interval_minutes', 10),
+                    id='gap_detection'
+                )
+
+            # Schedule the raw data retention job
             self.scheduler.add_job(
                 self._cleanup_raw_data,
+                'interval',
+                minutes=self.config.get('retention', {}).get('interval_minutes', 60),
+                id='raw_data_cleanup'
+            )
+
+            # Schedule the collected points reset job
+            self.scheduler.add_job(
+                self._reset_ingestion_state,
                 'cron',
                 hour=0,  # Run daily at midnight
-                id='raw_data_cleanup'
+                id='ingestion_state_reset'
             )
         except Exception as e:
             self.logger.error("Error configuring jobs: %s", e)
 
+    def _create_ingestion_client(self):
+        ingestion_client_class = self.SELF_SCHEDULED_CLIENTS.get(self.ingestion_mode, BinanceIngestionClient)
+        return ingestion_client_class(self.config, raw_data_sink=self.raw_data_sink, state_manager=self.state_manager)
+
+    def _add_symbol_job(self, symbol):
+        self.scheduler.add_job(
+            self.ingestion_client.ingest_data,
+            trigger=IntervalTrigger(seconds=self.ingestion_client.tick_interval),
+            args=[symbol],
+            id=f'ingest_data_{symbol}'
+        )
+
+    def _sync_cluster(self, started=True):
+        try:
+            symbols = self.cluster.sync()
+        except Exception as e:
+            self.logger.error("Error syncing cluster membership: %s", e)
+            if not self.cluster.fence_if_expiring():
+                return
+            # Another node may own these symbols once the leases expired
+            symbols = []
+        current = self.config['symbols']
+        if symbols == current:
+            self._release_shards()
+            return
+        added = [symbol for symbol in symbols if symbol not in current]
+        removed = [symbol for symbol in current if symbol not in symbols]
+        current[:] = symbols
+        if self.ingestion_mode == 'per_symbol':
+            for symbol in removed:
+                self.scheduler.remove_job(f'ingest_data_{symbol}')
+            for symbol in added:
+                self._add_symbol_job(symbol)
+        elif self.ingestion_mode == 'websocket':
+            # Stream connections are fixed per client, subscribe to the new symbols from scratch
+            if started:
+                self.ingestion_client.stop()
+            self.ingestion_client = self._create_ingestion_client()
+            if started:
+                self.ingestion_client.start()
+        self._release_shards()
+        if added:
+            # The previous owner may have advanced the counters of these symbols
+            self.state_manager.load()
+        self.logger.info("Now ingesting %d symbols (%d added, %d removed)", len(symbols), len(added), len(removed))
+
+    def _release_shards(self):
+        if not self.cluster.releasing:
+            return
+        # The new owner loads the counters when it claims a shard, they have to be saved first
+        if not self._checkpoint_state():
+            # Retried on the next sync; the leases are not renewed, so they expire at the latest
+            return
+        try:
+            self.cluster.release()
+        except Exception as e:
+            self.logger.error("Error releasing shards: %s", e)
+
+    def _record_job_event(self, event):
+        if event.code == EVENT_JOB_SUBMITTED:
+            now = datetime.now(timezone.utc)
+            for run_time in event.scheduled_run_times:
+                SCHEDULER_TICK_LAG_SECONDS.labels(event.job_id).observe((now - run_time).total_seconds())
+        else:
+            # Missed its misfire grace time, or the previous run was still going
+            SCHEDULER_MISSED_RUNS.labels(event.job_id).inc()
+
     def _cleanup_raw_data(self):
+        if self.cluster and self.timescale_enabled and 0 not in self.cluster.owned_shards:
+            # Chunks are dropped for all symbols by the owner of shard 0 only
+            return
         self.logger.info("Starting raw data cleanup...")
         try:
-            self.raw_data_repo.delete_all_raw_data()
-            self.state_manager.reset_state()
+            if self.archiver:
+                # Closed days are exported before retention may delete them
+                self.archiver.archive()
+            self.retention_manager.apply()
             self.logger.info("Raw data cleanup completed.")
         except Exception as e:
             self.logger.error("Error during raw data cleanup: %s", e)
 
+    def _reset_ingestion_state(self):
+        try:
+            self.state_manager.reset_state()
+        except Exception as e:
+            self.logger.error("Error resetting ingestion state: %s", e)
+
+    def _flush_streaming_downsampler(self):
+        try:
+            self.streaming_downsampler.flush()
+        except Exception as e:
+            self.logger.error("Error flushing streaming downsampler: %s", e)
+
+    def _flush_stats(self):
+        try:
+            STATS_COLLECTOR.flush(self.stats_repo)
+            self.stats_repo.refresh_bytes([raw_data_table(self.config), 'downsampled_data'])
+        except Exception as e:
+            self.logger.error("Error flushing table statistics: %s", e)
+
+    def _detect_gaps(self):
+        try:
+            self.gap_detector.run()
+        except Exception as e:
+            self.logger.error("Error detecting data gaps: %s", e)
+
+    def _checkpoint_state(self):
+        try:
+            self.state_manager.checkpoint()
+            return True
+        except Exception as e:
+            self.logger.error("Error checkpointing ingestion state: %s", e)
+            return False
+
     def start(self):
         self.logger.info("Starting orchestrator...")
+        if self.raw_data_writer:
+            self.raw_data_writer.start()
+        if self.cluster:
+            # Claim shards before the first ingestion tick
+            self._sync_cluster(started=False)
         self.scheduler.start()
+        if self.ingestion_mode in self.SELF_SCHEDULED_CLIENTS:
+            self.ingestion_client.start()
 
     def stop(self):
         self.logger.info("Stopping orchestrator...")
+        if self.ingestion_mode in self.SELF_SCHEDULED_CLIENTS:
+            self.ingestion_client.stop()
         self.scheduler.shutdown()
+        if self.streaming_downsampler:
+            # Windows that are still open are left to the next start, which recovers them from raw data
+            self._flush_streaming_downsampler()
+        if self.raw_data_writer:
+            # Runs after the scheduler has drained its jobs so no row is left queued
+            self.raw_data_writer.stop()
+        self._checkpoint_state()
+        if self.stats_repo:
+            self._flush_stats()
+        if self.cluster:
+            try:
+                self.cluster.leave()
+            except Exception as e:
+                self.logger.error("Error leaving the cluster: %s", e)
+        if self.metrics_server:
+            self.metrics_server.shutdown()
         self.logger.info("Orchestrator stopped.")
@@ -0,0 +1,91 @@
+# tests/test_adaptive_sampler.py
+
+import numpy as np
+import pytest
+from ingestion.adaptive_sampler import AdaptiveSampler
+
+SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'XLMUSDT', 'ICPUSDT']
+
+def make_sampler(**overrides):
+    sampler_config = {'enabled': True, 'min_interval': 0.5, 'max_interval': 30, 'target_move_bps': 1,
+                      'rebalance_interval': 1, 'redistribute': 0.5}
+    sampler_config.update(overrides)
+    config = {'symbols': list(SYMBOLS), 'sampling_frequency': 1, 'adaptive_sampling': sampler_config}
+    return AdaptiveSampler(config, clock=lambda: 0.0)
+
+def feed(sampler, seconds, volatility_bps):
+    """
+    Observe a random walk per symbol once a second, with the given per-second volatility in basis points.
+    """
+    rng = np.random.default_rng(0)
+    prices = {symbol: 100.0 for symbol in volatility_bps}
+    for now in range(seconds):
+        for symbol, bps in volatility_bps.items():
+            prices[symbol] *= np.exp(rng.normal(0, bps / 10000))
+            sampler.observe(symbol, prices[symbol], now=now)
+
+@pytest.fixture
+def sampler():
+    """
+    Fixture for a sampler that has seen one busy, one moderate and two flat symbols.
+    """
+    sampler = make_sampler()
+    feed(sampler, 60, {'BTCUSDT': 4, 'ETHUSDT': 1, 'XLMUSDT': 0, 'ICPUSDT': 0})
+    sampler.due_symbols(now=0)
+    return sampler
+
+def test_intervals_follow_volatility_within_the_budget(sampler):
+    """
+    Test that flat symbols drift to max_interval, busy ones are polled faster and the poll budget holds.
+    """
+    intervals = sampler.intervals
+    assert intervals['XLMUSDT'] == intervals['ICPUSDT'] == 30
+    assert intervals['BTCUSDT'] == 0.5
+    assert intervals['BTCUSDT'] < intervals['ETHUSDT'] < intervals['XLMUSDT']
+    assert sum(1 / interval for interval in intervals.values()) <= len(SYMBOLS) / 1
+
+def test_freed_budget_goes_to_the_most_active_symbols():
+    """
+    Test that the freed polls are handed to the most volatile symbols first, up to min_interval.
+    """
+    sampler = make_sampler(min_interval=0.1, target_move_bps=10, redistribute=1.0)
+    feed(sampler, 60, {'BTCUSDT': 4, 'ETHUSDT': 2, 'XLMUSDT': 0, 'ICPUSDT': 0})
+    sampler.due_symbols(now=0)
+
+    rates = {symbol: 1 / interval for symbol, interval in sampler.intervals.items()}
+    assert sum(rates.values()) == pytest.approx(len(SYMBOLS))
+    # ETHUSDT keeps the interval its volatility asks for, BTCUSDT takes the rest
+    assert 15 < sampler.intervals['ETHUSDT'] < 30
+    assert rates['BTCUSDT'] > 3.5
+
+    # Without redistribution the freed polls are saved
+    sampler = make_sampler(min_interval=0.1, target_move_bps=10, redistribute=0.0)
+    feed(sampler, 60, {'BTCUSDT': 4, 'ETHUSDT': 2, 'XLMUSDT': 0, 'ICPUSDT': 0})
+    sampler.due_symbols(now=0)
+    assert sum(1 / interval for interval in sampler.intervals.values()) < 2
+
+def test_due_symbols_and_weight_saved(sampler):
+    """
+    Test that symbols are only due once their interval has passed and that the skipped polls count as saved weight.
+    """
+    polled = {symbol: 0 for symbol in SYMBOLS}
+    now = 0.5
+    while now <= 60:
+        for symbol in sampler.due_symbols(now=now):
+            polled[symbol] += 1
+            sampler.record_weight(2)
+        now += 0.5
+
+    assert polled['BTCUSDT'] == 120
+    assert polled['XLMUSDT'] <= 3
+    # Static polling of 4 symbols at 1s costs 2 * 4 per second
+    assert sampler.weight_saved() == pytest.approx(60 * 8 - 2 * sum(polled.values()), abs=8)
+    assert sampler.weight_saved() > 0
+
+def test_disabled_by_default():
+    """
+    Test that no sampler is created unless adaptive_sampling is enabled.
+    """
+    assert AdaptiveSampler.from_config({'symbols': SYMBOLS, 'sampling_frequency': 1}) is None
+    with pytest.raises(ValueError):
+        make_sampler(min_interval=10, max_interval=5)
@@ -0,0 +1,105 @@
+# tests/test_aggregations.py
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from database.aggregate_repository import AggregateRepository
+from database.database import Database
+from database.raw_data_repository import RawDataRepository
+from transformation.aggregations import (
+    AggregationSet, LogBucketSketch, aggregate_windows, merge_windows, states_from_frame, storage_frame
+)
+from transformation.transformer import DataTransformer
+
+START = pd.Timestamp('2024-01-01', tz='UTC')
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    """
+    Fixture that points Database at an embedded SQLite file for the duration of a test.
+    """
+    engine, session_local = Database._engine, Database._SessionLocal
+    Database.initialize({'backend': 'sqlite', 'path': str(tmp_path / 'binance.sqlite')})
+    yield Database.get_engine()
+    Database._engine.dispose()
+    Database._engine, Database._SessionLocal = engine, session_local
+
+def _prices(seconds, seed=0):
+    """
+    One random walk price per second and symbol.
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = START + pd.to_timedelta(np.arange(seconds), unit='s')
+    return pd.concat([
+        pd.DataFrame({'symbol': symbol, 'timestamp': timestamps,
+                      'price': 100 * np.exp(np.cumsum(rng.normal(0, 1e-3, seconds)))})
+        for symbol in SYMBOLS
+    ], ignore_index=True)
+
+def test_windows_match_pandas_and_sketches_merge_exactly():
+    """
+    Test the registry against pandas, and that merged minute states equal aggregating the hour directly.
+    """
+    df = _prices(7200)
+    aggregations = AggregationSet(['count', 'mean', 'median', 'stddev', 'min', 'max', 'p95'], accuracy=0.005)
+    windows, _ = aggregate_windows(df, '5T', aggregations)
+    grouped = df.assign(timestamp=df['timestamp'].dt.floor('5T')).groupby(['symbol', 'timestamp'])['price']
+    expected = grouped.agg(['count', 'mean', 'median', 'std', 'min', 'max']).reset_index()
+    for name, column in [('count', 'count'), ('mean', 'mean'), ('median', 'median'), ('stddev', 'std'),
+                         ('min', 'min'), ('max', 'max')]:
+        np.testing.assert_allclose(windows[name], expected[column], rtol=1e-9)
+    # The sketch returns the value of rank q * (n - 1) rounded down within its accuracy
+    p95 = grouped.apply(lambda prices: np.quantile(prices, 0.95, method='lower')).to_numpy()
+    assert np.max(np.abs(windows['p95'] - p95) / p95) <= 0.005
+
+    mergeable = AggregationSet(['count', 'mean', 'stddev', 'min', 'max', 'p95'], accuracy=0.005)
+    minutes, states = aggregate_windows(df, '1T', mergeable)
+    stored = storage_frame(minutes, states, mergeable.names)
+    hours, merged = merge_windows(stored, states_from_frame(stored, mergeable), '60T', mergeable)
+    direct, direct_states = aggregate_windows(df, '60T', mergeable)
+    pd.testing.assert_frame_equal(hours, direct, check_exact=False, rtol=1e-9)
+    np.testing.assert_array_equal(merged['sketch'].keys, direct_states['sketch'].keys)
+    np.testing.assert_array_equal(merged['sketch'].counts, direct_states['sketch'].counts)
+
+    with pytest.raises(ValueError):
+        AggregationSet(['median']).merge(states, np.array([0, len(minutes)]))
+    with pytest.raises(ValueError):
+        LogBucketSketch.from_bytes(stored['sketch'].tolist(), accuracy=0.01)
+
+def test_transformer_stores_and_merges_aggregates(sqlite_database):
+    """
+    Test that the transformation stores the configured aggregations and merges rollup sketches level by level.
+    """
+    df = _prices(3600)
+    RawDataRepository().insert_raw_data_bulk([
+        (symbol, {'price': str(price)}, timestamp.to_pydatetime())
+        for symbol, timestamp, price in df.itertuples(index=False)
+    ])
+    config = {
+        'symbols': SYMBOLS, 'downsampling_frequency': 5, 'transform_grace_seconds': 0,
+        'rollups': {'enabled': True, 'resolutions': [1, 60]},
+        'aggregations': {'downsampled_data': ['max', 'p50'], 'rollup_data': ['stddev', 'p99']},
+    }
+    transformer = DataTransformer(config)
+    transformer.transform_data(now=START + timedelta(hours=1))
+
+    aggregate_repo = AggregateRepository()
+    windows = aggregate_repo.fetch_aggregates('downsampled_data', 'BTCUSDT', 5)
+    expected = df[df['symbol'] == 'BTCUSDT'].groupby(df['timestamp'].dt.floor('5T'))['price']
+    assert len(windows) == 12
+    np.testing.assert_allclose(windows['max'], expected.max(), rtol=1e-12)
+    np.testing.assert_allclose(windows['p50'], expected.median(), rtol=0.01)
+
+    # The hourly bucket is merged from the stored minute sketches
+    hour = aggregate_repo.fetch_aggregates('rollup_data', 'ETHUSDT', 60)
+    prices = df.loc[df['symbol'] == 'ETHUSDT', 'price']
+    assert len(hour) == 1
+    assert hour['stddev'].iloc[0] == pytest.approx(prices.std(), rel=1e-9)
+    p99 = np.quantile(prices, 0.99, method='lower')
+    assert abs(hour['p99'].iloc[0] - p99) / p99 <= 0.005
+
+    with pytest.raises(ValueError):
+        DataTransformer(dict(config, aggregations={'rollup_data': ['median']}))
@@ -0,0 +1,126 @@
+# tests/test_async_binance_ingestion.py
+
+import aiohttp
+import asyncio
+import json
+import time
+import pytest
+from aiohttp import web
+from unittest.mock import MagicMock
+from ingestion.async_binance_ingestion import AsyncBinanceIngestionClient
+from utils.rate_limiter import RateWindow, WeightedRateLimiter
+
+class FakeTickerServer:
+    """
+    Local stand-in for GET /api/v3/ticker/price that records every request it serves.
+    """
+
+    def __init__(self, rejected_symbols=()):
+        self.rejected_symbols = set(rejected_symbols)
+        self.requests = []
+
+    async def ticker_price(self, request):
+        self.requests.append(dict(request.query))
+        if 'symbols' in request.query:
+            symbols = json.loads(request.query['symbols'])
+            if self.rejected_symbols & set(symbols):
+                return web.json_response({'code': -1121, 'msg': 'Invalid symbol.'}, status=400)
+            return web.json_response([{'symbol': symbol, 'price': '1.0'} for symbol in symbols])
+        symbol = request.query['symbol']
+        if symbol in self.rejected_symbols:
+            return web.json_response({'code': -1121, 'msg': 'Invalid symbol.'}, status=400)
+        return web.json_response({'symbol': symbol, 'price': '1.0'})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/api/v3/ticker/price', self.ticker_price)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.runner.cleanup()
+
+def _make_client(base_url, symbols):
+    config = {
+        'symbols': symbols,
+        'data_points': 3,
+        'sampling_frequency': 0.05,
+        'api_rate_limit': 1000,
+        'batch_size': 2,
+        'base_url': base_url
+    }
+    state_manager = MagicMock()
+    collected_points = {}
+
+    def update_collected_points(symbol):
+        collected_points[symbol] = collected_points.get(symbol, 0) + 1
+        return collected_points[symbol]
+
+    state_manager.get_collected_points.side_effect = lambda symbol: collected_points.get(symbol, 0)
+    state_manager.update_collected_points.side_effect = update_collected_points
+    return AsyncBinanceIngestionClient(config, raw_data_sink=MagicMock(), state_manager=state_manager)
+
+def test_tick_loop_fetches_all_symbols_until_data_points():
+    """
+    Test that each tick fetches every pending symbol in chunks with one shared timestamp per tick.
+    """
+    async def scenario():
+        async with FakeTickerServer() as server:
+            client = _make_client(server.base_url, ['BTCUSDT', 'ETHUSDT', 'BNBUSDT'])
+            run_task = asyncio.ensure_future(client.run())
+            await asyncio.sleep(0.5)
+            client._stop_event.set()
+            await run_task
+            return server, client
+
+    server, client = asyncio.run(scenario())
+
+    calls = client.raw_data_sink.insert_raw_data.call_args_list
+    assert len(calls) == 9  # 3 symbols x data_points
+    for symbol in ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']:
+        assert sum(1 for c in calls if c.args[0] == symbol) == 3
+    assert len({c.args[2] for c in calls}) == 3  # one timestamp per tick
+    assert all('symbols' in query for query in server.requests)
+    assert client.stats['ticks'] >= 3
+
+def test_failed_chunk_falls_back_to_per_symbol():
+    """
+    Test that a rejected chunk is retried one symbol at a time and only the bad symbol is lost.
+    """
+    async def scenario():
+        async with FakeTickerServer(rejected_symbols=['ETHUSDT']) as server:
+            client = _make_client(server.base_url, ['BTCUSDT', 'ETHUSDT', 'BNBUSDT'])
+            client._loop = asyncio.get_running_loop()
+            client._executor = None
+            async with aiohttp.ClientSession(server.base_url) as session:
+                client._session = session
+                await client.ingest_batch()
+            return client
+
+    client = asyncio.run(scenario())
+
+    inserted = sorted(c.args[0] for c in client.raw_data_sink.insert_raw_data.call_args_list)
+    assert inserted == ['BNBUSDT', 'BTCUSDT']
+
+def test_async_rate_limiter_spaces_out_calls():
+    """
+    Test that acquire_async delays coroutines to the next window once the current one is used up.
+    """
+    limiter = WeightedRateLimiter([RateWindow('requests', 10, 1)])
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*[limiter.acquire_async() for _ in range(15)])
+        return time.monotonic() - start
+
+    until_next_window = 1 - time.time() % 1
+    elapsed = asyncio.run(scenario())
+
+    # 10 permits fit the current one-second window, the remaining 5 wait for the next one
+    assert elapsed == pytest.approx(until_next_window, abs=0.15)
+    assert limiter.stats['permits'] == 15
@@ -0,0 +1,240 @@
+# tests/test_backfill.py
+
+import json
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+from unittest.mock import MagicMock
+from database.database import Database
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.raw_data_repository import RawDataRepository
+from database.rollup_repository import RollupRepository
+from database.watermark_repository import WatermarkRepository
+from ingestion.backfill import BackfillEngine
+from transformation.transformer import DataTransformer
+from utils.rate_limiter import WeightedRateLimiter
+
+MINUTE_MS = 60 * 1000
+
+def kline_price(symbol, open_time):
+    return 100 + (open_time // MINUTE_MS) % 1000 + len(symbol)
+
+class _KlinesHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path != '/api/v3/klines':
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.server.requests += 1
+        self.server.used_weight += 2
+        # Klines of one minute every minute, as Binance returns them
+        start = -(-int(params['startTime']) // MINUTE_MS) * MINUTE_MS
+        end = int(params['endTime'])
+        limit = int(params.get('limit', 500))
+        klines = []
+        for open_time in range(start, end + 1, MINUTE_MS)[:limit]:
+            price = str(kline_price(params['symbol'], open_time))
+            klines.append([open_time, price, price, price, price, '1.0', open_time + MINUTE_MS - 1, price, 1,
+                           '0.5', price, '0'])
+        body = json.dumps(klines).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-MBX-USED-WEIGHT-1M', str(self.server.used_weight))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def klines_server():
+    """
+    Fixture for a local stand-in of the Binance klines endpoint.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _KlinesHandler)
+    server.requests = 0
+    server.used_weight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    """
+    Fixture that points Database at an embedded SQLite file for the duration of a test.
+    """
+    engine, session_local = Database._engine, Database._SessionLocal
+    Database.initialize({'backend': 'sqlite', 'path': str(tmp_path / 'binance.sqlite')})
+    yield Database.get_engine()
+    Database._engine.dispose()
+    Database._engine, Database._SessionLocal = engine, session_local
+
+class FakeProgressRepository:
+    """
+    Keeps backfill_progress rows in a dict.
+    """
+    def __init__(self):
+        self.rows = {}
+
+    def get_progress(self, symbols, source):
+        return {
+            (symbol, range_start): value
+            for (symbol, row_source, range_start), value in self.rows.items()
+            if row_source == source and symbol in symbols
+        }
+
+    def save_progress(self, symbol, source, range_start, range_end, cursor, completed):
+        self.rows[(symbol, source, range_start)] = (range_end, cursor, completed)
+
+class CollectingRawDataRepository:
+    """
+    Collects bulk inserted raw rows, keyed like the raw_data primary key.
+    """
+    def __init__(self):
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def insert_raw_data_bulk(self, rows):
+        with self.lock:
+            for symbol, data, timestamp in rows:
+                self.rows[(symbol, timestamp)] = float(data['price'])
+        return len(rows)
+
+def _engine(server, progress_repo, raw_data_repo, watermark_repo=None):
+    config = {
+        'symbols': ['BTCUSDT', 'ETHUSDT', 'BNBUSDT'],
+        'downsampling_frequency': 1,
+        'api_rate_limit': 1000,
+        'rate_limits': {'request_weight_per_minute': 100000},
+        'base_url': f'http://127.0.0.1:{server.server_address[1]}',
+        'backfill': {'source': 'klines', 'target': 'raw', 'workers': 4, 'segment_days': 7, 'kline_interval': '1m'}
+    }
+    return BackfillEngine(config, raw_data_repo=raw_data_repo, progress_repo=progress_repo,
+                          watermark_repo=watermark_repo or MagicMock(), rate_limiter=WeightedRateLimiter.from_config(config))
+
+def test_multi_symbol_multi_month_backfill(klines_server):
+    """
+    Test that two months of minute klines for three symbols are stored exactly once and reported with a throughput.
+    """
+    raw_data_repo = CollectingRawDataRepository()
+    engine = _engine(klines_server, FakeProgressRepository(), raw_data_repo)
+
+    report = engine.run(['BTCUSDT', 'ETHUSDT', 'BNBUSDT'], '2024-01-01', '2024-03-01')
+
+    minutes = (31 + 29) * 24 * 60
+    assert report['rows'] == 3 * minutes
+    assert len(raw_data_repo.rows) == 3 * minutes
+    assert report['failed_segments'] == 0
+    assert report['rows_per_second'] > 0
+    timestamp = datetime(2024, 2, 15, 12, 30, tzinfo=timezone.utc)
+    assert raw_data_repo.rows[('ETHUSDT', timestamp)] == kline_price('ETHUSDT', int(timestamp.timestamp() * 1000))
+    print(f"Backfilled {report['rows']} rows at {report['rows_per_second']:.0f} rows/s")
+
+def test_resumes_from_checkpoint(klines_server):
+    """
+    Test that completed segments are skipped and an interrupted segment continues at its cursor.
+    """
+    progress_repo = FakeProgressRepository()
+    raw_data_repo = CollectingRawDataRepository()
+    first = _engine(klines_server, progress_repo, raw_data_repo)
+    first.run(['BTCUSDT'], '2024-01-01', '2024-01-15')
+
+    # Pretend the second week stopped after its first day
+    week_two = datetime(2024, 1, 8, tzinfo=timezone.utc)
+    range_end, _, _ = progress_repo.rows[('BTCUSDT', 'klines_1m', week_two)]
+    progress_repo.save_progress('BTCUSDT', 'klines_1m', week_two, range_end,
+                                datetime(2024, 1, 9, tzinfo=timezone.utc), False)
+    klines_server.requests = 0
+
+    second = _engine(klines_server, progress_repo, raw_data_repo)
+    report = second.run(['BTCUSDT'], '2024-01-01', '2024-01-15')
+
+    assert report['rows'] == 6 * 24 * 60
+    assert klines_server.requests == 9
+    assert progress_repo.rows[('BTCUSDT', 'klines_1m', week_two)][2] is True
+
+def test_raw_backfill_rewinds_transform_watermarks(klines_server):
+    """
+    Test that the transform watermark is moved back to the start of a raw backfill.
+    """
+    watermark_repo = MagicMock()
+    engine = _engine(klines_server, FakeProgressRepository(), CollectingRawDataRepository(), watermark_repo)
+
+    engine.run(['BTCUSDT'], '2024-01-01', '2024-01-02')
+
+    watermark_repo.rewind_watermarks.assert_called_once_with(
+        {'BTCUSDT': datetime(2024, 1, 1, tzinfo=timezone.utc)}, stage='downsampled_data'
+    )
+
+def test_backfill_rewinds_archive_watermarks(klines_server):
+    """
+    Test that the archive watermarks of the written tables are moved back to the day of the start.
+    """
+    config = {
+        'symbols': ['BTCUSDT'], 'downsampling_frequency': 1,
+        'api_rate_limit': 1000, 'rate_limits': {'request_weight_per_minute': 100000},
+        'base_url': f'http://127.0.0.1:{klines_server.server_address[1]}',
+        'archive': {'enabled': True, 'tables': ['raw_data', 'downsampled_data']},
+        'backfill': {'source': 'klines', 'target': 'raw', 'workers': 1, 'kline_interval': '1m'}
+    }
+    watermark_repo = MagicMock()
+    engine = BackfillEngine(config, raw_data_repo=CollectingRawDataRepository(), progress_repo=FakeProgressRepository(),
+                            watermark_repo=watermark_repo, rate_limiter=WeightedRateLimiter.from_config(config))
+
+    engine.run(['BTCUSDT'], datetime(2024, 1, 1, 9, 30, tzinfo=timezone.utc), datetime(2024, 1, 1, 10, tzinfo=timezone.utc))
+
+    rewinds = {c.kwargs['stage']: c.args[0]['BTCUSDT'] for c in watermark_repo.rewind_watermarks.call_args_list}
+    assert rewinds == {
+        'downsampled_data': datetime(2024, 1, 1, 9, 30, tzinfo=timezone.utc),
+        'archive_raw_data': datetime(2024, 1, 1, tzinfo=timezone.utc),
+        'archive_downsampled_data': datetime(2024, 1, 1, tzinfo=timezone.utc),
+    }
+
+def test_unaligned_backfill_reaggregates_whole_windows(klines_server, sqlite_database):
+    """
+    Test that a backfill starting in the middle of a window rewinds every stage to a window start, so the
+    stored windows and rollup buckets are aggregated from all of their rows.
+    """
+    config = {
+        'symbols': ['BTCUSDT'], 'downsampling_frequency': 5, 'transform_grace_seconds': 0,
+        'rollups': {'enabled': True, 'resolutions': [5, 15]},
+        'api_rate_limit': 1000, 'rate_limits': {'request_weight_per_minute': 100000},
+        'base_url': f'http://127.0.0.1:{klines_server.server_address[1]}',
+        'backfill': {'source': 'klines', 'target': 'raw', 'workers': 1, 'kline_interval': '1m'}
+    }
+    raw_data_repo = RawDataRepository()
+    # One point per minute from 09:00 to 09:59, with 09:33 to 09:38 missing
+    raw_data_repo.insert_raw_data_bulk([
+        ('BTCUSDT', {'price': str(50 + minute)}, datetime(2024, 1, 1, 9, minute, tzinfo=timezone.utc))
+        for minute in range(60) if not 33 <= minute <= 38
+    ])
+    transformer = DataTransformer(config)
+    transformer.transform_data(now=datetime(2024, 1, 1, 10, tzinfo=timezone.utc))
+
+    engine = BackfillEngine(config, raw_data_repo=raw_data_repo, progress_repo=FakeProgressRepository(),
+                            rate_limiter=WeightedRateLimiter.from_config(config))
+    engine.run(['BTCUSDT'], datetime(2024, 1, 1, 9, 32, 30, tzinfo=timezone.utc),
+               datetime(2024, 1, 1, 9, 39, tzinfo=timezone.utc))
+    watermarks = [WatermarkRepository().get_watermarks(['BTCUSDT'], stage=stage)['BTCUSDT']
+                  for stage in ['downsampled_data', 'rollup_5m', 'rollup_15m']]
+    assert watermarks == [datetime(2024, 1, 1, 9, 30, tzinfo=timezone.utc)] * 3
+    transformer.transform_data(now=datetime(2024, 1, 1, 10, tzinfo=timezone.utc))
+
+    raw = raw_data_repo.fetch_unprocessed_data('BTCUSDT').set_index('timestamp')['price'].astype(float)
+    assert len(raw) == 60
+    expected = raw.resample('5min').agg(['mean', 'median'])
+    stored = DownsampledDataRepository().fetch_downsampled_data('BTCUSDT').set_index('timestamp')
+    pd.testing.assert_series_equal(stored['avg_price'], expected['mean'], check_names=False, check_freq=False)
+    pd.testing.assert_series_equal(stored['median_price'], expected['median'], check_names=False, check_freq=False)
+    quarters = RollupRepository().fetch_rollups('BTCUSDT', 15).set_index('timestamp')
+    assert quarters['count'].tolist() == [15, 15, 15, 15]
+    assert quarters['sum'].tolist() == raw.resample('15min').sum().tolist()
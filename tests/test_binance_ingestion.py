@@ -0,0 +1,102 @@
+# tests/test_binance_ingestion.py
+
+import pytest
+from unittest.mock import MagicMock, patch
+from ingestion.binance_ingestion import BinanceIngestionClient, chunk_symbols
+
+@pytest.fixture
+def sample_client():
+    """
+    Fixture to create a BinanceIngestionClient with its Binance client and repositories mocked.
+    """
+    config = {
+        'symbols': ['BTCUSDT', 'ETHUSDT', 'BNBUSDT'],
+        'data_points': 10,
+        'api_rate_limit': 100,
+        'batch_size': 2
+    }
+    with patch('ingestion.binance_ingestion.Client'), \
+         patch('ingestion.binance_ingestion.StateManager'), \
+         patch('ingestion.binance_ingestion.RawDataRepository'):
+        client = BinanceIngestionClient(config)
+
+    client.client = MagicMock()
+    client.raw_data_sink = MagicMock()
+    client.state_manager = MagicMock()
+    client.state_manager.get_collected_points.return_value = 0
+    client.state_manager.update_collected_points.return_value = 1
+    return client
+
+def test_chunk_symbols():
+    """
+    Test that symbols are split into chunks of at most batch_size.
+    """
+    assert chunk_symbols(['A', 'B', 'C', 'D', 'E'], 2) == [['A', 'B'], ['C', 'D'], ['E']]
+    assert chunk_symbols([], 2) == []
+    with pytest.raises(ValueError):
+        chunk_symbols(['A'], 0)
+
+def test_ingest_batch_fans_out_with_shared_timestamp(sample_client):
+    """
+    Test that one request per chunk is made and every symbol gets a raw row with the same timestamp.
+    """
+    client = sample_client
+    client.client.ticker_price.side_effect = lambda symbols: [
+        {'symbol': symbol, 'price': '1.0'} for symbol in symbols
+    ]
+
+    client.ingest_batch()
+
+    assert client.client.ticker_price.call_count == 2
+    calls = client.raw_data_sink.insert_raw_data.call_args_list
+    assert [c.args[0] for c in calls] == ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']
+    assert len({c.args[2] for c in calls}) == 1
+
+def test_ingest_batch_skips_completed_symbols(sample_client):
+    """
+    Test that symbols which already reached data_points are not requested.
+    """
+    client = sample_client
+    client.state_manager.get_collected_points.side_effect = lambda symbol: 10 if symbol == 'ETHUSDT' else 0
+    client.client.ticker_price.side_effect = lambda symbols: [
+        {'symbol': symbol, 'price': '1.0'} for symbol in symbols
+    ]
+
+    client.ingest_batch()
+
+    client.client.ticker_price.assert_called_once_with(symbols=['BTCUSDT', 'BNBUSDT'])
+
+def test_ingest_batch_falls_back_to_per_symbol(sample_client):
+    """
+    Test that a failed chunk request is retried one symbol at a time.
+    """
+    client = sample_client
+
+    def ticker_price(symbol=None, symbols=None):
+        if symbols is not None:
+            raise Exception("Invalid symbol.")
+        return {'symbol': symbol, 'price': '1.0'}
+
+    client.client.ticker_price.side_effect = ticker_price
+
+    client.ingest_batch()
+
+    inserted = [c.args[0] for c in client.raw_data_sink.insert_raw_data.call_args_list]
+    assert inserted == ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']
+
+def test_ingest_batch_polls_only_due_symbols(sample_client):
+    """
+    Test that with adaptive sampling only the symbols picked by the sampler are requested and their prices observed.
+    """
+    client = sample_client
+    client.sampler = MagicMock()
+    client.sampler.due_symbols.return_value = ['ETHUSDT']
+    client.client.ticker_price.side_effect = lambda symbols: [
+        {'symbol': symbol, 'price': '2.5'} for symbol in symbols
+    ]
+
+    client.ingest_batch()
+
+    client.client.ticker_price.assert_called_once_with(symbols=['ETHUSDT'])
+    client.sampler.observe.assert_called_once_with('ETHUSDT', 2.5)
+    client.sampler.record_weight.assert_called_once_with(4)
@@ -0,0 +1,111 @@
+# tests/test_binance_websocket_ingestion.py
+
+import json
+import os
+import time
+import pytest
+from unittest.mock import MagicMock
+from ingestion.binance_websocket_ingestion import BinanceWebSocketIngestionClient
+from tests.ws_replay_server import ReplayWebSocketServer
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'binance_combined_stream.jsonl')
+SUBSCRIBE_ACK = json.dumps({'result': None, 'id': 1})
+
+@pytest.fixture
+def recorded_frames():
+    """
+    Fixture with recorded miniTicker frames for BTCUSDT and ETHUSDT; ETHUSDT misses one update.
+    """
+    with open(FIXTURE_PATH) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _make_client(url):
+    config = {
+        'symbols': ['BTCUSDT', 'ETHUSDT'],
+        'data_points': 100,
+        'websocket': {'url': url, 'reconnect_delay': 0.05, 'ping_interval': 0, 'ping_timeout': 0.5}
+    }
+    state_manager = MagicMock()
+    state_manager.get_collected_points.return_value = 0
+    state_manager.update_collected_points.return_value = 1
+    return BinanceWebSocketIngestionClient(config, raw_data_sink=MagicMock(), state_manager=state_manager)
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+def test_replayed_stream_reaches_raw_data_sink(recorded_frames):
+    """
+    Test that every recorded frame becomes one raw row stamped with its exchange event time.
+    """
+    with ReplayWebSocketServer([[SUBSCRIBE_ACK] + recorded_frames]) as server:
+        client = _make_client(server.url)
+        client.start()
+        _wait_for(lambda: client.raw_data_sink.insert_raw_data.call_count == len(recorded_frames))
+        client.stop()
+
+    calls = client.raw_data_sink.insert_raw_data.call_args_list
+    first = json.loads(recorded_frames[0])['data']
+    assert calls[0].args[0] == first['s']
+    assert calls[0].args[1] == {'symbol': first['s'], 'price': first['c']}
+    assert calls[0].args[2].timestamp() * 1000 == first['E']
+
+    subscribe = json.loads(server.received[0])
+    assert subscribe['method'] == 'SUBSCRIBE'
+    assert subscribe['params'] == ['btcusdt@miniTicker', 'ethusdt@miniTicker']
+
+    gap_stats = client.get_gap_stats()
+    assert gap_stats['ETHUSDT']['missed_updates'] == 1
+    assert gap_stats['BTCUSDT']['missed_updates'] == 0
+
+def test_reconnect_resubscribes_and_counts_disconnect(recorded_frames):
+    """
+    Test that a dropped connection is reopened, resubscribed and accounted as a gap.
+    """
+    sessions = [[SUBSCRIBE_ACK] + recorded_frames[:4], [SUBSCRIBE_ACK] + recorded_frames[4:]]
+    with ReplayWebSocketServer(sessions) as server:
+        client = _make_client(server.url)
+        client.start()
+        _wait_for(lambda: client.raw_data_sink.insert_raw_data.call_count == len(recorded_frames))
+        client.stop()
+
+    assert server.connections == 2
+    assert len(server.received) == 2
+    assert json.loads(server.received[0])['params'] == json.loads(server.received[1])['params']
+
+    gap_stats = client.get_gap_stats()
+    for symbol in ['BTCUSDT', 'ETHUSDT']:
+        assert gap_stats[symbol]['reconnects'] == 1
+        assert gap_stats[symbol]['disconnected_seconds'] > 0
+
+def test_trade_stream_counts_missed_trades():
+    """
+    Test that skipped trade ids are counted as missed trades.
+    """
+    client = _make_client('ws://unused')
+    client.stream_type = 'trade'
+    for trade_id in [10, 11, 15]:
+        client.ingest_data({'e': 'trade', 'E': 1728723600000, 'T': 1728723600000 + trade_id,
+                            's': 'BTCUSDT', 't': trade_id, 'p': '62500.00', 'q': '0.1'})
+
+    assert client.get_gap_stats()['BTCUSDT']['missed_trades'] == 3
+    assert client.raw_data_sink.insert_raw_data.call_count == 3
+
+def test_trades_of_one_millisecond_are_collapsed():
+    """
+    Test that only the first trade of every millisecond reaches the sink, since they share a raw_data key.
+    """
+    client = _make_client('ws://unused')
+    client.stream_type = 'trade'
+    for trade_id, trade_time, price in [(1, 1728723600000, '62500.00'), (2, 1728723600000, '62501.00'),
+                                        (3, 1728723600000, '62502.00'), (4, 1728723600001, '62503.00')]:
+        client.ingest_data({'e': 'trade', 'E': trade_time, 'T': trade_time,
+                            's': 'BTCUSDT', 't': trade_id, 'p': price, 'q': '0.1'})
+
+    prices = [c.args[1]['price'] for c in client.raw_data_sink.insert_raw_data.call_args_list]
+    assert prices == ['62500.00', '62503.00']
+    assert client.state_manager.update_collected_points.call_count == 2
+    assert client.get_gap_stats()['BTCUSDT']['collapsed_trades'] == 2
@@ -0,0 +1,157 @@
+# tests/test_cluster.py
+
+from collections import Counter
+from unittest.mock import patch
+
+import pytest
+from orchestrator.cluster import ClusterMembership, HashRing, shard_of
+
+SYMBOLS = [f'SYM{i:04d}USDT' for i in range(500)]
+
+class FakeClusterRepository:
+    """
+    In-memory cluster_node and shard_lease tables with a manual clock, shared by several nodes.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.heartbeats = {}
+        self.leases = {}
+
+    def heartbeat(self, node_id):
+        self.heartbeats[node_id] = self.now
+
+    def live_nodes(self, ttl_seconds):
+        return sorted(node for node, heartbeat in self.heartbeats.items() if heartbeat > self.now - ttl_seconds)
+
+    def claim_shards(self, node_id, shards, ttl_seconds):
+        claimed = []
+        for shard in shards:
+            lease = self.leases.get(shard)
+            if lease is None or lease[0] == node_id or lease[1] < self.now:
+                self.leases[shard] = (node_id, self.now + ttl_seconds)
+                claimed.append(shard)
+        return claimed
+
+    def release_shards(self, node_id, shards):
+        for shard in shards:
+            if self.leases.get(shard, (None,))[0] == node_id:
+                del self.leases[shard]
+
+    def leave(self, node_id):
+        self.heartbeats.pop(node_id, None)
+        self.leases = {shard: lease for shard, lease in self.leases.items() if lease[0] != node_id}
+
+def _node(repository, node_id):
+    config = {'symbols': SYMBOLS, 'cluster': {'node_id': node_id, 'shards': 64, 'lease_ttl': 30}}
+    return ClusterMembership(config, repository=repository)
+
+def _sync_all(nodes):
+    owned = {node.node_id: node.sync() for node in nodes}
+    symbols = [symbol for node_symbols in owned.values() for symbol in node_symbols]
+    # A symbol is never ingested by two nodes
+    assert len(symbols) == len(set(symbols))
+    for node in nodes:
+        node.release()
+    return owned
+
+def test_hash_ring_moves_few_keys_when_a_node_joins():
+    """
+    Test that keys spread over all nodes and that a joining node only takes keys, about 1/N of them.
+    """
+    keys = [f'shard-{i}' for i in range(1000)]
+    before = HashRing(['a', 'b', 'c'])
+    after = HashRing(['a', 'b', 'c', 'd'])
+
+    counts = Counter(before.node_for(key) for key in keys)
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+
+    assert min(counts.values()) > 200
+    assert all(after.node_for(key) == 'd' for key in moved)
+    assert 150 < len(moved) < 350
+
+def test_nodes_split_the_shards_and_rebalance_on_join():
+    """
+    Test that live nodes end up owning disjoint shards covering every symbol, also after a node joins.
+    """
+    repository = FakeClusterRepository()
+    nodes = [_node(repository, 'node-a'), _node(repository, 'node-b')]
+    _sync_all(nodes)  # node-a claims every shard before node-b is live
+    _sync_all(nodes)  # node-a hands over
+    owned = _sync_all(nodes)
+    assert sorted(owned['node-a'] + owned['node-b']) == sorted(SYMBOLS)
+    assert owned['node-a'] and owned['node-b']
+
+    nodes.append(_node(repository, 'node-c'))
+    _sync_all(nodes)  # node-c is not in the ring of the others yet
+    _sync_all(nodes)  # the others hand over
+    owned = _sync_all(nodes)  # node-c claims the released shards
+
+    assert sorted(sum(owned.values(), [])) == sorted(SYMBOLS)
+    assert all(owned.values())
+
+def test_shards_are_released_only_when_asked():
+    """
+    Test that shards given up by a sync stay leased, so the new owner waits, until they are released.
+    """
+    repository = FakeClusterRepository()
+    a = _node(repository, 'node-a')
+    _sync_all([a])
+    b = _node(repository, 'node-b')
+    _sync_all([b])
+
+    a_symbols = a.sync()
+    assert a.releasing and len(a_symbols) < len(SYMBOLS)
+    assert b.sync() == []
+
+    a.release()
+    assert sorted(a_symbols + b.sync()) == sorted(SYMBOLS)
+
+def test_shards_move_when_a_node_leaves_or_dies():
+    """
+    Test that a node leaving hands its shards over at once and a crashed node's shards move after the lease TTL.
+    """
+    repository = FakeClusterRepository()
+    a, b, c = _node(repository, 'node-a'), _node(repository, 'node-b'), _node(repository, 'node-c')
+    for _ in range(3):
+        _sync_all([a, b, c])
+
+    c.leave()
+    owned = _sync_all([a, b])
+    assert sorted(owned['node-a'] + owned['node-b']) == sorted(SYMBOLS)
+
+    # node-b stops heartbeating without releasing its leases
+    b_symbols = set(owned['node-b'])
+    repository.now += 10
+    assert set(a.sync()).isdisjoint(b_symbols)
+    repository.now += 31
+    assert sorted(a.sync()) == sorted(SYMBOLS)
+
+def test_node_gives_shards_up_before_its_leases_expire():
+    """
+    Test that a node whose syncs fail stops owning its shards before another node can claim them.
+    """
+    repository = FakeClusterRepository()
+    a = _node(repository, 'node-a')
+    with patch('orchestrator.cluster.time.monotonic', return_value=100):
+        _sync_all([a])
+
+    with patch.object(repository, 'heartbeat', side_effect=RuntimeError("database unavailable")):
+        with patch('orchestrator.cluster.time.monotonic', return_value=110):
+            with pytest.raises(RuntimeError):
+                a.sync()
+            assert not a.fence_if_expiring()
+        assert len(a.owned_symbols()) == len(SYMBOLS)
+
+        # The next sync would come after the 30 second leases expired
+        with patch('orchestrator.cluster.time.monotonic', return_value=120):
+            assert a.fence_if_expiring()
+        assert a.owned_symbols() == []
+
+    assert len(a.sync()) == len(SYMBOLS)
+
+def test_shard_of_is_stable():
+    """
+    Test that the shard of a symbol does not depend on the process.
+    """
+    assert shard_of('BTCUSDT', 256) == shard_of('BTCUSDT', 256)
+    assert len({shard_of(symbol, 64) for symbol in SYMBOLS}) == 64
@@ -0,0 +1,114 @@
+# tests/test_compacted_raw_data.py
+
+from datetime import timedelta
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from database.compacted_raw_data_repository import CompactedRawDataRepository, run_split_minutes
+from database.database import Database
+from database.raw_data_repository import RawDataRepository
+from transformation.transformer import DataTransformer
+
+START = pd.Timestamp('2024-01-01', tz='UTC').to_pydatetime()
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    """
+    Fixture that points Database at an embedded SQLite file for the duration of a test.
+    """
+    engine, session_local = Database._engine, Database._SessionLocal
+    Database.initialize({'backend': 'sqlite', 'path': str(tmp_path / 'binance.sqlite')})
+    yield Database.get_engine()
+    Database._engine.dispose()
+    Database._engine, Database._SessionLocal = engine, session_local
+
+def _ticks(minutes=30):
+    """
+    One price per second and symbol that stays flat for a few seconds at a time.
+    """
+    rng = np.random.default_rng(0)
+    return [
+        (symbol, {'price': str(100 + int(price))}, START + timedelta(seconds=i))
+        for symbol in SYMBOLS
+        for i, price in enumerate(np.cumsum(rng.choice([0, 0, 0, 1, -1], minutes * 60)))
+    ]
+
+def _downsample(repository):
+    transformer = DataTransformer({'downsampling_frequency': 5, 'symbols': SYMBOLS},
+                                  raw_data_repo=repository, downsampled_repo=object(), watermark_repo=object())
+    return transformer._downsample_all(repository.fetch_unprocessed_data_all(SYMBOLS))
+
+def test_runs_downsample_like_raw_data(sqlite_database):
+    """
+    Test that batched writes are folded into runs and read back as the original data points.
+    """
+    rows = sorted(_ticks(), key=lambda row: row[2])
+    raw_data_repo = RawDataRepository()
+    compacted_repo = CompactedRawDataRepository(split_minutes=5)
+    for start in range(0, len(rows), 250):
+        raw_data_repo.insert_raw_data_bulk(rows[start:start + 250])
+        compacted_repo.insert_raw_data_bulk(rows[start:start + 250])
+
+    with sqlite_database.connect() as connection:
+        runs = connection.exec_driver_sql('SELECT COUNT(*), SUM(count) FROM raw_data_run').fetchone()
+    assert runs[0] < len(rows) / 2
+    assert runs[1] == len(rows)
+
+    pd.testing.assert_frame_equal(_downsample(raw_data_repo), _downsample(compacted_repo))
+    df = compacted_repo.fetch_unprocessed_data('BTCUSDT', START + timedelta(minutes=10), START + timedelta(minutes=20))
+    assert len(df) == 600
+    assert list(df.columns) == ['timestamp', 'price', 'symbol']
+
+def test_runs_end_at_window_boundaries_and_late_points(sqlite_database):
+    """
+    Test that runs never cross a split boundary and that older points become runs of their own.
+    """
+    repository = CompactedRawDataRepository(split_minutes=1)
+    repository.insert_raw_data_bulk([
+        ('BTCUSDT', {'price': '100'}, START + timedelta(seconds=i)) for i in range(90)
+    ])
+    repository.insert_raw_data_bulk([
+        ('BTCUSDT', {'price': '100'}, START + timedelta(seconds=i)) for i in range(90, 100)
+    ])
+    # Older than the open run, stored on its own
+    repository.insert_raw_data_bulk([('BTCUSDT', {'price': '50'}, START - timedelta(seconds=1))])
+
+    with sqlite_database.connect() as connection:
+        counts = [row[0] for row in connection.exec_driver_sql(
+            'SELECT count FROM raw_data_run ORDER BY timestamp').fetchall()]
+    assert counts == [1, 60, 40]
+
+    # A run is only deleted once all of its points are older than the cutoff
+    assert repository.delete_raw_data_before('BTCUSDT', START + timedelta(seconds=30), 100) == 1
+    assert repository.delete_raw_data_before('BTCUSDT', START + timedelta(seconds=60), 100) == 1
+    assert len(repository.fetch_unprocessed_data('BTCUSDT')) == 40
+
+def test_failed_batch_is_retried_without_duplicates(sqlite_database):
+    """
+    Test that a batch whose upsert failed is stored once when it is written again.
+    """
+    repository = CompactedRawDataRepository(split_minutes=1)
+    rows = [('BTCUSDT', {'price': '100'}, START + timedelta(seconds=i)) for i in range(7)]
+    repository.insert_raw_data_bulk(rows[:3])
+
+    with patch.object(repository, '_upsert', side_effect=Exception("connection lost")):
+        with pytest.raises(Exception):
+            repository.insert_raw_data_bulk(rows[3:6])
+    repository.insert_raw_data_bulk(rows[3:6])
+    repository.insert_raw_data_bulk(rows[6:])
+
+    with sqlite_database.connect() as connection:
+        counts = [row[0] for row in connection.exec_driver_sql('SELECT count FROM raw_data_run').fetchall()]
+    assert counts == [7]
+    assert len(repository.fetch_unprocessed_data('BTCUSDT')) == 7
+
+def test_split_minutes_align_with_windows_and_rollups():
+    """
+    Test that runs are split at a common divisor of the windows and the base rollup buckets.
+    """
+    assert run_split_minutes({'downsampling_frequency': 15}) == 15
+    assert run_split_minutes({'downsampling_frequency': 7}) == 1
+    assert run_split_minutes({'downsampling_frequency': 10, 'rollups': {'enabled': True, 'resolutions': [4, 60]}}) == 2
@@ -0,0 +1,174 @@
+# tests/test_gap_detector.py
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from database.database import Database
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.raw_data_repository import RawDataRepository
+from transformation.transformer import DataTransformer
+from utils.gap_detector import GapDetector, find_gaps
+
+START = pd.Timestamp('2024-01-01', tz='UTC').to_pydatetime()
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    """
+    Fixture that points Database at an embedded SQLite file for the duration of a test.
+    """
+    engine, session_local = Database._engine, Database._SessionLocal
+    Database.initialize({'backend': 'sqlite', 'path': str(tmp_path / 'binance.sqlite')})
+    yield Database.get_engine()
+    Database._engine.dispose()
+    Database._engine, Database._SessionLocal = engine, session_local
+
+class FakeBackfillEngine:
+    """
+    Stands in for BackfillEngine, writes one point per second of the requested range.
+    """
+    def __init__(self, raw_data_repo, fail=False):
+        self.raw_data_repo = raw_data_repo
+        self.fail = fail
+        self.calls = []
+        self.stats = {'rows': 0, 'requests': 0, 'segments': 0, 'failed_segments': 0}
+
+    def run(self, symbols, start, end):
+        self.calls.append((symbols, start, end))
+        if self.fail:
+            self.stats['failed_segments'] += 1
+            return dict(self.stats)
+        points = pd.date_range(pd.Timestamp(start).ceil('s'), pd.Timestamp(end), freq='1s', inclusive='left')
+        self.raw_data_repo.insert_raw_data_bulk([
+            (symbol, {'price': '100'}, timestamp.to_pydatetime()) for symbol in symbols for timestamp in points
+        ])
+        self.stats['rows'] += len(points) * len(symbols)
+        return dict(self.stats)
+
+def test_find_gaps_masks_symbol_boundaries():
+    """
+    Test that only pauses within one symbol are gaps, also next to symbols without rows.
+    """
+    seconds = lambda values: np.array(values, dtype=np.int64) * 1000000
+    symbols = ['A', 'B', 'C', 'D']
+    # B starts long after A ends and D long after C, which has no rows at all
+    firsts = [seconds([0, 1, 2, 10, 11]), seconds([100, 101]), seconds([]), seconds([500, 501, 520])]
+    gaps = find_gaps(symbols, firsts, firsts, 3 * 1000000)
+    assert [(gap['symbol'], gap['gap_start'].timestamp(), gap['gap_end'].timestamp()) for gap in gaps] == [
+        ('A', 2.0, 10.0), ('D', 501.0, 520.0)
+    ]
+    assert find_gaps(symbols, [seconds([])] * 4, [seconds([])] * 4, 1) == []
+
+def test_scan_records_and_refills_gaps(sqlite_database):
+    """
+    Test that a scan stores the pauses of every symbol and that a refill fills and closes them.
+    """
+    config = {'symbols': SYMBOLS, 'sampling_frequency': 1,
+              'gap_detection': {'max_gap_factor': 3, 'lookback_hours': 1, 'grace_seconds': 0}}
+    raw_data_repo = RawDataRepository()
+    missing = {'BTCUSDT': range(100, 160), 'ETHUSDT': range(300, 302)}
+    raw_data_repo.insert_raw_data_bulk([
+        (symbol, {'price': '100'}, START + timedelta(seconds=i))
+        for symbol in SYMBOLS for i in range(600) if i not in missing[symbol]
+    ])
+    backfill_engine = FakeBackfillEngine(raw_data_repo)
+    detector = GapDetector(config, raw_data_repo=raw_data_repo, backfill_engine=backfill_engine)
+
+    report = detector.run(now=START + timedelta(minutes=10))
+    # ETHUSDT misses two points, which is within the threshold
+    assert report['rows_scanned'] == 1138
+    assert report['gaps_found'] == 1
+    assert report['gaps_refilled'] == 1 and report['refill_rows'] == 60
+    gaps = detector.gap_repo.get_gaps()
+    assert gaps[['symbol', 'status', 'refill_attempts', 'refilled_rows']].values.tolist() == [
+        ['BTCUSDT', 'filled', 1, 60]
+    ]
+    assert gaps['gap_start'].iloc[0] == pd.Timestamp(START + timedelta(seconds=99))
+    assert gaps['gap_end'].iloc[0] == pd.Timestamp(START + timedelta(seconds=160))
+
+    # The next scan starts at the last point seen, so the pause across both scans is found
+    raw_data_repo.insert_raw_data_bulk([('BTCUSDT', {'price': '100'}, START + timedelta(seconds=660))])
+    detector.refill_enabled = False
+    assert detector.run(now=START + timedelta(minutes=12))['gaps_found'] == 1
+    assert len(detector.gap_repo.get_gaps(status='open')) == 1
+
+    # A gap that keeps failing is given up after max_attempts refills
+    detector.backfill_engine = FakeBackfillEngine(raw_data_repo, fail=True)
+    detector.max_attempts = 2
+    for _ in range(3):
+        detector.refill()
+    assert len(detector.backfill_engine.calls) == 2
+    assert detector.gap_repo.get_gaps(status='failed')['refill_attempts'].tolist() == [2]
+
+def test_refilled_gap_inside_a_window_reaggregates_the_whole_window(sqlite_database):
+    """
+    Test that refilling a gap that starts in the middle of a window downsamples that window from all of its rows.
+    """
+    config = {
+        'symbols': ['BTCUSDT'], 'sampling_frequency': 60, 'downsampling_frequency': 5, 'transform_grace_seconds': 0,
+        'api_rate_limit': 1000, 'backfill': {'kline_interval': '1m', 'workers': 1},
+        'gap_detection': {'max_gap_factor': 3, 'lookback_hours': 1, 'grace_seconds': 0, 'refill_source': 'klines'}
+    }
+    raw_data_repo = RawDataRepository()
+    # One point per minute from 09:00 to 09:29, 09:12 to 09:17 are missing
+    raw_data_repo.insert_raw_data_bulk([
+        ('BTCUSDT', {'price': str(100 + minute)}, START + timedelta(hours=9, minutes=minute))
+        for minute in range(30) if not 12 <= minute <= 17
+    ])
+    transformer = DataTransformer(config)
+    transformer.transform_data(now=START + timedelta(hours=9, minutes=30))
+
+    detector = GapDetector(config, raw_data_repo=raw_data_repo)
+
+    def fetch_klines(client, symbol, cursor, range_end):
+        # Minute klines of the range, with the price the missing points would have had
+        open_times = range(-(-cursor // 60000) * 60000, range_end, 60000)
+        return [[open_time, None, None, None, str(100 + open_time // 60000 % 60)] for open_time in open_times], range_end
+
+    detector.backfill_engine._fetch_klines = fetch_klines
+    report = detector.run(now=START + timedelta(hours=9, minutes=30))
+    assert report['gaps_found'] == 1 and report['refill_rows'] == 6
+    transformer.transform_data(now=START + timedelta(hours=9, minutes=30))
+
+    raw = raw_data_repo.fetch_unprocessed_data('BTCUSDT').set_index('timestamp')['price'].astype(float)
+    assert len(raw) == 30
+    expected = raw.resample('5min').agg(['mean', 'median'])
+    stored = DownsampledDataRepository().fetch_downsampled_data('BTCUSDT').set_index('timestamp')
+    np.testing.assert_allclose(stored['avg_price'], expected['mean'])
+    np.testing.assert_allclose(stored['median_price'], expected['median'])
+
+def test_refilled_trades_are_sampled_like_polled_points(sqlite_database):
+    """
+    Test that a gap refilled from aggTrades gets one point per sampling interval, so the window mean is not biased.
+    """
+    config = {
+        'symbols': ['BTCUSDT'], 'sampling_frequency': 60, 'downsampling_frequency': 5, 'transform_grace_seconds': 0,
+        'api_rate_limit': 1000, 'backfill': {'workers': 1},
+        'gap_detection': {'max_gap_factor': 3, 'lookback_hours': 1, 'grace_seconds': 0, 'refill_source': 'aggTrades'}
+    }
+    raw_data_repo = RawDataRepository()
+    # One point per minute from 09:00 to 09:29, 09:12 to 09:17 are missing
+    raw_data_repo.insert_raw_data_bulk([
+        ('BTCUSDT', {'price': str(100 + minute)}, START + timedelta(hours=9, minutes=minute))
+        for minute in range(30) if not 12 <= minute <= 17
+    ])
+    detector = GapDetector(config, raw_data_repo=raw_data_repo)
+
+    def fetch_agg_trades(client, symbol, cursor, range_end):
+        # A trade every 100ms at 1000, except the one on each full minute, in pages of 1000 trades
+        times = range(-(-cursor // 100) * 100, range_end, 100)
+        trades = [{'p': str(100 + t // 60000 % 60) if t % 60000 == 0 else '1000', 'T': t} for t in times][:1000]
+        return trades, trades[-1]['T'] + 1 if len(trades) == 1000 else range_end
+
+    detector.backfill_engine._fetch_agg_trades = fetch_agg_trades
+    report = detector.run(now=START + timedelta(hours=9, minutes=30))
+    assert report['refill_rows'] == 6
+    DataTransformer(config).transform_data(now=START + timedelta(hours=9, minutes=30))
+
+    raw = raw_data_repo.fetch_unprocessed_data('BTCUSDT')
+    assert raw['timestamp'].dt.second.eq(0).all()
+    stored = DownsampledDataRepository().fetch_downsampled_data('BTCUSDT').set_index('timestamp')['avg_price']
+    assert stored[pd.Timestamp(START + timedelta(hours=9, minutes=10))] == 112
+    assert stored[pd.Timestamp(START + timedelta(hours=9, minutes=15))] == 117
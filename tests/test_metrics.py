@@ -0,0 +1,84 @@
+# tests/test_metrics.py
+
+import urllib.request
+
+import pytest
+from utils.metrics import REGISTRY, Counter, Histogram, configure_metrics, timed_method
+
+@pytest.fixture
+def registry():
+    """
+    Fixture that enables the global registry for one test.
+    """
+    REGISTRY.enabled = True
+    yield REGISTRY
+    REGISTRY.enabled = False
+
+def test_counters_and_histograms_render_as_prometheus_text(registry):
+    """
+    Test the text exposition of a labelled counter and a histogram.
+    """
+    responses = Counter('test_responses', 'Responses.', ['status'])
+    latency = Histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    responses.labels('200').inc()
+    responses.labels('200').inc(2)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    lines = responses.render() + latency.render()
+
+    assert '# TYPE test_responses_total counter' in lines
+    assert 'test_responses_total{status="200"} 3.0' in lines
+    assert '# TYPE test_latency_seconds histogram' in lines
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count 3' in lines
+    assert 'test_latency_seconds_sum 5.55' in lines
+
+def test_disabled_metrics_record_nothing():
+    """
+    Test that nothing is recorded while the registry is disabled.
+    """
+    calls = Counter('test_disabled_calls', 'Calls.')
+    latency = Histogram('test_disabled_seconds', 'Latency.')
+
+    calls.inc()
+    with latency.time():
+        pass
+
+    assert calls.labels().value == 0
+    assert latency.labels().counts == [0] * (len(latency.buckets) + 1)
+
+def test_timed_method_labels_class_and_method(registry):
+    """
+    Test that the repository decorator observes one duration per call, labelled with class and method.
+    """
+    durations = Histogram('test_method_seconds', 'Durations.', ['repository', 'method'])
+
+    class FakeRepository:
+        @timed_method(durations)
+        def fetch(self, value):
+            return value * 2
+
+    assert FakeRepository().fetch(21) == 42
+    assert sum(durations.labels('FakeRepository', 'fetch').counts) == 1
+
+def test_metrics_endpoint_serves_the_registry():
+    """
+    Test that the configured HTTP endpoint serves the metrics of the process.
+    """
+    server = configure_metrics({'metrics': {'enabled': True, 'port': 0, 'host': '127.0.0.1'}})
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+            body = response.read().decode()
+            content_type = response.headers['Content-Type']
+    finally:
+        server.shutdown()
+        server.server_close()
+        REGISTRY.enabled = False
+
+    assert content_type.startswith('text/plain')
+    assert '# TYPE db_round_trip_seconds histogram' in body
+    assert '# TYPE rows_written_total counter' in body
@@ -0,0 +1,124 @@
+# tests/test_parquet_archive.py
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from unittest.mock import MagicMock
+from archive.parquet_archive import ArchiveReader, ParquetArchiver, partition_path
+
+class FakeArchiveSource:
+    """
+    Serves raw rows from a DataFrame through the ArchiveSourceRepository methods.
+    """
+    def __init__(self, df):
+        self.df = df
+
+    def first_timestamp(self, table, symbol):
+        timestamps = self.df.loc[self.df['symbol'] == symbol, 'timestamp']
+        return timestamps.min() if len(timestamps) else None
+
+    def iter_rows(self, table, symbol, start, end, chunksize):
+        df = self.df
+        rows = df[(df['symbol'] == symbol) & (df['timestamp'] >= start) & (df['timestamp'] < end)]
+        for offset in range(0, len(rows), chunksize):
+            yield rows.iloc[offset:offset + chunksize][['timestamp', 'price']].reset_index(drop=True)
+
+@pytest.fixture
+def raw_df():
+    """
+    Fixture for three days of ticks every 10 seconds for two symbols.
+    """
+    timestamps = pd.date_range('2024-10-10', periods=3 * 8640, freq='10s', tz='UTC')
+    rng = np.random.default_rng(5)
+    return pd.concat([
+        pd.DataFrame({'symbol': symbol, 'timestamp': timestamps, 'price': 100 + rng.normal(size=len(timestamps)).cumsum()})
+        for symbol in ['BTCUSDT', 'ETHUSDT']
+    ], ignore_index=True)
+
+@pytest.fixture
+def archiver(raw_df, tmp_path):
+    """
+    Fixture for a raw_data archiver whose transform watermark is 2024-10-12 06:00 for every symbol.
+    """
+    config = {
+        'symbols': ['BTCUSDT', 'ETHUSDT'],
+        'archive': {'path': str(tmp_path), 'tables': ['raw_data'], 'row_group_size': 1000}
+    }
+    archived = {}
+    watermark_repo = MagicMock()
+    transform_watermark = pd.Timestamp('2024-10-12 06:00', tz='UTC').to_pydatetime()
+
+    def get_watermarks(symbols, stage='downsampled_data'):
+        if stage == 'downsampled_data':
+            return {symbol: transform_watermark for symbol in symbols}
+        return {symbol: archived[symbol] for symbol in symbols if symbol in archived}
+
+    watermark_repo.get_watermarks.side_effect = get_watermarks
+    watermark_repo.set_watermarks.side_effect = lambda watermarks, stage: archived.update(watermarks)
+    return ParquetArchiver(config, source=FakeArchiveSource(raw_df), watermark_repo=watermark_repo)
+
+def test_archives_only_closed_days(archiver, tmp_path):
+    """
+    Test that the days before the transform watermark are written in row groups and recorded as archived.
+    """
+    report = archiver.archive()
+
+    assert report['files'] == 4
+    assert report['rows'] == 4 * 8640
+    path = partition_path(str(tmp_path), 'raw_data', 'BTCUSDT', pd.Timestamp('2024-10-10'))
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_rows == 8640
+    assert metadata.num_row_groups == 9
+    assert not (tmp_path / 'raw_data' / 'symbol=BTCUSDT' / 'date=2024-10-12').exists()
+    archiver.watermark_repo.set_watermarks.assert_called_with(
+        {'ETHUSDT': pd.Timestamp('2024-10-12', tz='UTC').to_pydatetime()}, stage='archive_raw_data'
+    )
+
+def test_rerun_does_not_archive_again(archiver):
+    """
+    Test that archived days are skipped by the next run.
+    """
+    archiver.archive()
+    assert archiver.archive()['files'] == 0
+
+def test_reader_returns_archived_rows(archiver, raw_df, tmp_path):
+    """
+    Test that the reader returns exactly the archived rows of the requested symbols and range.
+    """
+    archiver.archive()
+    reader = ArchiveReader(str(tmp_path))
+
+    df = reader.read('raw_data', ['ETHUSDT'], '2024-10-10 22:00', '2024-10-11 02:00')
+
+    start, end = pd.Timestamp('2024-10-10 22:00', tz='UTC'), pd.Timestamp('2024-10-11 02:00', tz='UTC')
+    expected = raw_df[(raw_df['symbol'] == 'ETHUSDT') & (raw_df['timestamp'] >= start) & (raw_df['timestamp'] < end)]
+    pd.testing.assert_frame_equal(df, expected.reset_index(drop=True), check_dtype=False)
+
+    arrays = reader.read('raw_data', 'BTCUSDT', '2024-10-10', '2024-10-11', as_arrays=True)
+    assert arrays['BTCUSDT']['timestamp'].dtype == np.int64
+    assert len(arrays['BTCUSDT']['price']) == 8640
+
+def test_rearchived_day_keeps_deleted_rows(archiver, raw_df, tmp_path):
+    """
+    Test that archiving a day again after a backfill adds the new rows and keeps those retention deleted.
+    """
+    archiver.archive()
+    day = pd.Timestamp('2024-10-10', tz='UTC')
+    # Retention deleted the first half of the day, a backfill corrected one row and added one
+    btc = raw_df[(raw_df['symbol'] == 'BTCUSDT') & (raw_df['timestamp'] >= day + pd.Timedelta(hours=12))]
+    backfilled = pd.DataFrame({'symbol': 'BTCUSDT', 'price': [1.0, 2.0],
+                               'timestamp': [day + pd.Timedelta(hours=13), day + pd.Timedelta(seconds=5)]})
+    btc = pd.concat([btc[btc['timestamp'] != day + pd.Timedelta(hours=13)], backfilled], ignore_index=True)
+    archiver.source = FakeArchiveSource(btc.sort_values('timestamp', ignore_index=True))
+    archiver.watermark_repo.set_watermarks({'BTCUSDT': day.to_pydatetime()}, stage='archive_raw_data')
+
+    assert archiver.archive()['files'] == 2
+
+    df = ArchiveReader(str(tmp_path)).read('raw_data', ['BTCUSDT'], day, day + pd.Timedelta(days=1))
+    assert len(df) == 8641
+    assert df['timestamp'].is_monotonic_increasing
+    prices = df.set_index('timestamp')['price']
+    assert prices[day + pd.Timedelta(seconds=5)] == 2.0
+    assert prices[day + pd.Timedelta(hours=13)] == 1.0
+    assert prices[day] == raw_df.loc[(raw_df['symbol'] == 'BTCUSDT') & (raw_df['timestamp'] == day), 'price'].iloc[0]
@@ -0,0 +1,99 @@
+# tests/test_rate_limiter.py
+
+import threading
+import time
+
+import pytest
+from utils.rate_limiter import RateWindow, WeightedRateLimiter, request_weight
+
+HOUR = 3600
+
+def _until_next(interval):
+    return interval - time.time() % interval
+
+def test_weights_are_booked_per_window():
+    """
+    Test that a request that does not fit the current window is delayed to the next one.
+    """
+    limiter = WeightedRateLimiter([RateWindow('weight', 10, HOUR)])
+
+    assert limiter.reserve(4) == 0
+    assert limiter.reserve(4) == 0
+    assert limiter.reserve(4) == pytest.approx(_until_next(HOUR), abs=1)
+    with pytest.raises(ValueError):
+        limiter.reserve(11)
+
+def test_resyncs_from_used_weight_header():
+    """
+    Test that weight used by other clients, as reported by the server, is taken into account.
+    """
+    limiter = WeightedRateLimiter([RateWindow('requests', 100, 1), RateWindow('weight', 6000, 60)])
+
+    limiter.record_response(200, {'X-MBX-USED-WEIGHT-1M': '5990', 'Content-Type': 'application/json'})
+
+    assert limiter.reserve(4) == 0
+    assert limiter.reserve(20) == pytest.approx(_until_next(60), abs=0.5)
+
+def test_backs_off_on_429_and_418():
+    """
+    Test that Retry-After is honoured and that the backoff doubles without it.
+    """
+    limiter = WeightedRateLimiter([RateWindow('weight', 6000, 60)], backoff=0.5)
+
+    limiter.record_response(429, {'Retry-After': '2'})
+    assert limiter.reserve() == pytest.approx(2, abs=0.1)
+
+    limiter = WeightedRateLimiter([RateWindow('weight', 6000, 60)], backoff=0.5)
+    limiter.record_response(418)
+    first = limiter.reserve()
+    limiter.record_response(418)
+    second = limiter.reserve()
+    assert first == pytest.approx(0.5, abs=0.1)
+    assert second == pytest.approx(1.0, abs=0.1)
+    assert limiter.stats['backoffs'] == 2
+
+def test_waiters_do_not_hold_the_lock():
+    """
+    Test that a caller waiting for its permit does not block others from booking theirs, and that permits stay in order.
+    """
+    limiter = WeightedRateLimiter([RateWindow('weight', 6000, 60)])
+    limiter.record_response(429, {'Retry-After': '0.5'})
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    time.sleep(0.05)
+
+    start = time.perf_counter()
+    delay = limiter.reserve()
+    elapsed = time.perf_counter() - start
+    waiter.join()
+
+    assert elapsed < 0.05
+    assert delay == pytest.approx(0.45, abs=0.1)
+    assert limiter.stats['waited_seconds'] == pytest.approx(0.5, abs=0.1)
+
+def test_shared_memory_budget(tmp_path):
+    """
+    Test that limiters opening the same shared memory file share one budget and one backoff.
+    """
+    path = str(tmp_path / 'rate_limit')
+    first = WeightedRateLimiter([RateWindow('weight', 10, HOUR)], shared_memory=path)
+    second = WeightedRateLimiter([RateWindow('weight', 10, HOUR)], shared_memory=path)
+
+    assert first.reserve(6) == 0
+    assert second.reserve(6) == pytest.approx(_until_next(HOUR), abs=1)
+
+    first.close()
+    third = WeightedRateLimiter([RateWindow('weight', 10, HOUR)], shared_memory=path)
+    third.record_response(418, {'Retry-After': '30'})
+    assert second.reserve(1) >= 29
+    second.close()
+    third.close()
+
+def test_request_weights():
+    """
+    Test the weights of the endpoints used by the pipeline.
+    """
+    assert request_weight('/api/v3/ticker/price', {'symbol': 'BTCUSDT'}) == 2
+    assert request_weight('/api/v3/ticker/price', {'symbols': '["BTCUSDT","ETHUSDT"]'}) == 4
+    assert request_weight('/api/v3/klines', {'symbol': 'BTCUSDT'}) == 2
+    assert request_weight('/api/v3/unknown') == 1
@@ -0,0 +1,84 @@
+# tests/test_raw_data_writer.py
+
+import queue
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+from database.raw_data_writer import RawDataWriter
+
+@pytest.fixture
+def repository():
+    """
+    Fixture for a mocked RawDataRepository.
+    """
+    return MagicMock()
+
+def _rows(count):
+    timestamp = datetime(2024, 10, 12, 9, 0, tzinfo=timezone.utc)
+    return [('BTCUSDT', {'symbol': 'BTCUSDT', 'price': str(i)}, timestamp) for i in range(count)]
+
+def test_stop_flushes_queued_rows(repository):
+    """
+    Test that every queued row is written when the writer stops, in batches of at most batch_size.
+    """
+    writer = RawDataWriter(repository=repository, batch_size=4, flush_interval=60)
+    writer.start()
+    for row in _rows(10):
+        writer.insert_raw_data(*row)
+    writer.stop()
+
+    written = [row for c in repository.insert_raw_data_bulk.call_args_list for row in c.args[0]]
+    assert written == _rows(10)
+    assert all(len(c.args[0]) <= 4 for c in repository.insert_raw_data_bulk.call_args_list)
+
+    stats = writer.get_stats()
+    assert stats['rows_written'] == 10
+    assert stats['max_batch_size'] <= 4
+    assert stats['queue_size'] == 0
+
+def test_failed_flush_is_counted(repository):
+    """
+    Test that rows of a bulk insert that keeps failing are counted once the retries run out, without crashing the flusher.
+    """
+    repository.insert_raw_data_bulk.side_effect = Exception("connection lost")
+    writer = RawDataWriter(repository=repository, batch_size=10, flush_interval=60, max_retries=2, retry_backoff=0.01)
+    writer.start()
+    for row in _rows(3):
+        writer.insert_raw_data(*row)
+    writer.stop()
+
+    stats = writer.get_stats()
+    assert repository.insert_raw_data_bulk.call_count == 3
+    assert stats['retries'] == 2
+    assert stats['rows_failed'] == 3
+    assert stats['rows_written'] == 0
+    assert stats['retry_rows'] == 0
+
+def test_failed_flush_is_retried(repository):
+    """
+    Test that a batch whose first insert fails is written by a later retry.
+    """
+    repository.insert_raw_data_bulk.side_effect = [Exception("connection lost"), None]
+    writer = RawDataWriter(repository=repository, batch_size=10, flush_interval=60, retry_backoff=0.05)
+    writer.start()
+    for row in _rows(3):
+        writer.insert_raw_data(*row)
+    writer.stop()
+
+    calls = repository.insert_raw_data_bulk.call_args_list
+    assert [c.args[0] for c in calls] == [_rows(3), _rows(3)]
+    stats = writer.get_stats()
+    assert stats['retries'] == 1
+    assert stats['rows_written'] == 3
+    assert stats['rows_failed'] == 0
+
+def test_full_queue_applies_backpressure(repository):
+    """
+    Test that producers get queue.Full once the bounded queue is full and the flusher is not draining it.
+    """
+    writer = RawDataWriter(repository=repository, max_queue_size=2, put_timeout=0.01)
+    for row in _rows(2):
+        writer.insert_raw_data(*row)
+
+    with pytest.raises(queue.Full):
+        writer.insert_raw_data(*_rows(1)[0])
@@ -0,0 +1,123 @@
+# tests/test_retention_manager.py
+
+import pandas as pd
+import pytest
+from unittest.mock import MagicMock, patch
+from archive.parquet_archive import ParquetArchiver
+from utils.retention_manager import RetentionManager
+
+NOW = pd.Timestamp('2024-10-12 12:00:00', tz='UTC').to_pydatetime()
+
+@pytest.fixture
+def retention_manager():
+    """
+    Fixture for a RetentionManager with a 1 hour TTL and mocked repositories.
+    """
+    config = {
+        'symbols': ['BTCUSDT', 'ETHUSDT'],
+        'retention': {'raw_data_ttl_hours': 1, 'batch_size': 100, 'time_budget': 60}
+    }
+    manager = RetentionManager(config, raw_data_repo=MagicMock(), watermark_repo=MagicMock())
+    manager.raw_data_repo.delete_raw_data_before.return_value = 0
+    return manager
+
+def test_cutoff_never_passes_watermark(retention_manager):
+    """
+    Test that rows are deleted up to the TTL cutoff, or the watermark if it is older, and untransformed symbols are kept.
+    """
+    watermark = pd.Timestamp('2024-10-12 10:30:00', tz='UTC').to_pydatetime()
+    retention_manager.watermark_repo.get_watermarks.return_value = {'BTCUSDT': watermark}
+
+    retention_manager.apply(now=NOW)
+
+    retention_manager.raw_data_repo.delete_raw_data_before.assert_called_once_with('BTCUSDT', watermark, 100)
+
+    retention_manager.watermark_repo.get_watermarks.return_value = {'BTCUSDT': NOW, 'ETHUSDT': NOW}
+    retention_manager.raw_data_repo.delete_raw_data_before.reset_mock()
+    retention_manager.apply(now=NOW)
+
+    cutoff = pd.Timestamp('2024-10-12 11:00:00', tz='UTC').to_pydatetime()
+    assert [c.args for c in retention_manager.raw_data_repo.delete_raw_data_before.call_args_list] == [
+        ('BTCUSDT', cutoff, 100), ('ETHUSDT', cutoff, 100)
+    ]
+
+def test_deletes_in_batches_and_reports_rows(retention_manager):
+    """
+    Test that full batches are repeated until a partial batch and the deleted rows are reported.
+    """
+    retention_manager.watermark_repo.get_watermarks.return_value = {'BTCUSDT': NOW}
+    retention_manager.raw_data_repo.delete_raw_data_before.side_effect = [100, 100, 42]
+
+    report = retention_manager.apply(now=NOW)
+
+    assert retention_manager.raw_data_repo.delete_raw_data_before.call_count == 3
+    assert report['rows_deleted'] == 242
+    assert report['complete'] is True
+    assert report['seconds'] >= 0
+
+def test_stops_when_time_budget_is_spent(retention_manager):
+    """
+    Test that no new batch is started once the time budget is exhausted.
+    """
+    retention_manager.watermark_repo.get_watermarks.return_value = {'BTCUSDT': NOW, 'ETHUSDT': NOW}
+    retention_manager.raw_data_repo.delete_raw_data_before.return_value = 100
+
+    with patch('utils.retention_manager.time.perf_counter', side_effect=[0, 0, 30, 61, 61]):
+        report = retention_manager.apply(now=NOW)
+
+    assert retention_manager.raw_data_repo.delete_raw_data_before.call_count == 2
+    assert report == {'rows_deleted': 200, 'complete': False, 'seconds': 61}
+
+def test_timescale_drops_chunks():
+    """
+    Test that with TimescaleDB expired chunks are dropped instead of deleting rows.
+    """
+    backend = MagicMock()
+    dropped_before = pd.Timestamp('2024-10-11 00:00:00', tz='UTC').to_pydatetime()
+    backend.drop_raw_chunks.return_value = (3, 259200, dropped_before)
+    manager = RetentionManager({'symbols': ['BTCUSDT']}, raw_data_repo=MagicMock(), timescale_backend=backend)
+
+    with patch('utils.retention_manager.STATS_COLLECTOR') as collector:
+        report = manager.apply(now=NOW)
+
+    backend.drop_raw_chunks.assert_called_once_with(pd.Timestamp('2024-10-11 12:00:00', tz='UTC').to_pydatetime())
+    manager.raw_data_repo.delete_raw_data_before.assert_not_called()
+    collector.record_drop.assert_called_once_with('raw_data', dropped_before)
+    assert report['rows_deleted'] == 259200
+    assert report['chunks_dropped'] == 3
+
+def test_archive_watermark_limits_cutoff():
+    """
+    Test that with the archive enabled rows are only deleted up to the archived days.
+    """
+    config = {'symbols': ['BTCUSDT'], 'archive': {'enabled': True, 'tables': ['raw_data']}}
+    archived = pd.Timestamp('2024-10-11 00:00:00', tz='UTC').to_pydatetime()
+    watermark_repo = MagicMock()
+    watermark_repo.get_watermarks.side_effect = [{'BTCUSDT': NOW}, {'BTCUSDT': archived}]
+    manager = RetentionManager(config, raw_data_repo=MagicMock(), watermark_repo=watermark_repo)
+    manager.raw_data_repo.delete_raw_data_before.return_value = 0
+
+    manager.apply(now=NOW)
+
+    manager.raw_data_repo.delete_raw_data_before.assert_called_once_with('BTCUSDT', archived, 10000)
+    watermark_repo.get_watermarks.assert_called_with(['BTCUSDT'], stage='archive_raw_data')
+
+def test_archive_of_compacted_runs_limits_cutoff():
+    """
+    Test that with compaction the raw_data entry of archive.tables means raw_data_run for the archiver and retention.
+    """
+    config = {'symbols': ['BTCUSDT'], 'raw_storage': {'compaction': True},
+              'archive': {'enabled': True, 'tables': ['raw_data', 'downsampled_data']}}
+    archived = pd.Timestamp('2024-10-11 00:00:00', tz='UTC').to_pydatetime()
+    watermark_repo = MagicMock()
+    watermark_repo.get_watermarks.side_effect = [{'BTCUSDT': NOW}, {'BTCUSDT': archived}]
+    manager = RetentionManager(config, raw_data_repo=MagicMock(), watermark_repo=watermark_repo)
+    manager.raw_data_repo.delete_raw_data_before.return_value = 0
+
+    manager.apply(now=NOW)
+
+    assert ParquetArchiver(config, source=MagicMock(), watermark_repo=MagicMock()).tables == [
+        'raw_data_run', 'downsampled_data'
+    ]
+    manager.raw_data_repo.delete_raw_data_before.assert_called_once_with('BTCUSDT', archived, 10000)
+    watermark_repo.get_watermarks.assert_called_with(['BTCUSDT'], stage='archive_raw_data_run')
@@ -0,0 +1,108 @@
+# tests/test_series_query.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import MagicMock
+from database.series_query import SeriesQuery
+
+class FakeDownsampledRepository:
+    """
+    Serves a fixed DataFrame through fetch_downsampled_data and records every range read.
+    """
+    def __init__(self, df):
+        self.df = df
+        self.calls = []
+
+    def fetch_downsampled_data(self, symbol, start=None, end=None):
+        self.calls.append((symbol, start, end))
+        df = self.df
+        return df[(df['symbol'] == symbol) & (df['timestamp'] >= start) & (df['timestamp'] < end)].reset_index(drop=True)
+
+@pytest.fixture
+def downsampled_df():
+    """
+    Fixture for two days of 1-minute windows of two symbols.
+    """
+    timestamps = pd.date_range('2024-10-11 00:00:00', periods=2 * 1440, freq='1min', tz='UTC')
+    return pd.concat([
+        pd.DataFrame({
+            'symbol': symbol,
+            'timestamp': timestamps,
+            'avg_price': np.arange(len(timestamps), dtype=float) + offset,
+            'median_price': np.arange(len(timestamps), dtype=float) + offset
+        })
+        for symbol, offset in [('BTCUSDT', 0.0), ('ETHUSDT', 0.5)]
+    ], ignore_index=True)
+
+@pytest.fixture
+def series_query(downsampled_df):
+    """
+    Fixture for a SeriesQuery with 60-bucket chunks over a fake repository, closed up to 2024-10-12 12:00.
+    """
+    config = {'downsampling_frequency': 1, 'series_cache': {'chunk_buckets': 60, 'max_rows': 100000}}
+    watermark_repo = MagicMock()
+    watermark = pd.Timestamp('2024-10-12 12:00:00', tz='UTC').to_pydatetime()
+    watermark_repo.get_watermarks.return_value = {'BTCUSDT': watermark, 'ETHUSDT': watermark}
+    return SeriesQuery(config, downsampled_repo=FakeDownsampledRepository(downsampled_df),
+                       watermark_repo=watermark_repo)
+
+def _expected(df, symbols, start, end):
+    start, end = pd.Timestamp(start, tz='UTC'), pd.Timestamp(end, tz='UTC')
+    mask = df['symbol'].isin(symbols) & (df['timestamp'] >= start) & (df['timestamp'] < end)
+    return df[mask].reset_index(drop=True)
+
+def test_returns_same_rows_as_the_database(series_query, downsampled_df):
+    """
+    Test that cold and warm reads return exactly the rows of the range, across closed chunks and the open tail.
+    """
+    symbols = ['BTCUSDT', 'ETHUSDT']
+    expected = _expected(downsampled_df, symbols, '2024-10-12 09:30', '2024-10-12 14:10')
+
+    cold = series_query.get_series(symbols, '2024-10-12 09:30', '2024-10-12 14:10')
+    warm = series_query.get_series(symbols, '2024-10-12 09:30', '2024-10-12 14:10')
+
+    pd.testing.assert_frame_equal(cold, expected)
+    pd.testing.assert_frame_equal(warm, expected)
+
+def test_only_open_tail_is_read_again(series_query):
+    """
+    Test that closed chunks are served from the cache and only the range after the watermark is re-read.
+    """
+    series_query.get_series('BTCUSDT', '2024-10-12 09:00', '2024-10-12 14:00')
+    repo = series_query.downsampled_repo
+    # One read for the three closed hours, one for the open tail
+    assert len(repo.calls) == 2
+    assert series_query.get_stats()['misses'] == 3
+
+    repo.calls.clear()
+    series_query.get_series('BTCUSDT', '2024-10-12 09:00', '2024-10-12 14:00')
+
+    assert repo.calls == [('BTCUSDT', pd.Timestamp('2024-10-12 12:00', tz='UTC'), pd.Timestamp('2024-10-12 14:00', tz='UTC'))]
+    assert series_query.get_stats()['hits'] == 3
+
+def test_lru_eviction_bounds_cached_rows(series_query):
+    """
+    Test that the least recently used chunks are evicted once max_rows is exceeded.
+    """
+    series_query.max_rows = 120
+    series_query.get_series('BTCUSDT', '2024-10-12 08:00', '2024-10-12 10:00')
+    series_query.get_series('BTCUSDT', '2024-10-12 08:00', '2024-10-12 09:00')
+    series_query.get_series('BTCUSDT', '2024-10-12 10:00', '2024-10-12 11:00')
+
+    stats = series_query.get_stats()
+    assert stats['cached_rows'] == 120
+    assert stats['cached_chunks'] == 2
+    # 09:00 was the least recently used chunk
+    assert ('BTCUSDT', 1, pd.Timestamp('2024-10-12 09:00', tz='UTC')) not in series_query._cache
+
+def test_as_arrays(series_query, downsampled_df):
+    """
+    Test that as_arrays returns NumPy arrays per symbol with int64 nanosecond timestamps.
+    """
+    arrays = series_query.get_series(['BTCUSDT'], '2024-10-12 10:00', '2024-10-12 10:05', as_arrays=True)
+
+    expected = _expected(downsampled_df, ['BTCUSDT'], '2024-10-12 10:00', '2024-10-12 10:05')
+    assert arrays['BTCUSDT']['timestamp'].dtype == np.int64
+    assert arrays['BTCUSDT']['timestamp'][0] == pd.Timestamp('2024-10-12 10:00', tz='UTC').value
+    np.testing.assert_array_equal(arrays['BTCUSDT']['avg_price'], expected['avg_price'].to_numpy())
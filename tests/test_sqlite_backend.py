@@ -0,0 +1,105 @@
+# tests/test_sqlite_backend.py
+
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+from database.database import Database
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.raw_data_repository import RawDataRepository
+from database.rollup_repository import RollupRepository
+from database.state_repository import StateRepository
+from database.watermark_repository import WatermarkRepository
+from transformation.transformer import DataTransformer
+from utils.retention_manager import RetentionManager
+
+START = pd.Timestamp('2024-01-01', tz='UTC').to_pydatetime()
+SYMBOLS = ['BTCUSDT', 'ETHUSDT']
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    """
+    Fixture that points Database at an embedded SQLite file for the duration of a test.
+    """
+    engine, session_local = Database._engine, Database._SessionLocal
+    Database.initialize({'backend': 'sqlite', 'path': str(tmp_path / 'binance.sqlite')})
+    yield Database.get_engine()
+    Database._engine.dispose()
+    Database._engine, Database._SessionLocal = engine, session_local
+
+@pytest.fixture
+def raw_data_repo(sqlite_database):
+    """
+    Fixture for a RawDataRepository holding two hours of 1 second prices per symbol.
+    """
+    repository = RawDataRepository()
+    repository.insert_raw_data_bulk([
+        (symbol, {'symbol': symbol, 'price': str(100 + i)}, START + timedelta(seconds=i))
+        for symbol in SYMBOLS for i in range(7200)
+    ])
+    return repository
+
+def test_sqlite_runs_in_wal_mode(sqlite_database):
+    """
+    Test that the embedded database uses write-ahead logging.
+    """
+    with sqlite_database.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+
+def test_raw_data_reads_and_retention(raw_data_repo):
+    """
+    Test bulk inserts, range reads from per-symbol watermarks and batched deletes on SQLite.
+    """
+    # Duplicates are ignored like ON CONFLICT DO NOTHING
+    raw_data_repo.insert_raw_data_bulk([('BTCUSDT', {'price': '1'}, START)])
+
+    df = raw_data_repo.fetch_unprocessed_data('BTCUSDT', START + timedelta(minutes=30))
+    assert len(df) == 5400
+    assert df['timestamp'].iloc[0] == pd.Timestamp('2024-01-01 00:30', tz='UTC')
+    assert df['price'].iloc[0] == 1900
+
+    df = raw_data_repo.fetch_unprocessed_data_all(SYMBOLS, {'BTCUSDT': START + timedelta(hours=1)},
+                                                  end=START + timedelta(hours=1, minutes=30))
+    assert df.groupby('symbol').size().to_dict() == {'BTCUSDT': 1800, 'ETHUSDT': 5400}
+
+    assert raw_data_repo.delete_raw_data_before('ETHUSDT', START + timedelta(hours=1), 1000) == 1000
+    assert raw_data_repo.fetch_unprocessed_data('ETHUSDT')['timestamp'].iloc[0] == \
+        pd.Timestamp('2024-01-01 00:16:40', tz='UTC')
+
+def test_transformation_pipeline(raw_data_repo):
+    """
+    Test the transformation, rollups, watermarks, state and retention end to end on SQLite.
+    """
+    config = {
+        'symbols': SYMBOLS,
+        'downsampling_frequency': 60,
+        'transform_grace_seconds': 0,
+        'rollups': {'enabled': True, 'resolutions': [60, 120]},
+        'retention': {'raw_data_ttl_hours': 1}
+    }
+    watermark_repo = WatermarkRepository()
+    downsampled_repo = DownsampledDataRepository()
+    transformer = DataTransformer(config, raw_data_repo=raw_data_repo, downsampled_repo=downsampled_repo,
+                                  watermark_repo=watermark_repo)
+    transformer.transform_data(now=START + timedelta(hours=3))
+
+    df = downsampled_repo.fetch_downsampled_data('BTCUSDT')
+    assert df['avg_price'].tolist() == [1899.5, 5499.5]
+    assert df['timestamp'].tolist() == [START, START + timedelta(hours=1)]
+    assert RollupRepository().fetch_rollups('BTCUSDT', 120)['count'].tolist() == [7200]
+    assert watermark_repo.get_watermarks(SYMBOLS) == {symbol: START + timedelta(hours=3) for symbol in SYMBOLS}
+
+    # Watermarks never move backwards unless rewound
+    watermark_repo.set_watermarks({'BTCUSDT': START})
+    assert watermark_repo.get_watermarks(['BTCUSDT'])['BTCUSDT'] == START + timedelta(hours=3)
+    watermark_repo.rewind_watermarks({'BTCUSDT': START + timedelta(hours=2)})
+    assert watermark_repo.get_watermarks(['BTCUSDT'])['BTCUSDT'] == START + timedelta(hours=2)
+
+    state_repo = StateRepository()
+    state_repo.save_collected_points({'BTCUSDT': 5})
+    state_repo.save_collected_points({'BTCUSDT': 7, 'ETHUSDT': 1})
+    assert state_repo.load_collected_points() == {'BTCUSDT': 7, 'ETHUSDT': 1}
+
+    retention_manager = RetentionManager(config, raw_data_repo=raw_data_repo, watermark_repo=watermark_repo)
+    report = retention_manager.apply(now=START + timedelta(hours=2, minutes=30))
+    assert report['rows_deleted'] == 2 * 5400
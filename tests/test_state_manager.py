@@ -0,0 +1,135 @@
+# tests/test_state_manager.py
+
+import threading
+import pytest
+from unittest.mock import MagicMock
+from utils.state_manager import StateManager
+
+@pytest.fixture
+def repository():
+    """
+    Fixture for a mocked StateRepository with persisted state for one symbol.
+    """
+    repository = MagicMock()
+    repository.load_collected_points.return_value = {'BTCUSDT': 5}
+    return repository
+
+def test_restores_counters_on_startup(repository):
+    """
+    Test that counters are loaded from the repository when the manager is created.
+    """
+    state_manager = StateManager(repository=repository)
+
+    assert state_manager.get_collected_points('BTCUSDT') == 5
+    assert state_manager.get_collected_points('ETHUSDT') == 0
+
+def test_updates_stay_in_memory_until_checkpoint(repository):
+    """
+    Test that updates do not touch the database and that a checkpoint writes only changed symbols.
+    """
+    state_manager = StateManager(repository=repository)
+
+    assert state_manager.update_collected_points('BTCUSDT') == 6
+    assert state_manager.update_collected_points('ETHUSDT') == 1
+    assert state_manager.update_collected_points('ETHUSDT') == 2
+    repository.save_collected_points.assert_not_called()
+
+    assert state_manager.checkpoint() == 2
+    repository.save_collected_points.assert_called_once_with({'BTCUSDT': 6, 'ETHUSDT': 2})
+
+    # Nothing changed since the last checkpoint
+    assert state_manager.checkpoint() == 0
+    assert repository.save_collected_points.call_count == 1
+
+def test_failed_checkpoint_is_retried(repository):
+    """
+    Test that symbols from a failed checkpoint are written by the next one.
+    """
+    state_manager = StateManager(repository=repository)
+    state_manager.update_collected_points('ETHUSDT')
+    repository.save_collected_points.side_effect = [Exception("connection lost"), None]
+
+    with pytest.raises(Exception):
+        state_manager.checkpoint()
+    state_manager.checkpoint()
+
+    assert repository.save_collected_points.call_args.args[0] == {'ETHUSDT': 1}
+
+def test_concurrent_updates(repository):
+    """
+    Test that concurrent updates for the same symbol are not lost.
+    """
+    state_manager = StateManager(repository=repository)
+
+    def update():
+        for _ in range(1000):
+            state_manager.update_collected_points('ETHUSDT')
+
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert state_manager.get_collected_points('ETHUSDT') == 8000
+
+def test_checkpoints_during_updates_keep_every_change(repository):
+    """
+    Test that checkpoints running alongside updates never lose a changed counter.
+    """
+    saved = {}
+    repository.save_collected_points.side_effect = saved.update
+    state_manager = StateManager(repository=repository)
+    done = threading.Event()
+
+    def update(symbol):
+        for _ in range(2000):
+            state_manager.update_collected_points(symbol)
+
+    def checkpoint():
+        while not done.is_set():
+            state_manager.checkpoint()
+
+    checkpointer = threading.Thread(target=checkpoint)
+    checkpointer.start()
+    threads = [threading.Thread(target=update, args=(symbol,)) for symbol in ['BTCUSDT', 'ETHUSDT', 'BNBUSDT']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    checkpointer.join()
+    state_manager.checkpoint()
+
+    assert saved == {'BTCUSDT': 2005, 'ETHUSDT': 2000, 'BNBUSDT': 2000}
+
+def test_load_merges_into_live_counters(repository):
+    """
+    Test that reloading keeps updates that are not checkpointed and picks up counters advanced elsewhere.
+    """
+    state_manager = StateManager(repository=repository)
+    for _ in range(3):
+        state_manager.update_collected_points('BTCUSDT')
+    state_manager.update_collected_points('ETHUSDT')
+    # Another node advanced ETHUSDT and owned BNBUSDT
+    repository.load_collected_points.return_value = {'BTCUSDT': 5, 'ETHUSDT': 40, 'BNBUSDT': 12}
+
+    state_manager.load()
+
+    assert state_manager.get_collected_points('BTCUSDT') == 8
+    assert state_manager.get_collected_points('ETHUSDT') == 40
+    assert state_manager.get_collected_points('BNBUSDT') == 12
+    assert state_manager.checkpoint() == 2
+
+def test_reset_state(repository):
+    """
+    Test that resetting clears the in-memory counters and the persisted state.
+    """
+    state_manager = StateManager(repository=repository)
+    state_manager.update_collected_points('ETHUSDT')
+
+    state_manager.reset_state()
+
+    assert state_manager.get_collected_points('BTCUSDT') == 0
+    assert state_manager.checkpoint() == 0
+    repository.reset_state.assert_called_once()
@@ -0,0 +1,95 @@
+# tests/test_stats_catalog.py
+
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+from database.database import Database
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.raw_data_repository import RawDataRepository
+from database.stats_catalog import STATS_COLLECTOR, StatsCatalogRepository, StatsCollector
+
+START = pd.Timestamp('2024-01-01', tz='UTC').to_pydatetime()
+
+@pytest.fixture
+def catalog(tmp_path):
+    """
+    Fixture for a StatsCatalogRepository on an embedded SQLite file, with nothing collected yet.
+    """
+    engine, session_local = Database._engine, Database._SessionLocal
+    Database.initialize({'backend': 'sqlite', 'path': str(tmp_path / 'binance.sqlite')})
+    STATS_COLLECTOR.pending.clear()
+    yield StatsCatalogRepository()
+    STATS_COLLECTOR.pending.clear()
+    Database._engine.dispose()
+    Database._engine, Database._SessionLocal = engine, session_local
+
+def test_write_paths_maintain_catalog(catalog):
+    """
+    Test that inserts and retention deletes of the repositories end up in table_stats.
+    """
+    raw_data_repo = RawDataRepository()
+    raw_data_repo.insert_raw_data_bulk([
+        (symbol, {'price': '100'}, START + timedelta(seconds=i))
+        for symbol in ('BTCUSDT', 'ETHUSDT') for i in range(120)
+    ])
+    DownsampledDataRepository().insert_downsampled_data(pd.DataFrame({
+        'symbol': ['BTCUSDT', 'BTCUSDT'],
+        'timestamp': [pd.Timestamp(START), pd.Timestamp(START) + pd.Timedelta(minutes=1)],
+        'avg_price': [100.0, 100.0], 'median_price': [100.0, 100.0],
+    }))
+    STATS_COLLECTOR.flush(catalog)
+
+    # Retention takes the first minute of BTCUSDT
+    assert raw_data_repo.delete_raw_data_before('BTCUSDT', START + timedelta(minutes=1), 1000) == 60
+    raw_data_repo.insert_raw_data_bulk([('BTCUSDT', {'price': '101'}, START + timedelta(seconds=120))])
+    STATS_COLLECTOR.flush(catalog)
+
+    raw_stats = catalog.get_stats('raw_data').set_index('symbol')
+    assert raw_stats.loc['BTCUSDT', 'row_count'] == 61
+    assert raw_stats.loc['ETHUSDT', 'row_count'] == 120
+    assert raw_stats.loc['BTCUSDT', 'first_timestamp'] == pd.Timestamp(START + timedelta(minutes=1))
+    assert raw_stats.loc['BTCUSDT', 'last_timestamp'] == pd.Timestamp(START + timedelta(seconds=120))
+    assert raw_stats.loc['BTCUSDT', 'last_ingest_latency'] > 0
+    assert catalog.get_stats('downsampled_data')['row_count'].tolist() == [2]
+
+def test_failed_flush_keeps_deltas(catalog):
+    """
+    Test that deltas are merged back when the catalog cannot be written, so no count is lost.
+    """
+    collector = StatsCollector()
+    collector.record('raw_data', 'BTCUSDT', 5, START, START + timedelta(seconds=4))
+
+    class FailingRepository:
+        def apply_deltas(self, deltas):
+            raise RuntimeError("database unavailable")
+
+    with pytest.raises(RuntimeError):
+        collector.flush(FailingRepository())
+    collector.record('raw_data', 'BTCUSDT', 3, START + timedelta(seconds=5), START + timedelta(seconds=7))
+    assert collector.flush(catalog) == 1
+
+    stats = catalog.get_stats('raw_data')
+    assert stats['row_count'].tolist() == [8]
+    assert stats['last_timestamp'].iloc[0] == pd.Timestamp(START + timedelta(seconds=7))
+
+def test_dropped_range_scales_counts(catalog):
+    """
+    Test that a table-wide drop moves the first timestamps up and scales the counts by the dropped range.
+    """
+    RawDataRepository().insert_raw_data_bulk([
+        (symbol, {'price': '100'}, START + timedelta(seconds=i))
+        for symbol, seconds in (('BTCUSDT', 101), ('ETHUSDT', 21)) for i in range(seconds)
+    ])
+    STATS_COLLECTOR.flush(catalog)
+
+    # Chunks up to 30 seconds were dropped, all of ETHUSDT and 30 of the 100 seconds of BTCUSDT
+    STATS_COLLECTOR.record_drop('raw_data', START + timedelta(seconds=30))
+    STATS_COLLECTOR.flush(catalog)
+
+    raw_stats = catalog.get_stats('raw_data').set_index('symbol')
+    assert raw_stats.loc['BTCUSDT', 'row_count'] == 70
+    assert raw_stats.loc['BTCUSDT', 'first_timestamp'] == pd.Timestamp(START + timedelta(seconds=30))
+    assert raw_stats.loc['BTCUSDT', 'last_timestamp'] == pd.Timestamp(START + timedelta(seconds=100))
+    assert raw_stats.loc['ETHUSDT', 'row_count'] == 0
+    assert pd.isna(raw_stats.loc['ETHUSDT', 'first_timestamp'])
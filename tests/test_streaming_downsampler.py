@@ -0,0 +1,164 @@
+# tests/test_streaming_downsampler.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import MagicMock
+from database.database import Database
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.raw_data_repository import RawDataRepository
+from database.watermark_repository import WatermarkRepository
+from transformation.streaming_downsampler import StreamingDownsampler
+from transformation.transformer import DataTransformer
+
+@pytest.fixture
+def downsampler():
+    """
+    Fixture for a StreamingDownsampler with 1-minute windows and a mocked downsampled repository.
+    """
+    config = {
+        'downsampling_frequency': 1,
+        'symbols': ['BTCUSDT'],
+        'streaming_downsampling': {'grace_seconds': 5}
+    }
+    return StreamingDownsampler(config, downstream=MagicMock(), downsampled_repo=MagicMock(),
+                                watermark_repo=MagicMock(), started_at=pd.Timestamp('2024-10-12 09:00:00', tz='UTC'))
+
+@pytest.fixture
+def sqlite_database(tmp_path):
+    """
+    Fixture that points Database at an embedded SQLite file for the duration of a test.
+    """
+    engine, session_local = Database._engine, Database._SessionLocal
+    Database.initialize({'backend': 'sqlite', 'path': str(tmp_path / 'binance.sqlite')})
+    yield Database.get_engine()
+    Database._engine.dispose()
+    Database._engine, Database._SessionLocal = engine, session_local
+
+def _feed(downsampler, symbol, timestamps, prices):
+    for timestamp, price in zip(timestamps, prices):
+        downsampler.insert_raw_data(symbol, {'symbol': symbol, 'price': str(price)}, timestamp)
+
+def _emitted(downsampler):
+    return pd.concat(
+        [c.args[0] for c in downsampler.downsampled_repo.insert_downsampled_data.call_args_list],
+        ignore_index=True
+    )
+
+def test_matches_pandas_resample(downsampler):
+    """
+    Test that emitted windows have the same mean and median as resampling the raw points.
+    """
+    rng = np.random.default_rng(7)
+    timestamps = pd.date_range('2024-10-12 09:00:00', periods=300, freq='s', tz='UTC')
+    prices = np.round(100 + rng.normal(size=300).cumsum(), 2)
+    _feed(downsampler, 'BTCUSDT', timestamps, prices)
+
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:10:00', tz='UTC'))
+
+    expected = pd.DataFrame({'price': prices}, index=timestamps).resample('1min').agg(['mean', 'median'])
+    emitted = _emitted(downsampler)
+    assert list(emitted['timestamp']) == list(expected.index)
+    np.testing.assert_allclose(emitted['avg_price'], expected[('price', 'mean')])
+    np.testing.assert_allclose(emitted['median_price'], expected[('price', 'median')])
+    assert (emitted['symbol'] == 'BTCUSDT').all()
+
+def test_open_window_waits_for_grace_period(downsampler):
+    """
+    Test that only windows closed for longer than the grace period are emitted.
+    """
+    timestamps = pd.to_datetime(['2024-10-12 09:00:30', '2024-10-12 09:01:10'], utc=True)
+    _feed(downsampler, 'BTCUSDT', timestamps, [100, 101])
+
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:01:03', tz='UTC'))
+    downsampler.downsampled_repo.insert_downsampled_data.assert_not_called()
+
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:01:06', tz='UTC'))
+    emitted = _emitted(downsampler)
+    assert list(emitted['timestamp']) == [pd.Timestamp('2024-10-12 09:00:00', tz='UTC')]
+
+    # The window of 09:01 is still open
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:01:07', tz='UTC'))
+    assert len(_emitted(downsampler)) == 1
+
+def test_late_points_are_dropped(downsampler):
+    """
+    Test that points for an already emitted window are counted and not emitted again.
+    """
+    _feed(downsampler, 'BTCUSDT', pd.to_datetime(['2024-10-12 09:00:30'], utc=True), [100])
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:02:00', tz='UTC'))
+
+    _feed(downsampler, 'BTCUSDT', pd.to_datetime(['2024-10-12 09:00:45'], utc=True), [200])
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:03:00', tz='UTC'))
+
+    assert downsampler.late_points == 1
+    assert downsampler.downsampled_repo.insert_downsampled_data.call_count == 1
+
+def test_forwards_to_downstream_and_skips_invalid_prices(downsampler):
+    """
+    Test that every point is forwarded to the raw sink while non-numeric prices are not aggregated.
+    """
+    timestamps = pd.to_datetime(['2024-10-12 09:00:00', '2024-10-12 09:00:01'], utc=True)
+    _feed(downsampler, 'BTCUSDT', timestamps, ['100', 'ABC'])
+
+    assert downsampler.downstream.insert_raw_data.call_count == 2
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:02:00', tz='UTC'))
+    assert list(_emitted(downsampler)['avg_price']) == [100.0]
+
+def test_watermarks_follow_emitted_windows(downsampler):
+    """
+    Test that the transform watermark moves to the end of the last emitted window, but not past open ones.
+    """
+    _feed(downsampler, 'BTCUSDT', pd.to_datetime(['2024-10-12 09:00:30', '2024-10-12 09:01:30'], utc=True), [100, 101])
+
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:01:10', tz='UTC'))
+    downsampler.watermark_repo.set_watermarks.assert_called_once_with(
+        {'BTCUSDT': pd.Timestamp('2024-10-12 09:01:00', tz='UTC').to_pydatetime()}
+    )
+
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:01:20', tz='UTC'))
+    assert downsampler.watermark_repo.set_watermarks.call_count == 1
+
+def test_window_open_at_start_is_skipped_without_raw_data():
+    """
+    Test that without a recovery transformer the window that was open at the start is never emitted.
+    """
+    config = {'downsampling_frequency': 1, 'symbols': ['BTCUSDT'], 'streaming_downsampling': {'grace_seconds': 5}}
+    downsampler = StreamingDownsampler(config, downsampled_repo=MagicMock(), watermark_repo=MagicMock(),
+                                       started_at=pd.Timestamp('2024-10-12 09:00:40', tz='UTC'))
+    timestamps = pd.to_datetime(['2024-10-12 09:00:50', '2024-10-12 09:01:10'], utc=True)
+    _feed(downsampler, 'BTCUSDT', timestamps, [100, 101])
+
+    downsampler.flush(now=pd.Timestamp('2024-10-12 09:02:10', tz='UTC'))
+    emitted = _emitted(downsampler)
+    assert list(emitted['timestamp']) == [pd.Timestamp('2024-10-12 09:01:00', tz='UTC')]
+
+def test_restart_recovers_open_window_from_raw_data(sqlite_database):
+    """
+    Test that a window open across a stop and restart is stored with all of its points, not only the later ones.
+    """
+    config = {'downsampling_frequency': 1, 'symbols': ['BTCUSDT'], 'streaming_downsampling': {'grace_seconds': 5}}
+    prices = pd.Series(np.arange(300, dtype=float) + 100,
+                       index=pd.date_range('2024-10-12 09:00:00', periods=300, freq='s', tz='UTC'))
+    before, after = prices[:'2024-10-12 09:02:20'], prices['2024-10-12 09:02:40':]
+
+    def start(started_at):
+        return StreamingDownsampler(config, downstream=RawDataRepository(), started_at=started_at,
+                                    recovery_transformer=DataTransformer(dict(config, transform_grace_seconds=0)))
+
+    first = start(pd.Timestamp('2024-10-12 08:59:59', tz='UTC'))
+    _feed(first, 'BTCUSDT', before.index, before.values)
+    # Stop in the middle of the 09:02 window
+    first.flush(now=pd.Timestamp('2024-10-12 09:02:21', tz='UTC'))
+
+    second = start(pd.Timestamp('2024-10-12 09:02:40', tz='UTC'))
+    _feed(second, 'BTCUSDT', after.index, after.values)
+    assert second.flush(now=pd.Timestamp('2024-10-12 09:03:03', tz='UTC')) == 0
+    second.flush(now=pd.Timestamp('2024-10-12 09:05:10', tz='UTC'))
+
+    stored = DownsampledDataRepository().fetch_downsampled_data('BTCUSDT').set_index('timestamp')
+    expected = pd.concat([before, after]).resample('1min').agg(['mean', 'median'])
+    assert list(stored.index) == list(expected.index)
+    np.testing.assert_allclose(stored['avg_price'], expected['mean'])
+    np.testing.assert_allclose(stored['median_price'], expected['median'])
+    assert WatermarkRepository().get_watermarks(['BTCUSDT'])['BTCUSDT'] == pd.Timestamp('2024-10-12 09:05:00', tz='UTC')
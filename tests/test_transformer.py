@@ -1,6 +1,7 @@
 # tests/test_transformer.py
 
 import pytest
+import numpy as np
 import pandas as pd
 from transformation.transformer import DataTransformer
 from unittest.mock import MagicMock
@@ -19,6 +20,8 @@ def sample_transformer():
     # Mock repositories to isolate transformer logic
     transformer.raw_data_repo = MagicMock()
     transformer.downsampled_repo = MagicMock()
+    transformer.watermark_repo = MagicMock()
+    transformer.watermark_repo.get_watermarks.return_value = {}
     
     return transformer
 
@@ -190,4 +193,144 @@ def test_downsample_data_duplicate_timestamps(sample_transformer, caplog):
     pd.testing.assert_frame_equal(df_downsampled_sorted, expected_df_sorted)
     
     # Check if warning was logged
-    assert "Dropped 0 rows due to non-numeric prices." not in caplog.text
\ No newline at end of file
+    assert "Dropped 0 rows due to non-numeric prices." not in caplog.text
+
+def test_downsample_all_matches_per_symbol(sample_transformer):
+    """
+    Test that the single-pass multi-symbol transform matches a per-symbol pandas resample of mean and median.
+    """
+    transformer = sample_transformer
+    rng = np.random.default_rng(42)
+    frames = []
+    for symbol in ['AAPL', 'GOOG', 'MSFT']:
+        timestamps = pd.date_range('2024-10-12 09:00:00', periods=500, freq='7s', tz='UTC')
+        frames.append(pd.DataFrame({
+            'timestamp': timestamps,
+            'price': np.round(100 + rng.normal(size=len(timestamps)).cumsum(), 2),
+            'symbol': symbol
+        }))
+    df = pd.concat(frames, ignore_index=True)
+
+    expected = []
+    for symbol, group in df.groupby('symbol'):
+        resampled = group.set_index('timestamp').resample('1T').agg({'price': ['mean', 'median']})
+        resampled.columns = ['avg_price', 'median_price']
+        resampled = resampled.dropna().reset_index()
+        resampled['symbol'] = symbol
+        expected.append(resampled[['symbol', 'timestamp', 'avg_price', 'median_price']])
+    expected_df = pd.concat(expected, ignore_index=True)
+    df_downsampled = transformer._downsample_all(df.copy())
+
+    pd.testing.assert_frame_equal(df_downsampled, expected_df)
+
+def test_transform_data_batch_mode(sample_transformer, valid_sample_df):
+    """
+    Test that batch mode issues one fetch and one insert for all symbols.
+    """
+    transformer = sample_transformer
+    transformer.config['symbols'] = ['AAPL', 'GOOG']
+    transformer.raw_data_repo.fetch_unprocessed_data_all.return_value = valid_sample_df
+
+    transformer.transform_data(now=pd.Timestamp('2024-10-12 09:05:00', tz='UTC'))
+
+    end = pd.Timestamp('2024-10-12 09:04:00', tz='UTC').to_pydatetime()
+    transformer.raw_data_repo.fetch_unprocessed_data_all.assert_called_once_with(['AAPL', 'GOOG'], {}, end)
+    transformer.raw_data_repo.fetch_unprocessed_data.assert_not_called()
+    transformer.downsampled_repo.insert_downsampled_data.assert_called_once()
+
+def test_transform_data_noop_with_timescale(sample_transformer):
+    """
+    Test that the transformation does nothing when TimescaleDB maintains downsampled_data.
+    """
+    transformer = sample_transformer
+    transformer.config['timescale'] = {'enabled': True}
+
+    transformer.transform_data()
+
+    transformer.raw_data_repo.fetch_unprocessed_data_all.assert_not_called()
+    transformer.downsampled_repo.insert_downsampled_data.assert_not_called()
+
+def test_transform_data_reads_from_watermark_to_closed_window(sample_transformer, valid_sample_df):
+    """
+    Test that each symbol is read from its watermark up to the last window closed before now minus the grace period.
+    """
+    transformer = sample_transformer
+    transformer.config['transform_mode'] = 'per_symbol'
+    watermark = pd.Timestamp('2024-10-12 09:00:00', tz='UTC').to_pydatetime()
+    transformer.watermark_repo.get_watermarks.return_value = {'AAPL': watermark}
+    transformer.raw_data_repo.fetch_unprocessed_data.return_value = valid_sample_df
+
+    # 09:04:20 minus the 30 second grace period is still inside the 09:03 window
+    transformer.transform_data(now=pd.Timestamp('2024-10-12 09:04:20', tz='UTC'))
+
+    end = pd.Timestamp('2024-10-12 09:03:00', tz='UTC').to_pydatetime()
+    transformer.raw_data_repo.fetch_unprocessed_data.assert_called_once_with('AAPL', watermark, end)
+    transformer.watermark_repo.set_watermarks.assert_called_once_with({'AAPL': end})
+
+def test_transform_data_keeps_watermark_on_failure(sample_transformer):
+    """
+    Test that the watermark does not move when the downsampled rows could not be stored.
+    """
+    transformer = sample_transformer
+    transformer.raw_data_repo.fetch_unprocessed_data_all.side_effect = Exception("connection lost")
+
+    transformer.transform_data(now=pd.Timestamp('2024-10-12 09:05:00', tz='UTC'))
+
+    transformer.watermark_repo.set_watermarks.assert_not_called()
+
+def test_rollup_pyramid_matches_raw_aggregation(sample_transformer):
+    """
+    Test that an hourly level built from 1 and 5 minute levels equals hourly buckets built from raw rows.
+    """
+    transformer = sample_transformer
+    rng = np.random.default_rng(3)
+    timestamps = pd.date_range('2024-10-12 09:00:00', periods=7200, freq='s', tz='UTC')
+    df = pd.concat([
+        pd.DataFrame({'timestamp': timestamps, 'price': 100 + rng.normal(size=7200).cumsum(), 'symbol': symbol})
+        for symbol in ['AAPL', 'GOOG']
+    ], ignore_index=True)
+
+    one_minute = transformer._rollup_raw(df, 1)
+    hourly = transformer._rollup_level(transformer._rollup_level(one_minute, 5), 60)
+
+    pd.testing.assert_frame_equal(hourly, transformer._rollup_raw(df, 60))
+    assert list(hourly['count']) == [3600, 3600, 3600, 3600]
+    assert hourly['open'].iloc[0] == df['price'].iloc[0]
+    assert hourly['close'].iloc[1] == df['price'].iloc[7199]
+
+def test_update_rollup_levels_reads_closed_buckets_only(sample_transformer):
+    """
+    Test that a level is built only up to the last of its buckets the level below has fully passed.
+    """
+    transformer = sample_transformer
+    transformer.rollup_resolutions = [1, 5]
+    transformer.rollup_repo = MagicMock()
+    lower_watermark = pd.Timestamp('2024-10-12 09:07:00', tz='UTC').to_pydatetime()
+    transformer.watermark_repo.get_watermarks.side_effect = [{'AAPL': lower_watermark}, {}]
+    transformer.rollup_repo.fetch_rollups_all.return_value = pd.DataFrame({
+        'symbol': 'AAPL',
+        'timestamp': pd.date_range('2024-10-12 09:00:00', periods=5, freq='1min', tz='UTC'),
+        'open': [1.0, 2.0, 3.0, 4.0, 5.0], 'high': [2.0, 3.0, 9.0, 5.0, 6.0], 'low': [0.5, 1.0, 2.0, 3.0, 4.0],
+        'close': [2.0, 3.0, 4.0, 5.0, 6.0], 'count': [10, 10, 10, 10, 10], 'sum': [15.0, 25.0, 35.0, 45.0, 55.0]
+    })
+
+    transformer._update_rollup_levels()
+
+    end = pd.Timestamp('2024-10-12 09:05:00', tz='UTC').to_pydatetime()
+    transformer.rollup_repo.fetch_rollups_all.assert_called_once_with(1, ['AAPL'], {}, {'AAPL': end})
+    transformer.watermark_repo.set_watermarks.assert_called_once_with({'AAPL': end}, stage='rollup_5m')
+    stored = transformer.rollup_repo.insert_rollups.call_args.args[0]
+    assert stored[['open', 'high', 'low', 'close', 'count', 'sum', 'mean']].iloc[0].tolist() == [
+        1.0, 9.0, 0.5, 6.0, 50, 175.0, 3.5
+    ]
+
+def test_rollup_resolutions_must_align_with_windows():
+    """
+    Test that the first rollup resolution has to divide the downsampling windows and each level the next one.
+    """
+    config = {'downsampling_frequency': 10, 'symbols': ['AAPL']}
+    with pytest.raises(ValueError):
+        DataTransformer(dict(config, rollups={'enabled': True, 'resolutions': [4, 60]}))
+    with pytest.raises(ValueError):
+        DataTransformer(dict(config, rollups={'enabled': True, 'resolutions': [5, 12]}))
+    assert DataTransformer(dict(config, rollups={'enabled': True, 'resolutions': [5, 60]})).rollup_resolutions == [5, 60]
@@ -0,0 +1,124 @@
+# tests/ws_replay_server.py
+
+import base64
+import hashlib
+import socket
+import struct
+import threading
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+class ReplayWebSocketServer:
+    """
+    Minimal local WebSocket server that replays recorded text frames.
+
+    Each accepted connection plays the next entry of `sessions` (a list of frames). A connection
+    whose session is not the last one is dropped after its frames are sent, which forces the
+    client to reconnect. Subscribe requests received from the client are kept in `received`.
+    """
+
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.received = []
+        self.connections = 0
+        self._stop_event = threading.Event()
+        self._sockets = []
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen()
+        self.url = f"ws://127.0.0.1:{self._server.getsockname()[1]}/stream"
+
+    def __enter__(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        self._server.close()
+        for conn in self._sockets:
+            conn.close()
+
+    def _accept_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            session_index = self.connections
+            self.connections += 1
+            self._sockets.append(conn)
+            threading.Thread(target=self._serve, args=(conn, session_index), daemon=True).start()
+
+    def _serve(self, conn, session_index):
+        try:
+            self._handshake(conn)
+            self.received.append(self._recv_frame(conn)[1].decode())
+            frames = self.sessions[session_index] if session_index < len(self.sessions) else []
+            for frame in frames:
+                self._send_text(conn, frame)
+            if session_index < len(self.sessions) - 1:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+                return
+            # Keep the last session open and answer the client's close handshake
+            while True:
+                opcode, payload = self._recv_frame(conn)
+                if opcode == 0x8:
+                    conn.sendall(struct.pack('!BB', 0x88, len(payload)) + payload)
+                    conn.close()
+                    return
+        except OSError:
+            pass
+
+    def _handshake(self, conn):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                raise OSError("connection closed during handshake")
+            request += chunk
+        headers = {}
+        for line in request.decode().split('\r\n')[1:]:
+            if ': ' in line:
+                name, value = line.split(': ', 1)
+                headers[name.lower()] = value
+        accept = base64.b64encode(
+            hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()
+        ).decode()
+        conn.sendall((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+        ).encode())
+
+    def _recv_exact(self, conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise OSError("connection closed")
+            data += chunk
+        return data
+
+    def _recv_frame(self, conn):
+        first, second = self._recv_exact(conn, 2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._recv_exact(conn, 2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._recv_exact(conn, 8))[0]
+        mask = self._recv_exact(conn, 4) if second & 0x80 else b'\x00' * 4
+        payload = self._recv_exact(conn, length)
+        return first & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def _send_text(self, conn, text):
+        payload = text.encode()
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x81, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack('!BBH', 0x81, 126, len(payload))
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(payload))
+        conn.sendall(header + payload)
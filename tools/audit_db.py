@@ -1,76 +1,141 @@
+import argparse
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 from tabulate import tabulate
-from sqlalchemy import create_engine
+from sqlalchemy import text
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from database.compacted_raw_data_repository import raw_data_table
+from database.database import Database
+from database.stats_catalog import StatsCatalogRepository
 from utils.config_loader import ConfigLoader
 
-def main():
-    # Load configuration
-    config = ConfigLoader.load_config()
-    db_config = config['database']
+# Distinct symbols by skipping through the (symbol, timestamp) primary key, one index probe per symbol
+DISTINCT_SYMBOLS_QUERY = '''
+    WITH RECURSIVE symbols(symbol) AS (
+        SELECT MIN(symbol) FROM {table}
+        UNION ALL
+        SELECT (SELECT MIN(symbol) FROM {table} WHERE symbol > symbols.symbol)
+        FROM symbols WHERE symbols.symbol IS NOT NULL
+    )
+    SELECT symbol FROM symbols WHERE symbol IS NOT NULL
+'''
 
-    # Create SQLAlchemy engine
-    db_url = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@" \
-             f"{db_config['host']}:{db_config['port']}/{db_config['dbname']}"
-    engine = create_engine(db_url)
+def table_exists(engine, table):
+    if Database.is_sqlite():
+        query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = :table"
+    else:
+        query = "SELECT COUNT(*) FROM pg_class WHERE oid = to_regclass(:table)"
+    with engine.connect() as connection:
+        return connection.execute(text(query), {'table': table}).scalar() > 0
 
-    try:
-        # Fetch total count from raw_data
-        raw_total_count_query = "SELECT COUNT(*) FROM raw_data;"
-        raw_total_count = pd.read_sql_query(raw_total_count_query, engine).iloc[0, 0]
-        print(f"\nTotal records in raw_data: {raw_total_count}")
+def estimated_rows(engine, table):
+    ''' Row estimate of the planner statistics, None if the table was never analyzed '''
+    if Database.is_sqlite():
+        query = "SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = :table AND idx IS NOT NULL LIMIT 1"
+        with engine.connect() as connection:
+            has_stats = connection.execute(
+                text("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")).scalar()
+            return connection.execute(text(query), {'table': table}).scalar() if has_stats else None
+    with engine.connect() as connection:
+        # -1 until the first VACUUM or ANALYZE on PostgreSQL 14+
+        rows = connection.execute(
+            text("SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(:table)"), {'table': table}
+        ).scalar()
+    return rows if rows is not None and rows >= 0 else None
 
-        # Fetch counts per symbol from raw_data
-        raw_counts_query = "SELECT symbol, COUNT(*) as count FROM raw_data GROUP BY symbol;"
-        raw_counts_df = pd.read_sql_query(raw_counts_query, engine)
-        print("\n=== Raw Data Counts per Symbol ===")
-        print(tabulate(raw_counts_df, headers='keys', tablefmt='psql'))
+def table_bytes(engine, table):
+    if Database.is_sqlite():
+        return None
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT pg_total_relation_size(to_regclass(:table))"), {'table': table}).scalar()
 
-        # Fetch raw data sample
-        print("\n=== Raw Data Sample ===")
-        raw_sample_query = "SELECT * FROM raw_data ORDER BY timestamp DESC LIMIT 10;"
-        raw_sample_df = pd.read_sql_query(raw_sample_query, engine)
-        if not raw_sample_df.empty:
-            print(tabulate(raw_sample_df, headers='keys', tablefmt='psql'))
-        else:
-            print("No raw data found.")
+def symbol_stats(engine, table, symbol, exact):
+    ''' Count (if exact) and time range of one symbol, all within its slice of the primary key '''
+    count = 'COUNT(*)' if exact else 'NULL'
+    with engine.connect() as connection:
+        row = connection.execute(
+            text(f'SELECT {count}, MIN(timestamp), MAX(timestamp) FROM {table} WHERE symbol = :symbol'),
+            {'symbol': symbol}
+        ).fetchone()
+    return {'symbol': symbol, 'row_count': row[0], 'first_timestamp': row[1], 'last_timestamp': row[2]}
 
-        # Fetch total count from downsampled_data
-        down_total_count_query = "SELECT COUNT(*) FROM downsampled_data;"
-        down_total_count = pd.read_sql_query(down_total_count_query, engine).iloc[0, 0]
-        print(f"\nTotal records in downsampled_data: {down_total_count}")
+def scan_symbols(engine, table, symbols, exact, workers):
+    ''' Stats of every symbol, the per-symbol slices are read in parallel '''
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(lambda symbol: symbol_stats(engine, table, symbol, exact), symbols))
+    df = pd.DataFrame(rows, columns=['symbol', 'row_count', 'first_timestamp', 'last_timestamp'])
+    df = df[df['last_timestamp'].notna()].reset_index(drop=True)
+    for column in ('first_timestamp', 'last_timestamp'):
+        df[column] = pd.to_datetime(df[column], utc=True)
+    return df
 
-        # Fetch counts per symbol from downsampled_data
-        down_counts_query = "SELECT symbol, COUNT(*) as count FROM downsampled_data GROUP BY symbol;"
-        down_counts_df = pd.read_sql_query(down_counts_query, engine)
-        print("\n=== Downsampled Data Counts per Symbol ===")
-        print(tabulate(down_counts_df, headers='keys', tablefmt='psql'))
+def distinct_symbols(engine, table):
+    with engine.connect() as connection:
+        return [row[0] for row in connection.execute(text(DISTINCT_SYMBOLS_QUERY.format(table=table)))]
 
-        # Fetch downsampled data sample
-        print("\n=== Downsampled Data Sample ===")
-        down_sample_query = "SELECT * FROM downsampled_data ORDER BY timestamp DESC LIMIT 10;"
-        down_sample_df = pd.read_sql_query(down_sample_query, engine)
-        if not down_sample_df.empty:
-            print(tabulate(down_sample_df, headers='keys', tablefmt='psql'))
-        else:
-            print("No downsampled data found.")
+def table_report(engine, catalog, table, args, config):
+    ''' Return (source, total rows, per-symbol DataFrame) of a table '''
+    if args.exact:
+        df = scan_symbols(engine, table, distinct_symbols(engine, table), True, args.workers)
+        if args.refresh:
+            catalog.replace_stats(table, df)
+        return 'exact scan', int(df['row_count'].sum()), df
+    df = catalog.get_stats(table)
+    if not df.empty:
+        return 'stats catalog', int(df['row_count'].sum()), df
+    # Nothing recorded yet: planner estimate, and time ranges from one index probe per configured symbol
+    df = scan_symbols(engine, table, config['symbols'], False, args.workers)
+    return 'planner estimate', estimated_rows(engine, table), df
 
-        # Additional useful info: Time ranges
-        # Raw data time range
-        raw_time_range_query = "SELECT MIN(timestamp) AS start_time, MAX(timestamp) AS end_time FROM raw_data;"
-        raw_time_range_df = pd.read_sql_query(raw_time_range_query, engine)
-        print("\n=== Raw Data Time Range ===")
-        print(tabulate(raw_time_range_df, headers='keys', tablefmt='psql', showindex=False))
+def print_sample(engine, table, df, limit):
+    ''' Newest rows of the most recently written symbol, read backwards along its primary key '''
+    if df.empty or limit <= 0:
+        return
+    symbol = df.loc[df['last_timestamp'].idxmax(), 'symbol']
+    sample_df = pd.read_sql_query(
+        text(f'SELECT * FROM {table} WHERE symbol = :symbol ORDER BY timestamp DESC LIMIT :limit'),
+        engine, params={'symbol': symbol, 'limit': limit}
+    )
+    print(f"\n=== {table} Sample ({symbol}) ===")
+    print(tabulate(sample_df, headers='keys', tablefmt='psql', showindex=False))
 
-        # Downsampled data time range
-        down_time_range_query = "SELECT MIN(timestamp) AS start_time, MAX(timestamp) AS end_time FROM downsampled_data;"
-        down_time_range_df = pd.read_sql_query(down_time_range_query, engine)
-        print("\n=== Downsampled Data Time Range ===")
-        print(tabulate(down_time_range_df, headers='keys', tablefmt='psql', showindex=False))
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the stored data from the table_stats catalog.')
+    parser.add_argument('--exact', action='store_true',
+                        help='Count every symbol with index range scans instead of reading the catalog.')
+    parser.add_argument('--refresh', action='store_true', help='With --exact, store the exact counts in the catalog.')
+    parser.add_argument('--workers', type=int, default=4, help='Symbols scanned in parallel.')
+    parser.add_argument('--tables', nargs='+', help='Tables to audit, the raw table and downsampled_data by default.')
+    parser.add_argument('--sample', type=int, default=10, help='Rows of the newest symbol to show per table.')
+    args = parser.parse_args()
 
+    config = ConfigLoader.load_config()
+    engine = Database.get_engine()
+    try:
+        catalog = StatsCatalogRepository()
+        for table in args.tables or [raw_data_table(config), 'downsampled_data']:
+            if not table_exists(engine, table):
+                print(f"\n{table} does not exist.")
+                continue
+            source, total, df = table_report(engine, catalog, table, args, config)
+            print(f"\nTotal records in {table}: {total if total is not None else 'unknown'} ({source})")
+            size = table_bytes(engine, table)
+            if size is not None:
+                print(f"Total size of {table}: {size / 1024 ** 2:.1f} MiB")
+            print(f"\n=== {table} per Symbol ===")
+            print(tabulate(df, headers='keys', tablefmt='psql', showindex=False))
+            if not df.empty:
+                print(f"\n=== {table} Time Range ===")
+                print(tabulate(
+                    [[df['first_timestamp'].min(), df['last_timestamp'].max()]],
+                    headers=['start_time', 'end_time'], tablefmt='psql'
+                ))
+            print_sample(engine, table, df, args.sample)
     except Exception as e:
         print(f"Error fetching data: {e}")
     finally:
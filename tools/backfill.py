@@ -0,0 +1,42 @@
+# tools/backfill.py
+
+import argparse
+import json
+import sys
+import os
+
+# Adjust the Python path to include the parent directory
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ingestion.backfill import BackfillEngine
+from utils.config_loader import ConfigLoader
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill historical data from Binance.')
+    parser.add_argument('--start', required=True, help='Start of the period (inclusive), e.g. 2024-01-01.')
+    parser.add_argument('--end', required=True, help='End of the period (exclusive), e.g. 2024-04-01.')
+    parser.add_argument('--symbols', nargs='+', help='Symbols to backfill, defaults to the configured symbols.')
+    parser.add_argument('--source', choices=['klines', 'aggTrades'], help='Overrides backfill.source.')
+    parser.add_argument('--target', choices=['raw', 'downsampled'], help='Overrides backfill.target.')
+    parser.add_argument('--workers', type=int, help='Overrides backfill.workers.')
+    args = parser.parse_args()
+
+    # Load configuration
+    config = ConfigLoader.load_config()
+    backfill_config = dict(config.get('backfill', {}))
+    for key in ('source', 'target', 'workers'):
+        if getattr(args, key) is not None:
+            backfill_config[key] = getattr(args, key)
+    config['backfill'] = backfill_config
+
+    try:
+        engine = BackfillEngine(config)
+        report = engine.run(args.symbols or config['symbols'], args.start, args.end)
+        print(json.dumps(report, indent=2))
+        if report['failed_segments']:
+            print("Some segments failed, run the same command again to resume them.")
+    except Exception as e:
+        print(f"Error running backfill: {e}")
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,36 @@
 # tools/clear_db.py
 
 import argparse
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import sys
 import os
 
 # Adjust the Python path to include the parent directory
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.config_loader import ConfigLoader
+from database.database import Database
+from database.stats_catalog import StatsCatalogRepository
 
 def clear_tables(raw=False, downsampled=False):
-    # Load configuration
-    config = ConfigLoader.load_config()
-    db_config = config['database']
-
-    # Create SQLAlchemy engine
-    db_url = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@" \
-             f"{db_config['host']}:{db_config['port']}/{db_config['dbname']}"
-    engine = create_engine(db_url)
+    # The engine of the configured backend
+    engine = Database.get_engine()
+    # SQLite has no TRUNCATE
+    clear = "DELETE FROM {};" if Database.is_sqlite() else "TRUNCATE TABLE {} RESTART IDENTITY;"
 
     try:
         with engine.begin() as connection:
             if raw:
-                connection.execute(text("TRUNCATE TABLE raw_data RESTART IDENTITY;"))
+                connection.execute(text(clear.format('raw_data')))
                 print("raw_data table cleared.")
             if downsampled:
-                connection.execute(text("TRUNCATE TABLE downsampled_data RESTART IDENTITY;"))
+                connection.execute(text(clear.format('downsampled_data')))
                 print("downsampled_data table cleared.")
+        # The catalog would still count the removed rows
+        catalog = StatsCatalogRepository()
+        if raw:
+            catalog.reset('raw_data')
+        if downsampled:
+            catalog.reset('downsampled_data')
     except Exception as e:
         print(f"Error clearing tables: {e}")
     finally:
@@ -0,0 +1,37 @@
+# tools/cluster_status.py
+
+import sys
+import os
+from tabulate import tabulate
+
+# Adjust the Python path to include the parent directory
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database.cluster_repository import ClusterRepository
+from orchestrator.cluster import shard_of
+from utils.config_loader import ConfigLoader
+
+def main():
+    # Load configuration
+    config = ConfigLoader.load_config()
+    cluster_config = config.get('cluster', {})
+    shards = cluster_config.get('shards', 256)
+
+    try:
+        repository = ClusterRepository()
+        live = repository.live_nodes(cluster_config.get('lease_ttl', 30))
+        leases = {shard: node_id for shard, node_id, _ in repository.get_leases()}
+        rows = []
+        for node_id in sorted(set(leases.values()) | set(live)):
+            symbols = [symbol for symbol in config['symbols'] if leases.get(shard_of(symbol, shards)) == node_id]
+            rows.append([node_id, node_id in live, sum(1 for owner in leases.values() if owner == node_id),
+                         ' '.join(symbols)])
+        print(tabulate(rows, headers=['node', 'live', 'shards', 'symbols'], tablefmt='psql'))
+        unowned = [symbol for symbol in config['symbols'] if shard_of(symbol, shards) not in leases]
+        if unowned:
+            print(f"Symbols without an owner: {' '.join(unowned)}")
+    except Exception as e:
+        print(f"Error reading the cluster state: {e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# tools/find_gaps.py
+
+import argparse
+import json
+import sys
+import os
+
+from tabulate import tabulate
+
+# Adjust the Python path to include the parent directory
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.config_loader import ConfigLoader
+from utils.gap_detector import GapDetector
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan the raw data for gaps and list the recorded ones.')
+    parser.add_argument('--refill', action='store_true', help='Also refill the open gaps from Binance.')
+    parser.add_argument('--list-only', action='store_true', help='Only list the recorded gaps, do not scan.')
+    parser.add_argument('--status', choices=['open', 'filled', 'failed'], help='List gaps with this status only.')
+    parser.add_argument('--symbols', nargs='+', help='Symbols to scan, defaults to the configured symbols.')
+    args = parser.parse_args()
+
+    config = ConfigLoader.load_config()
+    if args.symbols:
+        config['symbols'] = args.symbols
+    config['gap_detection'] = dict(config.get('gap_detection', {}), refill=args.refill)
+
+    try:
+        detector = GapDetector(config)
+        if not args.list_only:
+            print(json.dumps(detector.run(), indent=2))
+        gaps = detector.gap_repo.get_gaps(config['symbols'], args.status)
+        print(tabulate(gaps, headers='keys', tablefmt='psql', showindex=False))
+    except Exception as e:
+        print(f"Error finding gaps: {e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# tools/migrate_raw_schema.py
+
+import argparse
+import sys
+import os
+import time
+from sqlalchemy import create_engine, text
+
+# Adjust the Python path to include the parent directory
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.config_loader import ConfigLoader
+
+NUMERIC_PATTERN = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+
+def add_price_column(connection):
+    connection.execute(text("ALTER TABLE raw_data ADD COLUMN IF NOT EXISTS price DOUBLE PRECISION;"))
+    connection.execute(text("ALTER TABLE raw_data ALTER COLUMN data DROP NOT NULL;"))
+    print("raw_data.price column is present.")
+
+def compress_payload(connection):
+    # lz4 TOAST compression is available from PostgreSQL 14
+    connection.execute(text("ALTER TABLE raw_data ALTER COLUMN data SET COMPRESSION lz4;"))
+    print("raw_data.data now uses lz4 compression for new values.")
+
+def backfill_prices(engine, batch_size, drop_payload):
+    """Fill price from the JSON payload in primary-key order, one batch per transaction."""
+    backfill_query = text(f'''
+        WITH batch AS (
+            SELECT symbol, timestamp
+            FROM raw_data
+            WHERE (symbol, timestamp) > (:last_symbol, :last_timestamp)
+            ORDER BY symbol, timestamp
+            LIMIT :batch_size
+        )
+        UPDATE raw_data rd
+        SET price = COALESCE(
+                rd.price,
+                CASE WHEN rd.data->>'price' ~ '{NUMERIC_PATTERN}'
+                     THEN (rd.data->>'price')::double precision END
+            ){", data = NULL" if drop_payload else ""}
+        FROM batch
+        WHERE rd.symbol = batch.symbol AND rd.timestamp = batch.timestamp
+        RETURNING rd.symbol, rd.timestamp
+    ''')
+    last_symbol, last_timestamp = '', '-infinity'
+    total = 0
+    start_time = time.perf_counter()
+    while True:
+        with engine.begin() as connection:
+            keys = connection.execute(backfill_query, {
+                'last_symbol': last_symbol,
+                'last_timestamp': last_timestamp,
+                'batch_size': batch_size
+            }).fetchall()
+        if not keys:
+            break
+        total += len(keys)
+        last_symbol, last_timestamp = max(keys)
+        print(f"Backfilled {total} rows (up to {last_symbol} {last_timestamp})")
+    elapsed = time.perf_counter() - start_time
+    print(f"Backfill finished: {total} rows in {elapsed:.1f}s.")
+    return total
+
+def report_storage(engine):
+    with engine.connect() as connection:
+        size = connection.execute(text(
+            "SELECT pg_size_pretty(pg_total_relation_size('raw_data'))"
+        )).scalar()
+        missing = connection.execute(text(
+            "SELECT COUNT(*) FROM raw_data WHERE price IS NULL"
+        )).scalar()
+    print(f"raw_data total size: {size}, rows without a numeric price: {missing}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate raw_data to the typed price column.')
+    parser.add_argument('--batch-size', type=int, default=50000, help='Rows updated per transaction.')
+    parser.add_argument('--drop-payload', action='store_true',
+                        help='Clear the JSON payload once its price has been copied.')
+    parser.add_argument('--compress-payload', action='store_true',
+                        help='Store the JSON payload with lz4 compression.')
+    args = parser.parse_args()
+
+    # Load configuration
+    config = ConfigLoader.load_config()
+    db_config = config['database']
+
+    # Create SQLAlchemy engine
+    db_url = f"postgresql+psycopg2://{db_config['user']}:{db_config['password']}@" \
+             f"{db_config['host']}:{db_config['port']}/{db_config['dbname']}"
+    engine = create_engine(db_url)
+
+    try:
+        with engine.begin() as connection:
+            add_price_column(connection)
+            if args.compress_payload:
+                compress_payload(connection)
+        backfill_prices(engine, args.batch_size, args.drop_payload)
+        if args.drop_payload:
+            print("Run VACUUM raw_data to reclaim the space of the dropped payloads.")
+        report_storage(engine)
+    except Exception as e:
+        print(f"Error migrating raw_data: {e}")
+    finally:
+        engine.dispose()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SKETCH_ACCURACY = 0.005
+
+# Partial states of a window that the aggregations are finished from
+STATES = ('count', 'sum', 'min', 'max', 'm2', 'median', 'sketch')
+# States that can be combined from the states of smaller windows, these are stored in aggregate_data
+MERGEABLE_STATES = ('count', 'sum', 'min', 'max', 'm2', 'sketch')
+
+PERCENTILE_PATTERN = re.compile(r'p(100|\d{1,2}(?:\.\d+)?)')
+
+
+class LogBucketSketch:
+    """A batch of mergeable quantile sketches, one per window.
+
+    Values are counted in logarithmic buckets: bucket k holds the values in
+    (gamma^(k-1), gamma^k] with gamma = (1 + accuracy) / (1 - accuracy), so
+    every quantile is returned within accuracy relative error, as in
+    DDSketch. Merging adds up the counts of equal buckets, so the sketches of
+    small windows combine into exactly the sketch of the larger window. The
+    buckets of all sketches are kept in flat keys and counts arrays with the
+    offsets of every sketch, and each operation is one NumPy pass over the
+    whole batch. Zero and negative values are counted in one bucket of value 0.
+    """
+
+    ZERO_KEY = np.iinfo(np.int32).min
+    BUCKET = np.dtype([('key', '<i4'), ('count', '<i8')])
+    HEADER = np.dtype('<f8')
+
+    def __init__(self, gamma, keys, counts, offsets):
+        self.gamma = gamma
+        self.keys = keys
+        self.counts = counts
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @staticmethod
+    def gamma_of(accuracy):
+        return (1 + accuracy) / (1 - accuracy)
+
+    @classmethod
+    def from_values(cls, values, offsets, accuracy):
+        """Sketch values[offsets[i]:offsets[i + 1]] into sketch i."""
+        gamma = cls.gamma_of(accuracy)
+        keys = np.full(len(values), cls.ZERO_KEY, dtype=np.int32)
+        positive = values > 0
+        keys[positive] = np.ceil(np.log(values[positive]) / math.log(gamma))
+        groups = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        return cls._collapse(gamma, groups, keys, np.ones(len(values), dtype=np.int64), len(offsets) - 1)
+
+    @classmethod
+    def _collapse(cls, gamma, groups, keys, counts, sketches):
+        """Sum the counts of equal (group, key) pairs, the groups become the sketches of the batch."""
+        order = np.lexsort((keys, groups))
+        groups, keys, counts = groups[order], keys[order], counts[order]
+        if len(keys):
+            change = np.ones(len(keys), dtype=bool)
+            change[1:] = (groups[1:] != groups[:-1]) | (keys[1:] != keys[:-1])
+            starts = np.flatnonzero(change)
+            groups, keys, counts = groups[starts], keys[starts], np.add.reduceat(counts, starts)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(groups, minlength=sketches))))
+        return cls(gamma, keys, counts, offsets)
+
+    def take(self, indices):
+        """Return the sketches at indices, in that order."""
+        lengths = np.diff(self.offsets)[indices]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # Position of every bucket in self, segment by segment
+        positions = np.repeat(self.offsets[:-1][indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return LogBucketSketch(self.gamma, self.keys[positions], self.counts[positions], offsets)
+
+    def merge(self, offsets):
+        """Merge sketches offsets[i] to offsets[i + 1] into sketch i of a new batch."""
+        sketch_groups = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        groups = np.repeat(sketch_groups, np.diff(self.offsets))
+        return self._collapse(self.gamma, groups, self.keys, self.counts, len(offsets) - 1)
+
+    def quantiles(self, q):
+        """Return the q quantile (0 to 1) of every sketch, NaN for empty ones.
+
+        This is the value of rank q * (n - 1) rounded down, within accuracy.
+        """
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+        before = cumulative[self.offsets[:-1]]
+        totals = cumulative[self.offsets[1:]] - before
+        # The bucket that holds the value of rank q * (n - 1) of each sketch
+        ranks = before + q * np.maximum(totals - 1, 0)
+        buckets = np.minimum(np.searchsorted(cumulative[1:], ranks, side='right'), max(len(self.keys) - 1, 0))
+        keys = self.keys[buckets] if len(self.keys) else np.zeros(len(self), dtype=np.int32)
+        values = 2 * np.power(self.gamma, keys.astype(np.float64)) / (self.gamma + 1)
+        values[keys == self.ZERO_KEY] = 0.0
+        values[totals == 0] = np.nan
+        return values
+
+    def to_bytes(self):
+        """Serialize every sketch: gamma, then its (key, count) buckets."""
+        header = np.array([self.gamma], dtype=self.HEADER).tobytes()
+        buckets = np.empty(len(self.keys), dtype=self.BUCKET)
+        buckets['key'], buckets['count'] = self.keys, self.counts
+        return [header + buckets[start:end].tobytes() for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    @classmethod
+    def from_bytes(cls, blobs, accuracy):
+        """Load sketches serialized by to_bytes, None is an empty sketch."""
+        gamma = cls.gamma_of(accuracy)
+        parts = []
+        for blob in blobs:
+            if blob is None:
+                parts.append(np.empty(0, dtype=cls.BUCKET))
+                continue
+            if np.frombuffer(blob, dtype=cls.HEADER, count=1)[0] != gamma:
+                raise ValueError("Stored sketches were built with another sketch_accuracy")
+            parts.append(np.frombuffer(blob, dtype=cls.BUCKET, offset=cls.HEADER.itemsize))
+        buckets = np.concatenate(parts) if parts else np.empty(0, dtype=cls.BUCKET)
+        offsets = np.concatenate(([0], np.cumsum([len(part) for part in parts], dtype=np.int64)))
+        return cls(gamma, buckets['key'].copy(), buckets['count'].copy(), offsets)
+
+
+class Aggregation:
+    """A named value of a window, computed from one or more partial states."""
+
+    def __init__(self, name, states, finish):
+        self.name = name
+        self.states = tuple(states)
+        self.finish = finish
+
+
+def _stddev(states):
+    counts = states['count'].astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Sample standard deviation like pandas, undefined for a single value
+        return np.where(counts > 1, np.sqrt(states['m2'] / (counts - 1)), np.nan)
+
+
+AGGREGATIONS = {}
+
+
+def register_aggregation(name, states, finish):
+    """Make an aggregation selectable in the aggregations section of config.yml."""
+    AGGREGATIONS[name] = Aggregation(name, states, finish)
+
+
+register_aggregation('count', ['count'], lambda states: states['count'])
+register_aggregation('sum', ['sum'], lambda states: states['sum'])
+register_aggregation('mean', ['count', 'sum'], lambda states: states['sum'] / states['count'])
+register_aggregation('min', ['min'], lambda states: states['min'])
+register_aggregation('max', ['max'], lambda states: states['max'])
+register_aggregation('stddev', ['count', 'sum', 'm2'], _stddev)
+# Exact, so it is not mergeable; use p50 for a median that is
+register_aggregation('median', ['median'], lambda states: states['median'])
+
+
+def get_aggregation(name):
+    """Return the registered aggregation, or a sketch percentile for names like p95 or p99.9."""
+    if name in AGGREGATIONS:
+        return AGGREGATIONS[name]
+    match = PERCENTILE_PATTERN.fullmatch(name)
+    if match is None:
+        raise ValueError(f"Unknown aggregation: {name}")
+    q = float(match.group(1)) / 100
+    return Aggregation(name, ['sketch'], lambda states: states['sketch'].quantiles(q))
+
+
+class AggregationSet:
+    """The aggregations of one output table, computed together from the states they need.
+
+    reduce() computes the states of windows from their values, merge()
+    combines the states of consecutive windows into larger windows, and
+    finish() turns states into the value of every aggregation. All of them
+    work on flat arrays with the offsets of each window.
+    """
+
+    def __init__(self, names, accuracy=DEFAULT_SKETCH_ACCURACY):
+        self.aggregations = [get_aggregation(name) for name in dict.fromkeys(names)]
+        self.accuracy = accuracy
+        needed = {state for aggregation in self.aggregations for state in aggregation.states}
+        self.states = [state for state in STATES if state in needed]
+
+    @property
+    def names(self):
+        return [aggregation.name for aggregation in self.aggregations]
+
+    @property
+    def mergeable(self):
+        return all(state in MERGEABLE_STATES for state in self.states)
+
+    def reduce(self, values, offsets):
+        """Return the states of the windows values[offsets[i]:offsets[i + 1]]."""
+        counts = np.diff(offsets)
+        starts = offsets[:-1]
+        if not len(values):
+            return self._empty_states()
+        states = {}
+        if 'count' in self.states:
+            states['count'] = counts
+        if 'sum' in self.states:
+            states['sum'] = np.add.reduceat(values, starts)
+        if 'min' in self.states:
+            states['min'] = np.minimum.reduceat(values, starts)
+        if 'max' in self.states:
+            states['max'] = np.maximum.reduceat(values, starts)
+        if 'm2' in self.states:
+            deviations = values - np.repeat(states['sum'] / counts, counts)
+            states['m2'] = np.add.reduceat(deviations * deviations, starts)
+        if 'median' in self.states:
+            # Sort by value within every window with one integer sort of (window, rank of the value)
+            ranks = np.empty(len(values), dtype=np.int64)
+            ranks[np.argsort(values)] = np.arange(len(values))
+            groups = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+            ordered = values[np.argsort(groups * len(values) + ranks)]
+            states['median'] = (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2
+        if 'sketch' in self.states:
+            states['sketch'] = LogBucketSketch.from_values(values, offsets, self.accuracy)
+        return states
+
+    def merge(self, states, offsets):
+        """Combine the states of windows offsets[i] to offsets[i + 1] into window i."""
+        if not self.mergeable:
+            raise ValueError(f"Aggregations {self.names} cannot be merged, use p50 instead of median")
+        if not len(offsets) > 1:
+            return self._empty_states()
+        starts = offsets[:-1]
+        merged = {}
+        for state in ('count', 'sum'):
+            if state in self.states:
+                merged[state] = np.add.reduceat(states[state], starts)
+        if 'min' in self.states:
+            merged['min'] = np.minimum.reduceat(states['min'], starts)
+        if 'max' in self.states:
+            merged['max'] = np.maximum.reduceat(states['max'], starts)
+        if 'm2' in self.states:
+            # Parallel variance: the spread within every part plus that of the part means around the total mean
+            means = states['sum'] / states['count']
+            offsets_from_mean = means - np.repeat(merged['sum'] / merged['count'], np.diff(offsets))
+            merged['m2'] = np.add.reduceat(states['m2'] + states['count'] * offsets_from_mean ** 2, starts)
+        if 'sketch' in self.states:
+            merged['sketch'] = states['sketch'].merge(offsets)
+        return merged
+
+    def finish(self, states):
+        """Return {name: values} of every aggregation."""
+        return {aggregation.name: aggregation.finish(states) for aggregation in self.aggregations}
+
+    def take(self, states, indices):
+        return {state: values.take(indices) if state == 'sketch' else values[indices]
+                for state, values in states.items()}
+
+    def _empty_states(self):
+        states = {state: np.empty(0, dtype=np.float64) for state in self.states}
+        if 'count' in states:
+            states['count'] = np.empty(0, dtype=np.int64)
+        if 'sketch' in states:
+            states['sketch'] = LogBucketSketch.from_values(np.empty(0), np.zeros(1, dtype=np.int64), self.accuracy)
+        return states
+
+
+def group_windows(symbols, timestamps, freq):
+    """Order rows by symbol and window of freq.
+
+    Returns the row order, the symbol and start of every window and the
+    offsets of the windows in the ordered rows.
+    """
+    windows = timestamps.dt.floor(freq)
+    window_values = windows.values.view(np.int64)
+    codes, uniques = pd.factorize(symbols.to_numpy(), sort=True)
+    order = np.lexsort((window_values, codes))
+    codes, window_values = codes[order], window_values[order]
+    change = np.ones(len(order), dtype=bool)
+    change[1:] = (codes[1:] != codes[:-1]) | (window_values[1:] != window_values[:-1])
+    starts = np.flatnonzero(change)
+    window_starts = pd.DatetimeIndex(window_values[starts].view('datetime64[ns]'))
+    if windows.dt.tz is not None:
+        window_starts = window_starts.tz_localize('UTC').tz_convert(windows.dt.tz)
+    return order, uniques[codes[starts]], window_starts, np.append(starts, len(order))
+
+
+def _windows_frame(symbols, window_starts, values):
+    df = pd.DataFrame({'symbol': symbols, 'timestamp': window_starts})
+    for name, column in values.items():
+        df[name] = column
+    return df
+
+
+def aggregate_windows(df, freq, aggregation_set, value_column='price'):
+    """Aggregate the values of df per symbol and window of freq.
+
+    Returns a DataFrame with symbol, timestamp and one column per
+    aggregation, and the states of its windows.
+    """
+    order, symbols, window_starts, offsets = group_windows(df['symbol'], df['timestamp'], freq)
+    states = aggregation_set.reduce(df[value_column].to_numpy(dtype=np.float64)[order], offsets)
+    return _windows_frame(symbols, window_starts, aggregation_set.finish(states)), states
+
+
+def merge_windows(df, states, freq, aggregation_set):
+    """Merge windows (symbol and timestamp of df, with their states) into windows of freq, like aggregate_windows."""
+    order, symbols, window_starts, offsets = group_windows(df['symbol'], df['timestamp'], freq)
+    merged = aggregation_set.merge(aggregation_set.take(states, order), offsets)
+    return _windows_frame(symbols, window_starts, aggregation_set.finish(merged)), merged
+
+
+def storage_frame(windows, states, names):
+    """Rows of aggregate_data: symbol, timestamp, the mergeable states and the values of names as JSON."""
+    frame = windows[['symbol', 'timestamp']].copy()
+    for state in MERGEABLE_STATES:
+        if state in states:
+            frame[state] = states[state].to_bytes() if state == 'sketch' else states[state]
+    values = windows[names].astype(object)
+    # JSON has no NaN
+    frame['aggregates'] = values.where(windows[names].notna(), None).to_dict(orient='records')
+    return frame
+
+
+def states_from_frame(df, aggregation_set):
+    """Load the states of aggregation_set from aggregate_data rows."""
+    states = {}
+    for state in aggregation_set.states:
+        if state == 'sketch':
+            states[state] = LogBucketSketch.from_bytes(df['sketch'].tolist(), aggregation_set.accuracy)
+        else:
+            states[state] = df[state].to_numpy(dtype=np.int64 if state == 'count' else np.float64)
+    return states
@@ -0,0 +1,173 @@
+import threading
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from database.aggregate_repository import AggregateRepository
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.raw_data_repository import parse_price
+from database.watermark_repository import WatermarkRepository
+from transformation.aggregations import AggregationSet, DEFAULT_SKETCH_ACCURACY, storage_frame
+from utils.logger import get_logger
+
+
+class _Bucket:
+    __slots__ = ('prices',)
+
+    def __init__(self):
+        self.prices = array('d')
+
+    def add(self, price):
+        self.prices.append(price)
+
+
+class StreamingDownsampler:
+    """Online downsampling stage fed directly by the ingestion path.
+
+    It is a raw data sink: every data point is appended to the prices of its
+    (symbol, window) bucket, and the closed buckets are aggregated together,
+    with the extra downsampled_data aggregations of the aggregations config.
+    It is then forwarded to the downstream raw sink, if there is one. flush()
+    writes every window that closed more than grace_seconds ago to
+    downsampled_data and frees its memory, so no transform ever re-reads
+    raw_data. Points that arrive for an already emitted window are counted in
+    late_points and dropped. The transform watermarks of all symbols follow the
+    emitted windows, as they would with the batch transformation.
+
+    Windows that are still open are never emitted, not even on stop, as
+    their stored row would only hold part of their points. For the same
+    reason the windows that were already open when the downsampler started
+    are not buffered either. Once they have closed, the recovery_transformer
+    downsamples them from raw data, starting at the watermark left by the
+    previous run, before any later window is emitted. Without one they are
+    skipped.
+    """
+
+    def __init__(self, config, downstream=None, downsampled_repo=None, watermark_repo=None, aggregate_repo=None,
+                 recovery_transformer=None, started_at=None):
+        self.config = config
+        self.bucket_seconds = config['downsampling_frequency'] * 60
+        stream_config = config.get('streaming_downsampling', {})
+        self.grace_seconds = stream_config.get('grace_seconds', 5)
+        self.downstream = downstream
+        self.downsampled_repo = downsampled_repo or DownsampledDataRepository()
+        self.watermark_repo = watermark_repo or WatermarkRepository()
+        aggregation_config = config.get('aggregations', {})
+        self.extras = list(aggregation_config.get('downsampled_data', []))
+        self.aggregations = AggregationSet(
+            ['mean', 'median'] + self.extras, aggregation_config.get('sketch_accuracy', DEFAULT_SKETCH_ACCURACY)
+        )
+        self.aggregate_repo = None
+        if self.extras:
+            self.aggregate_repo = aggregate_repo or AggregateRepository()
+        self.logger = get_logger(self.__class__.__name__)
+        self.late_points = 0
+        self.recovery_transformer = recovery_transformer
+        started_at = started_at if started_at is not None else datetime.now(timezone.utc)
+        # Start of the first window whose points all arrive here
+        self._complete_from = -int(-started_at.timestamp() // self.bucket_seconds) * self.bucket_seconds
+        self._recovered = False
+        self._buckets = {}
+        self._emitted_before = None
+        self._lock = threading.Lock()
+
+    def insert_raw_data(self, symbol, data, timestamp):
+        if self.downstream is not None:
+            self.downstream.insert_raw_data(symbol, data, timestamp)
+        price = parse_price(data)
+        if price is None:
+            self.logger.warning("Dropped data point for %s due to non-numeric price.", symbol)
+            return
+
+        epoch = timestamp.timestamp()
+        bucket_start = int(epoch // self.bucket_seconds) * self.bucket_seconds
+        if not self._recovered and bucket_start < self._complete_from:
+            # Left to the recovery transformer
+            return
+        with self._lock:
+            if self._emitted_before is not None and bucket_start < self._emitted_before:
+                self.late_points += 1
+                return
+            bucket = self._buckets.get((symbol, bucket_start))
+            if bucket is None:
+                bucket = self._buckets[(symbol, bucket_start)] = _Bucket()
+            bucket.add(price)
+
+    def flush(self, now=None):
+        """Emit the windows that closed more than grace_seconds ago to downsampled_data."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        cutoff = now.timestamp() - self.grace_seconds
+        # Only windows that ended before this point are emitted
+        emit_before = int(cutoff // self.bucket_seconds) * self.bucket_seconds
+        if not self._recovered:
+            # The watermark stays where the previous run left it until the open windows are recovered
+            if emit_before < self._complete_from:
+                return 0
+            if self.recovery_transformer is not None and not self._recover():
+                return 0
+            self._recovered = True
+        advanced = False
+        with self._lock:
+            closed = {key: bucket for key, bucket in self._buckets.items() if key[1] < emit_before}
+            for key in closed:
+                del self._buckets[key]
+            if self._emitted_before is None or emit_before > self._emitted_before:
+                self._emitted_before = emit_before
+                advanced = True
+
+        if not closed:
+            if advanced:
+                self._advance_watermarks(emit_before)
+            return 0
+        keys = sorted(closed)
+        prices = [np.frombuffer(closed[key].prices, dtype=np.float64) for key in keys]
+        offsets = np.concatenate(([0], np.cumsum([len(bucket_prices) for bucket_prices in prices])))
+        states = self.aggregations.reduce(np.concatenate(prices), offsets)
+        windows = pd.DataFrame({
+            'symbol': [symbol for symbol, _ in keys],
+            'timestamp': pd.to_datetime([bucket_start for _, bucket_start in keys], unit='s', utc=True),
+            **self.aggregations.finish(states)
+        })
+        df_downsampled = windows.rename(columns={'mean': 'avg_price', 'median': 'median_price'})
+        try:
+            self.downsampled_repo.insert_downsampled_data(
+                df_downsampled[['symbol', 'timestamp', 'avg_price', 'median_price']]
+            )
+            if self.extras:
+                self.aggregate_repo.insert_aggregates('downsampled_data', self.config['downsampling_frequency'],
+                                                      storage_frame(windows, states, self.extras))
+        except Exception:
+            # Keep the windows so the next flush retries them
+            with self._lock:
+                for key, bucket in closed.items():
+                    self._buckets.setdefault(key, bucket)
+            raise
+        if advanced:
+            self._advance_watermarks(emit_before)
+        self.logger.info("Emitted %d downsampled windows", len(windows))
+        return len(windows)
+
+    def _recover(self):
+        """Downsample the windows open at the start from raw data, return whether all symbols are done."""
+        until = pd.Timestamp(self._complete_from, unit='s', tz='UTC').to_pydatetime()
+        symbols = self.config.get('symbols', [])
+        self.recovery_transformer.transform_data(until=until)
+        watermarks = self.watermark_repo.get_watermarks(symbols)
+        behind = [symbol for symbol in symbols if watermarks.get(symbol) is None or watermarks[symbol] < until]
+        if behind:
+            # The transformer logs its own errors, try again on the next flush
+            self.logger.error("Recovering windows before %s failed for %d symbols", until, len(behind))
+            return False
+        self.logger.info("Recovered the windows before %s from raw data", until)
+        return True
+
+    def _advance_watermarks(self, emit_before):
+        watermark = pd.Timestamp(emit_before, unit='s', tz='UTC').to_pydatetime()
+        try:
+            self.watermark_repo.set_watermarks({symbol: watermark for symbol in self.config.get('symbols', [])})
+        except Exception as e:
+            # Only bookkeeping: the next advance writes a later watermark anyway
+            self.logger.error("Error updating transform watermarks: %s", e)
@@ -1,51 +1,248 @@
 import pandas as pd
 
-from database.raw_data_repository import RawDataRepository
+from database.aggregate_repository import AggregateRepository
+from database.compacted_raw_data_repository import create_raw_data_repository
 from database.downsampled_data_repository import DownsampledDataRepository
+from database.watermark_repository import WatermarkRepository
+from database.rollup_repository import RollupRepository, rollup_stage
+from transformation.aggregations import (
+    AggregationSet, DEFAULT_SKETCH_ACCURACY, aggregate_windows, merge_windows, states_from_frame, storage_frame
+)
 from utils.logger import get_logger
+from utils.metrics import histogram
+
+TRANSFORM_SECONDS = histogram('transform_seconds', 'Duration of transformation runs, per symbol in per_symbol mode '
+                              'and for all symbols at once in batch mode.', ['symbol'])
 
 class DataTransformer:
-    def __init__(self, config):
+    """Downsamples raw data into downsampled_data one closed window at a time.
+
+    Every symbol has a watermark in transform_watermark: the end of the last
+    window that was fully transformed. A run reads only the rows between the
+    watermark and the end of the latest window that closed more than
+    transform_grace_seconds ago, so open windows are never stored half-filled
+    and each run scans only the new rows.
+
+    When rollups are enabled, the same raw rows also produce the first level
+    of an OHLC pyramid in rollup_data. Every higher level is built from the
+    closed buckets of the level below it and has its own watermark.
+
+    The aggregations config adds aggregations of the registry to either
+    table, stored in aggregate_data together with their mergeable states.
+    Higher rollup levels merge the states of the level below, so their
+    percentiles come from merged sketches instead of the raw rows.
+    """
+
+    def __init__(self, config, raw_data_repo=None, downsampled_repo=None, watermark_repo=None, rollup_repo=None,
+                 aggregate_repo=None):
         self.config = config
         self.logger = get_logger(self.__class__.__name__)
-        self.raw_data_repo = RawDataRepository()
-        self.downsampled_repo = DownsampledDataRepository()
+        self.raw_data_repo = raw_data_repo or create_raw_data_repository(config)
+        self.downsampled_repo = downsampled_repo or DownsampledDataRepository()
+        self.watermark_repo = watermark_repo or WatermarkRepository()
+        self.grace_seconds = config.get('transform_grace_seconds', 30)
+        rollup_config = config.get('rollups', {})
+        self.rollup_resolutions = rollup_config.get('resolutions', []) if rollup_config.get('enabled', False) else []
+        # The first level is built from the raw rows of whole downsampling windows, so its buckets must not
+        # straddle a window end
+        if self.rollup_resolutions and config['downsampling_frequency'] % self.rollup_resolutions[0] != 0:
+            raise ValueError(f"Rollup resolution {self.rollup_resolutions[0]} does not divide "
+                             f"downsampling_frequency {config['downsampling_frequency']}")
+        for lower, upper in zip(self.rollup_resolutions, self.rollup_resolutions[1:]):
+            if upper % lower != 0:
+                raise ValueError(f"Rollup resolution {upper} is not a multiple of {lower}")
+        self.rollup_repo = None
+        if self.rollup_resolutions:
+            self.rollup_repo = rollup_repo or RollupRepository()
+        aggregation_config = config.get('aggregations', {})
+        accuracy = aggregation_config.get('sketch_accuracy', DEFAULT_SKETCH_ACCURACY)
+        self.downsampled_extras = list(aggregation_config.get('downsampled_data', []))
+        # avg_price and median_price are always stored
+        self.downsampled_aggregations = AggregationSet(['mean', 'median'] + self.downsampled_extras, accuracy)
+        self.rollup_aggregations = None
+        if self.rollup_resolutions and aggregation_config.get('rollup_data'):
+            self.rollup_aggregations = AggregationSet(aggregation_config['rollup_data'], accuracy)
+            if not self.rollup_aggregations.mergeable:
+                raise ValueError("Rollup aggregations are merged level by level, use p50 instead of median")
+        self.aggregate_repo = None
+        if self.downsampled_extras or self.rollup_aggregations:
+            self.aggregate_repo = aggregate_repo or AggregateRepository()
 
-    def transform_data(self):
+    def transform_data(self, now=None, until=None):
+        """Transform the windows between the watermarks and until, by default the latest closed window."""
+        if self.config.get('timescale', {}).get('enabled', False):
+            # downsampled_data is a continuous aggregate refreshed by TimescaleDB
+            self.logger.debug("Skipping data transformation, handled by TimescaleDB.")
+            return
         self.logger.info("Starting data transformation...")
-        for symbol in self.config['symbols']:
+        end = until if until is not None else self._closed_until(now)
+        try:
+            watermarks = self.watermark_repo.get_watermarks(self.config['symbols'])
+        except Exception as e:
+            self.logger.error("Error loading transform watermarks: %s", e)
+            return
+        if self.config.get('transform_mode', 'batch') == 'batch':
+            with TRANSFORM_SECONDS.labels('all').time():
+                self._transform_batch(watermarks, end)
+        else:
+            for symbol in self.config['symbols']:
+                try:
+                    with TRANSFORM_SECONDS.labels(symbol).time():
+                        df = self.raw_data_repo.fetch_unprocessed_data(symbol, watermarks.get(symbol), end)
+                        if not df.empty:
+                            self._store_windows(df.assign(symbol=symbol))
+                            self._store_base_rollups(df)
+                            self.logger.info("Transformed and stored data for %s", symbol)
+                        else:
+                            self.logger.info("No new data to transform for %s", symbol)
+                        self._set_watermarks({symbol: end})
+                except Exception as e:
+                    self.logger.error("Error transforming data for %s: %s", symbol, e)
+        if self.rollup_resolutions:
+            self._update_rollup_levels()
+
+    def _transform_batch(self, watermarks, end):
+        """Transform every symbol with one fetch, one groupby and one bulk insert."""
+        try:
+            df = self.raw_data_repo.fetch_unprocessed_data_all(self.config['symbols'], watermarks, end)
+            if not df.empty:
+                df_downsampled = self._store_windows(df)
+                self._store_base_rollups(df)
+                self.logger.info("Transformed and stored data for %d symbols",
+                                 df_downsampled['symbol'].nunique())
+            else:
+                self.logger.info("No new data to transform")
+            self._set_watermarks({symbol: end for symbol in self.config['symbols']})
+        except Exception as e:
+            self.logger.error("Error transforming data: %s", e)
+
+    def _set_watermarks(self, watermarks):
+        self.watermark_repo.set_watermarks(watermarks)
+        if self.rollup_resolutions:
+            # The first rollup level is built from the same raw rows
+            self.watermark_repo.set_watermarks(watermarks, stage=rollup_stage(self.rollup_resolutions[0]))
+
+    def _store_windows(self, df):
+        """Downsample raw rows, store the windows and their extra aggregations and return the windows."""
+        windows, states = self._aggregate_windows(df)
+        df_downsampled = self._downsampled_columns(windows)
+        self.downsampled_repo.insert_downsampled_data(df_downsampled)
+        if self.downsampled_extras:
+            self.aggregate_repo.insert_aggregates('downsampled_data', self.config['downsampling_frequency'],
+                                                  storage_frame(windows, states, self.downsampled_extras))
+        return df_downsampled
+
+    def _store_base_rollups(self, df):
+        if not self.rollup_resolutions:
+            return
+        resolution = self.rollup_resolutions[0]
+        df_rollups = self._rollup_raw(df, resolution)
+        if not df_rollups.empty:
+            self.rollup_repo.insert_rollups(df_rollups)
+        if self.rollup_aggregations:
+            df = df.assign(price=pd.to_numeric(df['price'], errors='coerce')).dropna(subset=['price'])
+            windows, states = aggregate_windows(df, f'{resolution}T', self.rollup_aggregations)
+            self.aggregate_repo.insert_aggregates('rollup_data', resolution,
+                                                  storage_frame(windows, states, self.rollup_aggregations.names))
+
+    def _merge_rollup_aggregates(self, lower, upper, starts, ends):
+        """Merge the stored states of lower level buckets into the buckets of the upper level."""
+        df = self.aggregate_repo.fetch_states_all('rollup_data', lower, list(ends), starts, ends)
+        if df.empty:
+            return
+        states = states_from_frame(df, self.rollup_aggregations)
+        windows, merged = merge_windows(df, states, f'{upper}T', self.rollup_aggregations)
+        self.aggregate_repo.insert_aggregates('rollup_data', upper,
+                                              storage_frame(windows, merged, self.rollup_aggregations.names))
+
+    def _update_rollup_levels(self):
+        """Build every higher rollup level from the closed buckets of the level below."""
+        symbols = self.config['symbols']
+        for lower, upper in zip(self.rollup_resolutions, self.rollup_resolutions[1:]):
             try:
-                df = self.raw_data_repo.fetch_unprocessed_data(symbol)
+                lower_watermarks = self.watermark_repo.get_watermarks(symbols, stage=rollup_stage(lower))
+                upper_watermarks = self.watermark_repo.get_watermarks(symbols, stage=rollup_stage(upper))
+                # An upper bucket is closed once the level below has passed its end
+                ends = {
+                    symbol: pd.Timestamp(watermark).floor(f'{upper}T').to_pydatetime()
+                    for symbol, watermark in lower_watermarks.items()
+                }
+                ends = {
+                    symbol: end for symbol, end in ends.items()
+                    if upper_watermarks.get(symbol) is None or end > upper_watermarks[symbol]
+                }
+                if not ends:
+                    continue
+                df = self.rollup_repo.fetch_rollups_all(lower, list(ends), upper_watermarks, ends)
                 if not df.empty:
-                    df_downsampled = self._downsample_data(df)
-                    self.downsampled_repo.insert_downsampled_data(df_downsampled)
-                    self.logger.info("Transformed and stored data for %s", symbol)
-                else:
-                    self.logger.info("No new data to transform for %s", symbol)
+                    self.rollup_repo.insert_rollups(self._rollup_level(df, upper))
+                if self.rollup_aggregations:
+                    self._merge_rollup_aggregates(lower, upper, upper_watermarks, ends)
+                self.watermark_repo.set_watermarks(ends, stage=rollup_stage(upper))
+                self.logger.info("Updated %d-minute rollups for %d symbols", upper, len(ends))
             except Exception as e:
-                self.logger.error("Error transforming data for %s: %s", symbol, e)
+                self.logger.error("Error updating %d-minute rollups: %s", upper, e)
+                # Higher levels depend on this one
+                return
 
-    def _downsample_data(self, df):
-        downsample_freq = f"{self.config['downsampling_frequency']}T"  # e.g., '1T' for 1 minute
+    def _rollup_raw(self, df, resolution):
+        """Aggregate raw rows into OHLC buckets of resolution minutes."""
+        df = df.assign(price=pd.to_numeric(df['price'], errors='coerce')).dropna(subset=['price'])
+        grouped = df.sort_values(['symbol', 'timestamp']).groupby(
+            ['symbol', pd.Grouper(key='timestamp', freq=f'{resolution}T', origin='epoch')]
+        )['price']
+        df_rollups = grouped.agg(open='first', high='max', low='min', close='last', count='count', sum='sum')
+        return self._finish_rollups(df_rollups, resolution)
+
+    def _rollup_level(self, df, resolution):
+        """Merge buckets of a lower level into buckets of resolution minutes."""
+        grouped = df.sort_values(['symbol', 'timestamp']).groupby(
+            ['symbol', pd.Grouper(key='timestamp', freq=f'{resolution}T', origin='epoch')]
+        )
+        df_rollups = grouped.agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+                                 close=('close', 'last'), count=('count', 'sum'), sum=('sum', 'sum'))
+        return self._finish_rollups(df_rollups, resolution)
+
+    @staticmethod
+    def _finish_rollups(df_rollups, resolution):
+        # Empty buckets created by the grouper have no price
+        df_rollups = df_rollups[df_rollups['count'] > 0].reset_index()
+        df_rollups['count'] = df_rollups['count'].astype('int64')
+        df_rollups['mean'] = df_rollups['sum'] / df_rollups['count']
+        df_rollups['resolution'] = resolution
+        return df_rollups[['symbol', 'resolution', 'timestamp', 'open', 'high', 'low', 'close', 'count', 'sum', 'mean']]
+
+    def _closed_until(self, now=None):
+        """Return the end of the latest window that closed more than grace_seconds before now."""
+        if now is None:
+            now = pd.Timestamp.now(tz='UTC')
+        cutoff = pd.Timestamp(now) - pd.Timedelta(seconds=self.grace_seconds)
+        return cutoff.floor(f"{self.config['downsampling_frequency']}T").to_pydatetime()
 
-        df['price'] = pd.to_numeric(df['price'], errors='coerce')
-        # Drop rows with NaN prices after conversion
+    def _aggregate_windows(self, df):
+        """Aggregate the prices of raw rows per symbol and window, return the windows and their states.
+
+        Windows are aligned to the epoch, which matches midnight as long as
+        downsampling_frequency divides a day evenly.
+        """
+        df = df.assign(price=pd.to_numeric(df['price'], errors='coerce'))
         initial_count = len(df)
         df = df.dropna(subset=['price'])
         dropped_count = initial_count - len(df)
         if dropped_count > 0:
             self.logger.warning("Dropped %d rows due to non-numeric prices.", dropped_count)
+        return aggregate_windows(df, f"{self.config['downsampling_frequency']}T", self.downsampled_aggregations)
 
-        df.set_index('timestamp', inplace=True)            
-        df_downsampled = df.resample(downsample_freq).agg({'price': ['mean', 'median']})
-
-        df_downsampled.columns = ['avg_price', 'median_price']
-        df_downsampled.dropna(inplace=True)
-
-        df_downsampled.reset_index(inplace=True)
-        # Assign 'symbol' column (assuming all rows in df have the same symbol)
-        df_downsampled['symbol'] = df['symbol'].iloc[0]
+    @staticmethod
+    def _downsampled_columns(windows):
+        df_downsampled = windows.rename(columns={'mean': 'avg_price', 'median': 'median_price'})
+        return df_downsampled[['symbol', 'timestamp', 'avg_price', 'median_price']]
 
-        df_downsampled = df_downsampled[['symbol', 'timestamp', 'avg_price', 'median_price']]
+    def _downsample_data(self, df):
+        """Downsample the rows of one symbol, all rows are taken to have the symbol of the first one."""
+        return self._downsample_all(df.assign(symbol=df['symbol'].iloc[0]))
 
-        return df_downsampled
+    def _downsample_all(self, df):
+        """Downsample rows of many symbols at once."""
+        windows, _ = self._aggregate_windows(df)
+        return self._downsampled_columns(windows)
@@ -7,7 +7,9 @@ class ConfigLoader:
         with open(config_file, 'r') as file:
             config = yaml.safe_load(file)
         # Override config with environment variables if they exist
-        db_config = config.get('database', {})
+        db_config = config.get('database') or {}
+        db_config['backend'] = os.environ.get('DATABASE_BACKEND', db_config.get('backend', 'postgresql'))
+        db_config['path'] = os.environ.get('DATABASE_PATH', db_config.get('path', 'data/binance.sqlite'))
         db_config['host'] = os.environ.get('DATABASE_HOST', db_config.get('host', 'localhost'))
         db_config['port'] = int(os.environ.get('DATABASE_PORT', db_config.get('port', 5432)))
         db_config['user'] = os.environ.get('DATABASE_USER', db_config.get('user', 'postgres'))
@@ -0,0 +1,155 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from database.compacted_raw_data_repository import create_raw_data_repository
+from database.gap_repository import GapRepository
+from database.watermark_repository import WatermarkRepository
+from utils.logger import get_logger
+from utils.metrics import counter
+
+GAP_STAGE = 'gap_scan'
+
+DATA_GAPS = counter('data_gaps', 'Pauses in the raw data points found by the gap detector.')
+GAP_REFILL_ROWS = counter('gap_refill_rows', 'Raw data points stored by gap refills.')
+
+
+def find_gaps(symbols, firsts, lasts, threshold_us):
+    """Find the pauses longer than threshold_us in the timestamps of many symbols at once.
+
+    firsts and lasts hold one int64 array of epoch microseconds per symbol,
+    the first and last timestamp of every stored row in ascending order. All
+    arrays are concatenated, so one diff covers every symbol; differences
+    across two symbols are masked out, and searchsorted maps the remaining
+    positions back to their symbol. Returns [{symbol, gap_start, gap_end}]
+    with the rows around each gap.
+    """
+    lengths = np.array([len(array) for array in firsts], dtype=np.int64)
+    if lengths.sum() < 2:
+        return []
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    starts = np.concatenate(firsts)
+    ends = np.concatenate(lasts)
+    pauses = starts[1:] - ends[:-1]
+    # Position i compares row i with row i + 1, which belongs to the next symbol if i + 1 is an offset
+    same_symbol = np.ones(len(pauses), dtype=bool)
+    boundaries = offsets[1:-1]
+    same_symbol[boundaries[(boundaries > 0) & (boundaries <= len(pauses))] - 1] = False
+    positions = np.flatnonzero((pauses > threshold_us) & same_symbol)
+    owners = np.searchsorted(offsets, positions, side='right') - 1
+    gap_starts = pd.to_datetime(ends[positions], unit='us', utc=True)
+    gap_ends = pd.to_datetime(starts[positions + 1], unit='us', utc=True)
+    return [
+        {'symbol': symbols[owner], 'gap_start': gap_start.to_pydatetime(), 'gap_end': gap_end.to_pydatetime()}
+        for owner, gap_start, gap_end in zip(owners, gap_starts, gap_ends)
+    ]
+
+
+class GapDetector:
+    """Finds pauses in the raw data points and refills them from Binance.
+
+    Every run reads the timestamps of each symbol from where the previous
+    run stopped (the gap_scan watermark, the last point it saw) up to
+    grace_seconds ago, lookback_hours back on the first run, on a pool of
+    workers. The reads only touch the (symbol, timestamp) primary key. A
+    pause between two points longer than max_gap_factor sampling intervals
+    (of the longest adaptive interval when adaptive sampling is enabled) is
+    stored in data_gaps. A pause at the end of the data is found once the
+    points resume.
+
+    With refill enabled, up to max_refills_per_run open gaps are loaded from
+    aggTrades (the last trade of every sampling interval) or klines by the
+    BackfillEngine, which also rewinds the transform watermarks to the start
+    of the window holding the gap, so the affected windows are downsampled
+    again from all of their rows. A gap that still fails after max_attempts
+    refills is marked failed.
+    """
+
+    def __init__(self, config, raw_data_repo=None, gap_repo=None, watermark_repo=None, backfill_engine=None):
+        self.config = config
+        gap_config = config.get('gap_detection', {})
+        interval = config['sampling_frequency']
+        adaptive_config = config.get('adaptive_sampling', {})
+        if adaptive_config.get('enabled', False):
+            interval = max(interval, adaptive_config.get('max_interval', 30 * interval))
+        self.threshold = timedelta(seconds=gap_config.get('max_gap_factor', 3) * interval)
+        self.lookback = timedelta(hours=gap_config.get('lookback_hours', 24))
+        self.grace = timedelta(seconds=gap_config.get('grace_seconds', 60))
+        self.workers = gap_config.get('workers', 4)
+        self.refill_enabled = gap_config.get('refill', True)
+        self.max_refills = gap_config.get('max_refills_per_run', 50)
+        self.max_attempts = gap_config.get('max_attempts', 3)
+        self.raw_data_repo = raw_data_repo or create_raw_data_repository(config)
+        self.gap_repo = gap_repo or GapRepository()
+        self.watermark_repo = watermark_repo or WatermarkRepository()
+        self.backfill_engine = backfill_engine
+        if self.refill_enabled and backfill_engine is None:
+            # Imported here, the backfill engine needs the Binance connector
+            from ingestion.backfill import BackfillEngine
+            # Refilled trades are put on the sampling grid, so they weigh like polled points in a window
+            backfill_config = dict(config.get('backfill', {}), target='raw',
+                                   source=gap_config.get('refill_source', 'aggTrades'),
+                                   sample_interval=config['sampling_frequency'])
+            self.backfill_engine = BackfillEngine(dict(config, backfill=backfill_config),
+                                                  raw_data_repo=self.raw_data_repo)
+        self.logger = get_logger(self.__class__.__name__)
+
+    def run(self, now=None):
+        """Scan for new gaps, refill open ones and return a report."""
+        report = self.scan(now)
+        if self.refill_enabled:
+            report.update(self.refill())
+        return report
+
+    def scan(self, now=None):
+        """Record the gaps since the previous scan of every symbol."""
+        start_time = time.perf_counter()
+        end = pd.Timestamp(now if now is not None else pd.Timestamp.now(tz='UTC')).to_pydatetime() - self.grace
+        symbols = list(self.config['symbols'])
+        watermarks = self.watermark_repo.get_watermarks(symbols, stage=GAP_STAGE)
+        starts = {symbol: watermarks.get(symbol, end - self.lookback) for symbol in symbols}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            spans = list(pool.map(
+                lambda symbol: self.raw_data_repo.fetch_timestamps(symbol, starts[symbol], end), symbols
+            ))
+        firsts, lasts = [span[0] for span in spans], [span[1] for span in spans]
+        gaps = find_gaps(symbols, firsts, lasts, int(self.threshold.total_seconds() * 1000000))
+        self.gap_repo.insert_gaps(gaps)
+        DATA_GAPS.inc(len(gaps))
+        # The last point seen is read again next time, so a gap across two scans is found
+        self.watermark_repo.set_watermarks({
+            symbol: pd.Timestamp(last[-1], unit='us', tz='UTC').to_pydatetime()
+            for symbol, last in zip(symbols, lasts) if len(last)
+        }, stage=GAP_STAGE)
+        report = {
+            'rows_scanned': int(sum(len(first) for first in firsts)),
+            'gaps_found': len(gaps),
+            'scan_seconds': time.perf_counter() - start_time,
+        }
+        self.logger.info("Scanned %d rows of %d symbols for gaps in %.2fs, found %d", report['rows_scanned'],
+                         len(symbols), report['scan_seconds'], report['gaps_found'])
+        return report
+
+    def refill(self):
+        """Load the points of open gaps from Binance."""
+        gaps = self.gap_repo.get_open_gaps(self.config['symbols'], self.max_refills, self.max_attempts)
+        filled = rows = 0
+        for symbol, gap_start, gap_end, attempts in gaps:
+            before = dict(self.backfill_engine.stats)
+            try:
+                # Strictly between the two stored points
+                self.backfill_engine.run([symbol], gap_start + timedelta(milliseconds=1), gap_end)
+                failed = self.backfill_engine.stats['failed_segments'] > before['failed_segments']
+            except Exception as e:
+                self.logger.error("Error refilling the gap of %s from %s: %s", symbol, gap_start, e)
+                failed = True
+            gap_rows = self.backfill_engine.stats['rows'] - before['rows']
+            status = 'filled' if not failed else ('failed' if attempts + 1 >= self.max_attempts else 'open')
+            self.gap_repo.record_refill(symbol, gap_start, status, gap_rows)
+            GAP_REFILL_ROWS.inc(gap_rows)
+            filled += status == 'filled'
+            rows += gap_rows
+        return {'gaps_refilled': filled, 'refill_rows': rows}
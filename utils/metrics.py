@@ -0,0 +1,290 @@
+import bisect
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.logger import get_logger
+
+# Upper bounds in seconds, from sub-millisecond DB calls to slow transformations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """Holds every metric of the process and renders them in the Prometheus text format.
+
+    Metrics are always registered, but only record anything while enabled is
+    set, so a disabled registry costs one attribute check per call.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered differently")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @property
+    def sample_name(self):
+        return self.name
+
+    def render(self):
+        name = self.sample_name
+        lines = [f'# HELP {name} {self.documentation}', f'# TYPE {name} {self.type}']
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(child.render(name, self._label_pairs(values)))
+        return lines
+
+    def _label_pairs(self, values):
+        return [
+            (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in zip(self.labelnames, values)
+        ]
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if not REGISTRY.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, pairs):
+        return [f'{name}{_format_labels(pairs)} {self.value}']
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    @property
+    def sample_name(self):
+        return f'{self.name}_total'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        if not REGISTRY.enabled:
+            return
+        self.value = value
+
+    def render(self, name, pairs):
+        return [f'{name}{_format_labels(pairs)} {self.value}']
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not REGISTRY.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager that observes the seconds spent in its block."""
+        if not REGISTRY.enabled:
+            return NULL_TIMER
+        return _Timer(self)
+
+    def render(self, name, pairs):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(pairs + [("le", str(bound))])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(pairs)} {total}')
+        lines.append(f'{name}_count{_format_labels(pairs)} {cumulative}')
+        return lines
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Metrics shared by several modules
+HTTP_REQUEST_SECONDS = histogram('http_request_seconds', 'Latency of Binance REST requests.', ['endpoint'])
+HTTP_RESPONSES = counter('http_responses', 'Binance REST responses by status code.', ['endpoint', 'status'])
+DB_ROUND_TRIP_SECONDS = histogram('db_round_trip_seconds', 'Duration of repository calls.',
+                                  ['repository', 'method'])
+ROWS_WRITTEN = counter('rows_written', 'Rows written to the database.', ['table'])
+SCHEDULER_TICK_LAG_SECONDS = histogram('scheduler_tick_lag_seconds', 'Delay between the scheduled and actual start '
+                                       'of a job run.', ['job'])
+SCHEDULER_MISSED_RUNS = counter('scheduler_missed_runs', 'Job runs that were skipped or missed.', ['job'])
+
+
+def timed_method(histogram_metric=DB_ROUND_TRIP_SECONDS):
+    """Decorator observing the duration of a method, labelled with its class and method name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not REGISTRY.enabled:
+                return func(self, *args, **kwargs)
+            with histogram_metric.labels(self.__class__.__name__, func.__name__).time():
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """Serve /metrics on a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True)
+    thread.start()
+    return server
+
+
+def configure_metrics(config):
+    """Enable recording and start the HTTP endpoint if the metrics section asks for it."""
+    metrics_config = config.get('metrics', {})
+    REGISTRY.enabled = metrics_config.get('enabled', False)
+    if not REGISTRY.enabled:
+        return None
+    server = start_metrics_server(metrics_config.get('port', 9108), metrics_config.get('host', '0.0.0.0'))
+    get_logger('Metrics').info("Serving metrics on port %d", server.server_address[1])
+    return server
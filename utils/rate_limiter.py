@@ -1,27 +1,259 @@
+import asyncio
+import fcntl
+import math
+import mmap
+import os
+import re
+import struct
 import threading
 import time
 
-class RateLimiter:
-    def __init__(self, max_calls_per_second):
-        self.capacity = max_calls_per_second
-        self.tokens = self.capacity
-        self.fill_rate = self.capacity
-        self.lock = threading.Lock()
-        self.last_check = time.monotonic()
+from utils.metrics import counter, histogram
+
+RATE_LIMITER_WAIT_SECONDS = histogram('rate_limiter_wait_seconds', 'Time callers waited for a rate limiter permit.')
+RATE_LIMITER_BACKOFFS = counter('rate_limiter_backoffs', 'Backoffs after 429 or 418 responses.')
+
+# Request weights of the REST endpoints used by the pipeline, from the Binance API docs
+ENDPOINT_WEIGHTS = {
+    '/api/v3/klines': 2,
+    '/api/v3/aggTrades': 4,
+    '/api/v3/exchangeInfo': 20,
+}
+
+HEADER_PATTERN = re.compile(r'x-mbx-(used-weight|order-count)-(\d+)([smhd])$')
+HEADER_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+HEADER_TYPES = {'used-weight': 'weight', 'order-count': 'orders'}
+
+# next_ticket, backoff_until, consecutive failures
+STATE_HEADER = struct.Struct('<ddq')
+# window index, used budget
+WINDOW_SLOT = struct.Struct('<qd')
+# Future windows a window can hold reservations for
+WINDOW_SLOTS = 64
+
+
+def request_weight(path, params=None):
+    """Weight of one request to a REST endpoint."""
+    if path == '/api/v3/ticker/price':
+        # One symbol weighs 2, a symbols list or all symbols 4
+        return 2 if params and 'symbol' in params else 4
+    return ENDPOINT_WEIGHTS.get(path, 1)
+
+
+class RateWindow:
+    """A fixed window of interval seconds in which at most limit units may be used.
+
+    type is 'weight' (request weight), 'orders' (orders placed) or 'requests'
+    (one per request).
+    """
+
+    def __init__(self, type, limit, interval):
+        if type not in ('weight', 'orders', 'requests'):
+            raise ValueError(f"Unknown rate limit type: {type}")
+        self.type = type
+        self.limit = limit
+        self.interval = interval
+
+    def __repr__(self):
+        return f"RateWindow({self.type!r}, {self.limit}, {self.interval})"
+
+
+class WeightedRateLimiter:
+    """Shares the Binance request weight and order budgets between threads and processes.
+
+    Every window is aligned to the wall clock like the Binance counters. A
+    caller books its cost in the first windows that still have room, no
+    earlier than the previous caller (so permits are handed out in arrival
+    order), and then sleeps outside of any lock until its permit is due.
+    Responses resync the windows from the X-MBX-USED-WEIGHT-* and
+    X-MBX-ORDER-COUNT-* headers, and a 429 or 418 pauses every caller for
+    Retry-After seconds, or an exponential backoff if the header is missing.
+
+    With shared_memory, the budget lives in a memory-mapped file guarded by a
+    file lock, so all processes opening the same path stay under the limits
+    together. They must use the same windows.
+    """
+
+    def __init__(self, windows, headroom=1.0, shared_memory=None, backoff=1.0, max_backoff=300.0):
+        self.windows = list(windows)
+        self.limits = [max(int(window.limit * headroom), 1) for window in self.windows]
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {'permits': 0, 'waited_seconds': 0.0, 'backoffs': 0}
+        self._lock = threading.Lock()
+        self._file = None
+        size = STATE_HEADER.size + len(self.windows) * WINDOW_SLOTS * WINDOW_SLOT.size
+        if shared_memory:
+            self._file = os.open(shared_memory, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._file).st_size < size:
+                    os.ftruncate(self._file, size)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._state = mmap.mmap(self._file, size)
+        else:
+            self._state = bytearray(size)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build the limiter of the rate_limits config section.
+
+        api_rate_limit stays a limit on requests per second.
+        """
+        limits_config = config.get('rate_limits', {})
+        windows = [RateWindow('requests', config['api_rate_limit'], 1)]
+        if limits_config.get('request_weight_per_minute'):
+            windows.append(RateWindow('weight', limits_config['request_weight_per_minute'], 60))
+        if limits_config.get('orders_per_second'):
+            windows.append(RateWindow('orders', limits_config['orders_per_second'], 1))
+        return cls(windows, headroom=limits_config.get('headroom', 1.0),
+                   shared_memory=limits_config.get('shared_memory') or None,
+                   backoff=limits_config.get('backoff', 1.0), max_backoff=limits_config.get('max_backoff', 300.0))
+
+    def reserve(self, weight=1, orders=0):
+        """Book a permit and return how many seconds until it may be used."""
+        costs = [self._cost(window, weight, orders) for window in self.windows]
+        for cost, limit, window in zip(costs, self.limits, self.windows):
+            if cost > limit:
+                raise ValueError(f"A cost of {cost} never fits {window}")
+        with self._locked():
+            now = time.time()
+            next_ticket, backoff_until, failures = STATE_HEADER.unpack_from(self._state, 0)
+            due = max(now, next_ticket, backoff_until)
+            moved = True
+            while moved:
+                moved = False
+                for position, (window, cost, limit) in enumerate(zip(self.windows, costs, self.limits)):
+                    index = math.floor(due / window.interval)
+                    if cost and self._used(position, index) + cost > limit:
+                        # Wait for the next window
+                        due = (index + 1) * window.interval + 1e-6
+                        moved = True
+            for position, (window, cost) in enumerate(zip(self.windows, costs)):
+                if cost:
+                    index = math.floor(due / window.interval)
+                    self._set_used(position, index, self._used(position, index) + cost)
+            STATE_HEADER.pack_into(self._state, 0, due, backoff_until, failures)
+        return due - now
+
+    def acquire(self, weight=1, orders=0):
+        delay = self.reserve(weight, orders)
+        waited = 0.0
+        while delay > 0:
+            time.sleep(delay)
+            waited += delay
+            # A 429 received in the meantime pauses permits that were already granted
+            delay = self._backoff_remaining()
+        self._count(waited)
+
+    async def acquire_async(self, weight=1, orders=0):
+        delay = self.reserve(weight, orders)
+        waited = 0.0
+        while delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+            delay = self._backoff_remaining()
+        self._count(waited)
+
+    def record_response(self, status, headers=None):
+        """Resync from the headers of a response and back off on 429 and 418."""
+        with self._locked():
+            now = time.time()
+            for key, value in (headers or {}).items():
+                match = HEADER_PATTERN.match(key.lower())
+                if match is None:
+                    continue
+                kind, interval = HEADER_TYPES[match.group(1)], int(match.group(2)) * HEADER_UNITS[match.group(3)]
+                for position, window in enumerate(self.windows):
+                    if window.type == kind and window.interval == interval:
+                        index = math.floor(now / interval)
+                        # The server also counts other clients on this IP
+                        self._set_used(position, index, max(self._used(position, index), float(value)))
+            next_ticket, backoff_until, failures = STATE_HEADER.unpack_from(self._state, 0)
+            if status in (418, 429):
+                retry_after = self._retry_after(headers)
+                if retry_after is None:
+                    retry_after = min(self.backoff * 2 ** failures, self.max_backoff)
+                backoff_until = max(backoff_until, now + retry_after)
+                failures += 1
+                self.stats['backoffs'] += 1
+                RATE_LIMITER_BACKOFFS.inc()
+            elif status < 400:
+                failures = 0
+            STATE_HEADER.pack_into(self._state, 0, next_ticket, backoff_until, failures)
+
+    def close(self):
+        if self._file is not None:
+            self._state.close()
+            os.close(self._file)
+            self._file = None
 
     def __enter__(self):
-        with self.lock:
-            current = time.monotonic()
-            elapsed = current - self.last_check
-            self.last_check = current
-            self.tokens += elapsed * self.fill_rate
-            self.tokens = min(self.tokens, self.capacity)
-            if self.tokens < 1:
-                time_to_wait = (1 - self.tokens) / self.fill_rate
-                time.sleep(time_to_wait)
-                self.tokens = 0
-            else:
-                self.tokens -= 1
+        self.acquire()
 
     def __exit__(self, exc_type, exc_value, traceback):
         pass
+
+    async def __aenter__(self):
+        await self.acquire_async()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+    @staticmethod
+    def _cost(window, weight, orders):
+        if window.type == 'weight':
+            return weight
+        if window.type == 'orders':
+            return orders
+        return 1
+
+    @staticmethod
+    def _retry_after(headers):
+        for key, value in (headers or {}).items():
+            if key.lower() == 'retry-after':
+                return float(value)
+        return None
+
+    def _backoff_remaining(self):
+        with self._locked():
+            _, backoff_until, _ = STATE_HEADER.unpack_from(self._state, 0)
+        return backoff_until - time.time()
+
+    def _count(self, waited):
+        RATE_LIMITER_WAIT_SECONDS.observe(waited)
+        with self._lock:
+            self.stats['permits'] += 1
+            self.stats['waited_seconds'] += waited
+
+    def _offset(self, position, index):
+        return STATE_HEADER.size + (position * WINDOW_SLOTS + index % WINDOW_SLOTS) * WINDOW_SLOT.size
+
+    def _used(self, position, index):
+        stored_index, used = WINDOW_SLOT.unpack_from(self._state, self._offset(position, index))
+        return used if stored_index == index else 0.0
+
+    def _set_used(self, position, index, used):
+        WINDOW_SLOT.pack_into(self._state, self._offset(position, index), index, used)
+
+    def _locked(self):
+        return _StateLock(self._lock, self._file)
+
+
+class _StateLock:
+    """Holds the thread lock and, in shared memory mode, the file lock."""
+
+    def __init__(self, lock, file):
+        self.lock = lock
+        self.file = file
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.lock.release()
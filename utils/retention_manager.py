@@ -0,0 +1,113 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from archive.parquet_archive import archive_stage, archive_tables
+from database.downsampled_data_repository import DownsampledDataRepository
+from database.compacted_raw_data_repository import create_raw_data_repository, raw_data_table
+from database.stats_catalog import STATS_COLLECTOR
+from database.watermark_repository import WatermarkRepository
+from utils.logger import get_logger
+
+class RetentionManager:
+    """Removes raw data points that are older than raw_data_ttl_hours.
+
+    With TimescaleDB, whole raw_data chunks are dropped. Otherwise rows are
+    deleted per symbol in primary-key ordered batches until time_budget
+    seconds are spent; the next run continues where this one stopped. A row
+    is only deleted once the transformation has passed it: the cutoff of a
+    symbol is never later than its transform watermark, and symbols without
+    a watermark are left alone. When the archive is enabled, rows are also
+    kept until the day they belong to has been archived.
+
+    Downsampled windows are only removed if downsampled_data_ttl_days is set
+    and downsampled_data is archived, under the same rules.
+    """
+
+    def __init__(self, config, raw_data_repo=None, watermark_repo=None, timescale_backend=None,
+                 downsampled_repo=None):
+        self.config = config
+        retention_config = config.get('retention', {})
+        self.ttl = timedelta(hours=retention_config.get('raw_data_ttl_hours', 24))
+        downsampled_ttl_days = retention_config.get('downsampled_data_ttl_days', 0)
+        self.downsampled_ttl = timedelta(days=downsampled_ttl_days) if downsampled_ttl_days else None
+        self.batch_size = retention_config.get('batch_size', 10000)
+        self.time_budget = retention_config.get('time_budget', 60)
+        archive_config = config.get('archive', {})
+        self.raw_table = raw_data_table(config)
+        self.archived_tables = archive_tables(config) if archive_config.get('enabled', False) else []
+        self.raw_data_repo = raw_data_repo or create_raw_data_repository(config)
+        self.timescale_backend = timescale_backend
+        self.downsampled_repo = None
+        if self.downsampled_ttl is not None:
+            if 'downsampled_data' not in self.archived_tables or timescale_backend is not None:
+                # Windows that are not archived would be lost for good
+                self.downsampled_ttl = None
+            else:
+                self.downsampled_repo = downsampled_repo or DownsampledDataRepository()
+        self.watermark_repo = None
+        if timescale_backend is None or self.archived_tables:
+            self.watermark_repo = watermark_repo or WatermarkRepository()
+        self.logger = get_logger(self.__class__.__name__)
+
+    def apply(self, now=None):
+        """Delete expired data and return a report of what was reclaimed."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        cutoff = now - self.ttl
+        start_time = time.perf_counter()
+        if self.timescale_backend is not None:
+            report = self._drop_chunks(cutoff)
+        else:
+            cutoffs = self._symbol_cutoffs(cutoff, self.raw_table)
+            rows, complete = self._delete_batches(self.raw_data_repo.delete_raw_data_before, cutoffs, start_time)
+            report = {'rows_deleted': rows, 'complete': complete}
+        if self.downsampled_ttl is not None and report['complete']:
+            cutoffs = self._symbol_cutoffs(now - self.downsampled_ttl, 'downsampled_data')
+            rows, complete = self._delete_batches(self.downsampled_repo.delete_downsampled_data_before,
+                                                  cutoffs, start_time)
+            report['downsampled_rows_deleted'] = rows
+            report['complete'] = complete
+        report['seconds'] = time.perf_counter() - start_time
+        self.logger.info("Retention reclaimed %d raw rows in %.2fs%s", report['rows_deleted'],
+                         report['seconds'], '' if report['complete'] else ' (time budget exhausted)')
+        return report
+
+    def _drop_chunks(self, cutoff):
+        if 'raw_data' in self.archived_tables:
+            archived = self.watermark_repo.get_watermarks(self.config['symbols'], stage=archive_stage('raw_data'))
+            if len(archived) < len(self.config['symbols']):
+                self.logger.info("Keeping raw_data chunks, some symbols have not been archived yet.")
+                return {'rows_deleted': 0, 'chunks_dropped': 0, 'complete': True}
+            cutoff = min([cutoff] + list(archived.values()))
+        chunks, rows, dropped_before = self.timescale_backend.drop_raw_chunks(cutoff)
+        if chunks:
+            # The rows per symbol are not known, the catalog estimates them from the dropped range
+            STATS_COLLECTOR.record_drop('raw_data', dropped_before)
+        return {'rows_deleted': rows, 'chunks_dropped': chunks, 'complete': True}
+
+    def _symbol_cutoffs(self, cutoff, table):
+        """Return {symbol: cutoff} limited by the transform and archive watermarks."""
+        symbols = self.config['symbols']
+        limits = [self.watermark_repo.get_watermarks(symbols)]
+        if table in self.archived_tables:
+            limits.append(self.watermark_repo.get_watermarks(symbols, stage=archive_stage(table)))
+        cutoffs = {}
+        for symbol in symbols:
+            watermarks = [limit.get(symbol) for limit in limits]
+            if None in watermarks:
+                self.logger.debug("Keeping %s of %s, it has not been transformed or archived yet.", table, symbol)
+                continue
+            cutoffs[symbol] = min([cutoff] + watermarks)
+        return cutoffs
+
+    def _delete_batches(self, delete, cutoffs, start_time):
+        rows_deleted = 0
+        for symbol, symbol_cutoff in cutoffs.items():
+            while True:
+                if time.perf_counter() - start_time >= self.time_budget:
+                    return rows_deleted, False
+                deleted = delete(symbol, symbol_cutoff, self.batch_size)
+                rows_deleted += deleted
+                if deleted < self.batch_size:
+                    break
+        return rows_deleted, True
@@ -2,18 +2,57 @@ import threading
 from database.state_repository import StateRepository
 
 class StateManager:
-    def __init__(self):
+    """Keeps the collected points of every symbol in memory.
+
+    Counters are restored from ingestion_state on startup, updated in memory
+    and written back in one batched upsert by checkpoint(). One lock guards
+    both the counters and the set of symbols changed since the last
+    checkpoint, so an update never slips between the two.
+    """
+
+    def __init__(self, repository=None):
         self.lock = threading.Lock()
-        self.repository = StateRepository()
+        self.repository = repository or StateRepository()
+        self._collected_points = {}
+        self._dirty = set()
+        self.load()
 
-    def get_collected_points(self, symbol):
+    def load(self):
+        """Merge the persisted counters into the live ones."""
+        collected_points = self.repository.load_collected_points()
         with self.lock:
-            return self.repository.get_collected_points(symbol)
+            # Counters only grow between resets, so the larger one is current: the persisted count of a
+            # symbol taken over from another node, or the live count with updates not checkpointed yet
+            for symbol, points in collected_points.items():
+                self._collected_points[symbol] = max(self._collected_points.get(symbol, 0), points)
+
+    def get_collected_points(self, symbol):
+        return self._collected_points.get(symbol, 0)
 
     def update_collected_points(self, symbol):
         with self.lock:
-            return self.repository.update_collected_points(symbol)
+            collected_points = self._collected_points.get(symbol, 0) + 1
+            self._collected_points[symbol] = collected_points
+            self._dirty.add(symbol)
+        return collected_points
+
+    def checkpoint(self):
+        """Persist the counters that changed since the last checkpoint."""
+        with self.lock:
+            dirty, self._dirty = self._dirty, set()
+            collected_points = {symbol: self._collected_points.get(symbol, 0) for symbol in dirty}
+        if not dirty:
+            return 0
+        try:
+            self.repository.save_collected_points(collected_points)
+        except Exception:
+            with self.lock:
+                self._dirty |= dirty
+            raise
+        return len(collected_points)
 
     def reset_state(self):
         with self.lock:
-            self.repository.reset_state()
\ No newline at end of file
+            self._collected_points = {}
+            self._dirty = set()
+            self.repository.reset_state()